@@ -4,35 +4,66 @@ Analysis and optimization module for network consolidation.
 Handles multi-threshold analysis, Pareto frontier computation, and scoring.
 """
 
+import bisect
 import ipaddress
-from typing import List, Dict, Tuple
-from core_consolidation import consolidate_with_bias
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import List, Dict, Optional, Tuple
+from core_consolidation import (
+	ADDRESS_BITS, CLIMB_FLOOR, HostIndex, HostInput, Interval, IPNetwork, ProgressCallback, consolidate_to_budget,
+	consolidate_with_bias, consolidate_with_bias_sweep, count_hosts, host_interval, merge_intervals, range_to_cidrs, to_intervals,
+)
+import metrics
+from roaring import RoaringBitmap
 
-def analyze_consolidation(host_ips: List[str], threshold: int) -> Dict:
-	"""Analyze consolidation with a given threshold and return summary stats."""
-	collapsed_networks = consolidate_with_bias(host_ips, max_missing_percent=threshold)
+DEFAULT_THRESHOLDS = [0, 10, 20, 25, 30, 35, 40, 45, 50]
+
+def analyze_consolidation(host_ips: List[HostInput], threshold: int, version: int = 4) -> Dict:
+	"""
+	Analyze consolidation with a given threshold and return summary stats.
 	
-	original_ip_set = set(ipaddress.IPv4Address(ip) for ip in host_ips)
-	final_ip_set = set()
+	IPv4 coverage is set algebra on RoaringBitmaps of the input hosts and of the networks'
+	usable hosts; IPv6 is counted from the intervals by summarize_consolidation.
+	"""
+	collapsed_networks = consolidate_with_bias(host_ips, max_missing_percent=threshold, version=version)
+	intervals = to_intervals(host_ips, version)
+	if version == 6:
+		return summarize_consolidation(collapsed_networks, HostIndex(intervals), threshold)
 	
-	for net in collapsed_networks:
-		if net.prefixlen == 32:
-			final_ip_set.add(net.network_address)
-		else:
-			final_ip_set.update(net.hosts())
+	original_ip_set = RoaringBitmap.from_intervals(intervals)
+	final_ip_set = RoaringBitmap.from_intervals(
+		host_interval(int(net.network_address), net.prefixlen) for net in collapsed_networks
+	)
+	return _summary(collapsed_networks, threshold, len(original_ip_set), len(final_ip_set), len(final_ip_set - original_ip_set))
+
+def summarize_consolidation(collapsed_networks: List[IPNetwork], original_index: HostIndex, threshold: int) -> Dict:
+	"""
+	Compute summary stats for one threshold's consolidated networks of a single IP version.
+	
+	Coverage is counted arithmetically: the networks' usable host ranges are merged so
+	overlapping outputs count once, and input hosts inside them come from the index.
+	"""
+	final_intervals = merge_intervals(
+		host_interval(int(net.network_address), net.prefixlen, net.version) for net in collapsed_networks
+	)
 	
-	missing_ips_included = final_ip_set - original_ip_set
-	total_ips_in_final = len(final_ip_set)
-	original_ips = len(original_ip_set)
-	objects_defined_count = sum(1 for net in collapsed_networks if net.prefixlen != 32)
+	total_ips_in_final = count_hosts(final_intervals)
+	missing_ips_included = total_ips_in_final - sum(original_index.count(start, end) for start, end in final_intervals)
+	return _summary(collapsed_networks, threshold, original_index.total, total_ips_in_final, missing_ips_included)
+
+def _summary(collapsed_networks: List[IPNetwork], threshold: int, original_ips: int, total_ips_in_final: int,
+             missing_ips_included: int) -> Dict:
+	# Host routes (/32, or /128 for IPv6) are group members, not objects
+	objects_defined_count = sum(1 for net in collapsed_networks if net.prefixlen != net.max_prefixlen)
 	
 	return {
 		'threshold': threshold,
 		'objects_defined': objects_defined_count,
 		'original_ips': original_ips,
 		'total_ips_final': total_ips_in_final,
-		'missing_ips_included': len(missing_ips_included),
-		'expansion_percent': (len(missing_ips_included) / original_ips) * 100,
+		'missing_ips_included': missing_ips_included,
+		'expansion_percent': (missing_ips_included / original_ips) * 100,
 		'networks': collapsed_networks
 	}
 
@@ -60,28 +91,348 @@ def equal_weight_score(results: List[Dict]) -> List[Dict]:
 		r['score'] = (obj_norm + mis_norm) / 2.0
 	return results
 
-def run_consolidation_analysis(host_ips: List[str], thresholds: List[int] = None) -> Tuple[List[Dict], List[Dict]]:
-	"""Run consolidation analysis across multiple thresholds and return results + Pareto frontier."""
-	if thresholds is None:
-		thresholds = [0, 10, 20, 25, 30, 35, 40, 45, 50]
+def _analyze_shared_thresholds(shm_name: str, interval_count: int, thresholds: List[int]) -> List[Dict]:
+	"""Worker entry point: attach to the shared host array and analyze a group of thresholds."""
+	shm = shared_memory.SharedMemory(name=shm_name)
+	try:
+		view = shm.buf.cast('I')
+		flat = view[:2 * interval_count].tolist()
+		view.release()
+	finally:
+		shm.close()
+	
+	intervals = list(zip(flat[0::2], flat[1::2]))
+	original_index = HostIndex(intervals)
+	networks_by_threshold = consolidate_with_bias_sweep(intervals, thresholds)
+	
+	results = []
+	for threshold in thresholds:
+		result = summarize_consolidation(networks_by_threshold[threshold], original_index, threshold)
+		# Plain tuples pickle far smaller than IPv4Network objects
+		result['networks'] = [(int(net.network_address), net.prefixlen) for net in result['networks']]
+		results.append(result)
+	return results
+
+def run_thresholds_parallel(intervals: List[Interval], thresholds: List[int], workers: int,
+                            progress_callback: Optional[ProgressCallback] = None) -> List[Dict]:
+	"""
+	Analyze thresholds across a process pool, returning results in threshold order.
 	
+	The merged host intervals are written once to a shared-memory uint32 array that
+	every worker attaches to, so the host list is never pickled per task.
+	"""
+	groups = [group for group in (thresholds[i::workers] for i in range(workers)) if group]
+	shm = shared_memory.SharedMemory(create=True, size=max(1, 8 * len(intervals)))
+	try:
+		view = shm.buf.cast('I')
+		view[:2 * len(intervals)] = array('I', (bound for interval in intervals for bound in interval))
+		view.release()
+		
+		with ProcessPoolExecutor(max_workers=len(groups)) as executor:
+			futures = [executor.submit(_analyze_shared_thresholds, shm.name, len(intervals), group) for group in groups]
+			results_by_threshold = {}
+			for done, future in enumerate(as_completed(futures), 1):
+				for result in future.result():
+					results_by_threshold[result['threshold']] = result
+				if progress_callback:
+					progress_callback('Running consolidation analysis', (done / len(futures)) * 100)
+	finally:
+		shm.close()
+		shm.unlink()
+	
+	# Thresholds share most of their networks, so build each IPv4Network once
+	network_objects = {}
 	results = []
+	for threshold in thresholds:
+		result = results_by_threshold[threshold]
+		networks = []
+		for net in result['networks']:
+			if net not in network_objects:
+				network_objects[net] = ipaddress.IPv4Network(net)
+			networks.append(network_objects[net])
+		results.append(dict(result, networks=networks))
+	return results
+
+def combine_family_results(family_results: List[List[Dict]]) -> List[Dict]:
+	"""
+	Merge per-family results threshold by threshold into dual-stack results.
+	
+	Counts add up across IPv4 and IPv6 and the network lists are concatenated, IPv4 first.
+	"""
+	if len(family_results) == 1:
+		return family_results[0]
+	
+	combined = []
+	for per_threshold in zip(*family_results):
+		original_ips = sum(r['original_ips'] for r in per_threshold)
+		missing_ips_included = sum(r['missing_ips_included'] for r in per_threshold)
+		combined.append({
+			'threshold': per_threshold[0]['threshold'],
+			'objects_defined': sum(r['objects_defined'] for r in per_threshold),
+			'original_ips': original_ips,
+			'total_ips_final': sum(r['total_ips_final'] for r in per_threshold),
+			'missing_ips_included': missing_ips_included,
+			'expansion_percent': (missing_ips_included / original_ips) * 100,
+			'networks': [net for r in per_threshold for net in r['networks']]
+		})
+	return combined
+
+def _analyze_family(intervals: List[Interval], thresholds: List[int], version: int) -> List[Dict]:
+	"""Worker entry point: analyze one IP version's intervals, returning networks as plain tuples."""
+	results = analyze_family(intervals, thresholds, version)
+	for result in results:
+		# Plain tuples pickle far smaller than network objects
+		result['networks'] = [(int(net.network_address), net.prefixlen) for net in result['networks']]
+	return results
+
+def analyze_family(intervals: List[Interval], thresholds: List[int], version: int = 4, workers: int = 1,
+                   progress_callback: Optional[ProgressCallback] = None) -> List[Dict]:
+	"""Unscored per-threshold results for the merged intervals of one IP version."""
 	total_thresholds = len(thresholds)
 	
-	print(f"Starting analysis of {len(host_ips)} IPs across {total_thresholds} thresholds...")
+	# The shared-memory fan-out packs addresses as uint32, so it only serves IPv4
+	if workers > 1 and total_thresholds > 1 and version == 4:
+		return run_thresholds_parallel(intervals, thresholds, min(workers, total_thresholds), progress_callback)
+	
+	original_index = HostIndex(intervals)
+	if progress_callback:
+		progress_callback('Running consolidation analysis', 0)
 	
+	# One bias sweep covers every threshold; only the per-threshold stats remain
+	networks_by_threshold = consolidate_with_bias_sweep(intervals, thresholds, version)
+	
+	results = []
 	for i, threshold in enumerate(thresholds, 1):
-		# Progress indicator for large datasets
-		if len(host_ips) > 10000:
-			progress = (i / total_thresholds) * 100
-			print(f"Processing threshold {threshold}% ({i}/{total_thresholds}) - {progress:.1f}% complete")
+		if progress_callback:
+			progress_callback('Running consolidation analysis', (i / total_thresholds) * 100)
 		
-		result = analyze_consolidation(host_ips, threshold)
-		results.append(result)
+		with metrics.stage('summarize', version=version):
+			results.append(summarize_consolidation(networks_by_threshold[threshold], original_index, threshold))
+	return results
+
+@metrics.stage('analysis')
+def run_consolidation_analysis(host_ips: List[HostInput], thresholds: List[int] = None, workers: int = 1,
+                               progress_callback: Optional[ProgressCallback] = None,
+                               host_ips_v6: Optional[List[HostInput]] = None) -> Tuple[List[Dict], List[Dict]]:
+	"""
+	Run consolidation analysis across multiple thresholds and return results + Pareto frontier.
 	
-	results = equal_weight_score(results)
-	frontier = pareto_front(results)
+	host_ips are IPv4 hosts or intervals; host_ips_v6, if given, are IPv6 ones. Each family
+	is consolidated on its own and the stats are combined per threshold. With workers > 1
+	IPv6 runs in its own process while IPv4 fans its thresholds out to the rest of the pool;
+	scoring and the Pareto frontier are identical to the serial path. progress_callback(stage,
+	percent) is called as IPv4 thresholds complete.
+	"""
+	if thresholds is None:
+		thresholds = DEFAULT_THRESHOLDS
+	
+	intervals = to_intervals(host_ips)
+	intervals6 = to_intervals(host_ips_v6, 6) if host_ips_v6 else []
 	
-	print(f"Analysis complete. Found {len(frontier)} Pareto optimal solutions.")
+	metrics.inc('analysis_runs')
+	metrics.inc('hosts_analyzed', count_hosts(intervals), version=4)
+	metrics.inc('hosts_analyzed', count_hosts(intervals6), version=6)
+	metrics.inc('thresholds_analyzed', len(thresholds))
+	
+	if intervals and intervals6 and workers > 1:
+		with ProcessPoolExecutor(max_workers=1) as executor:
+			future6 = executor.submit(_analyze_family, intervals6, thresholds, 6)
+			results4 = analyze_family(intervals, thresholds, 4, workers - 1, progress_callback)
+			results6 = future6.result()
+		
+		# Thresholds share most of their networks, so build each IPv6Network once
+		network_objects = {}
+		for result in results6:
+			networks = []
+			for net in result['networks']:
+				if net not in network_objects:
+					network_objects[net] = ipaddress.IPv6Network(net)
+				networks.append(network_objects[net])
+			result['networks'] = networks
+		family_results = [results4, results6]
+	else:
+		family_results = []
+		if intervals or not intervals6:
+			family_results.append(analyze_family(intervals, thresholds, 4, workers, progress_callback))
+		if intervals6:
+			family_results.append(analyze_family(intervals6, thresholds, 6))
+	
+	results = equal_weight_score(combine_family_results(family_results))
+	frontier = pareto_front(results)
+	metrics.inc('pareto_solutions', len(frontier))
 	
 	return results, frontier
+
+def run_budget_analysis(host_ips: List[HostInput], max_entries: int,
+                        host_ips_v6: Optional[List[HostInput]] = None) -> Dict:
+	"""
+	Consolidate to at most max_entries networks and summarize the result like a threshold result.
+	
+	The result carries 'max_entries' and 'entries' (networks produced, hosts included) in
+	place of a threshold, plus the usual objects/missing statistics across both IP versions.
+	"""
+	intervals = to_intervals(host_ips)
+	intervals6 = to_intervals(host_ips_v6, 6) if host_ips_v6 else []
+	networks = consolidate_to_budget(intervals, max_entries, intervals6)
+	
+	family_results = []
+	for version, family_intervals in ((4, intervals), (6, intervals6)):
+		if family_intervals or (version == 4 and not intervals6):
+			family_networks = [net for net in networks if net.version == version]
+			family_results.append([summarize_consolidation(family_networks, HostIndex(family_intervals), None)])
+	
+	result = combine_family_results(family_results)[0]
+	del result['threshold']
+	result['max_entries'] = max_entries
+	result['entries'] = len(networks)
+	return result
+
+# Frontier point choice marking a trie node that is used whole
+_TAKE = 'take'
+
+class _FrontierNode:
+	"""
+	A node of the compressed prefix trie with its Pareto curve.
+	
+	points are (objects, added, choice) sorted by objects with added strictly decreasing;
+	choice is _TAKE or None to use block itself, or (i, j) to combine left.points[i] with
+	right.points[j].
+	"""
+	__slots__ = ('block', 'version', 'points', 'left', 'right')
+	
+	def __init__(self, block, version, points, left=None, right=None):
+		self.block = block
+		self.version = version
+		self.points = points
+		self.left = left
+		self.right = right
+
+def _prune_frontier(points: List[Tuple]) -> List[Tuple]:
+	"""Drop points that are not strictly better in added than a point with fewer objects."""
+	pruned = []
+	for point in sorted(points, key=lambda p: (p[0], p[1])):
+		if not pruned or point[1] < pruned[-1][1]:
+			pruned.append(point)
+	return pruned
+
+def _merge_frontiers(left: _FrontierNode, right: _FrontierNode, block=None, version: int = 4) -> _FrontierNode:
+	"""Min-plus combine two disjoint subtrees' curves: the best added cost for every object count."""
+	if len(right.points) == 1:
+		# Shifting a curve by one point keeps it pruned, which covers most merges
+		objects_right, added_right, _ = right.points[0]
+		points = [(objects + objects_right, added + added_right, (i, 0)) for i, (objects, added, _) in enumerate(left.points)]
+		return _FrontierNode(block, version, points, left, right)
+	if len(left.points) == 1:
+		objects_left, added_left, _ = left.points[0]
+		points = [(objects_left + objects, added_left + added, (0, j)) for j, (objects, added, _) in enumerate(right.points)]
+		return _FrontierNode(block, version, points, left, right)
+	
+	best = {}
+	for i, (objects_left, added_left, _) in enumerate(left.points):
+		for j, (objects_right, added_right, _) in enumerate(right.points):
+			objects = objects_left + objects_right
+			added = added_left + added_right
+			if objects not in best or added < best[objects][0]:
+				best[objects] = (added, (i, j))
+	points = [(objects, added, choice) for objects, (added, choice) in best.items()]
+	return _FrontierNode(block, version, _prune_frontier(points), left, right)
+
+def _block_added(index: HostIndex, network_int: int, prefixlen: int, version: int) -> int:
+	"""Usable hosts of a block that are not input hosts, counted as summarize_consolidation does."""
+	low, high = host_interval(network_int, prefixlen, version)
+	return high - low + 1 - index.count(low, high)
+
+def _family_frontier(intervals: List[Interval], version: int) -> Optional[_FrontierNode]:
+	"""
+	Build the compressed trie over one family's collapsed blocks and solve it bottom-up.
+	
+	Leaves are the collapsed blocks; internal nodes are the smallest blocks where leaves
+	branch, up to the family's climb floor. Supernets that don't branch are never worth
+	taking (same leaves, more added), so they are skipped.
+	"""
+	bits = ADDRESS_BITS[version]
+	floor_shift = bits - CLIMB_FLOOR[version]
+	index = HostIndex(intervals)
+	leaves = [block for start, end in intervals for block in range_to_cidrs(start, end, version)]
+	addresses = [network_int for network_int, _ in leaves]
+	
+	def build(lo: int, hi: int) -> _FrontierNode:
+		if hi - lo == 1:
+			# A collapsed block lies inside the input, so it never adds addresses
+			objects = 0 if leaves[lo][1] == bits else 1
+			return _FrontierNode(leaves[lo], version, [(objects, 0, None)])
+		
+		# Smallest block holding every leaf in [lo, hi); its two halves split the range
+		prefixlen = bits - (addresses[lo] ^ addresses[hi - 1]).bit_length()
+		network_int = addresses[lo] & ~((1 << (bits - prefixlen)) - 1)
+		mid = bisect.bisect_left(addresses, network_int | (1 << (bits - prefixlen - 1)), lo, hi)
+		
+		node = _merge_frontiers(build(lo, mid), build(mid, hi), (network_int, prefixlen), version)
+		take = (1, _block_added(index, network_int, prefixlen, version), _TAKE)
+		node.points = _prune_frontier(node.points + [take])
+		return node
+	
+	# Blocks never grow past the floor, so each floor-sized root is solved on its own
+	root = None
+	lo = 0
+	while lo < len(leaves):
+		hi = lo + 1
+		while hi < len(leaves) and addresses[hi] >> floor_shift == addresses[lo] >> floor_shift:
+			hi += 1
+		subtree = build(lo, hi)
+		root = subtree if root is None else _merge_frontiers(root, subtree)
+		lo = hi
+	return root
+
+def _frontier_networks(root: _FrontierNode, point: int) -> List[IPNetwork]:
+	"""Reconstruct the blocks chosen for one point of the root curve."""
+	networks = []
+	stack = [(root, point)]
+	while stack:
+		node, i = stack.pop()
+		choice = node.points[i][2]
+		if choice is None or choice == _TAKE:
+			network_class = ipaddress.IPv4Network if node.version == 4 else ipaddress.IPv6Network
+			networks.append(network_class(node.block))
+		else:
+			stack.append((node.right, choice[1]))
+			stack.append((node.left, choice[0]))
+	return sorted(networks, key=lambda net: (net.version, net.network_address, net.prefixlen))
+
+@metrics.stage('optimal_frontier')
+def optimal_frontier(host_ips: List[HostInput], host_ips_v6: Optional[List[HostInput]] = None,
+                     with_networks: bool = False) -> List[Dict]:
+	"""
+	Exact trade-off curve between objects_defined and missing_ips_included.
+	
+	Solves the choices the bias climb makes (keep each collapsed block or replace a group of
+	them with a common supernet no larger than the floor) with a tree DP over the compressed
+	prefix trie. Each node either takes its block whole or combines its children's curves,
+	so every point is optimal rather than the outcome of a greedy climb. Pareto pruning keeps
+	curves short, so in practice the cost stays near linear in the number of trie nodes;
+	the worst case is quadratic.
+	
+	Returns one result per frontier point in objects order, with the same statistics keys as
+	summarize_consolidation (and networks when with_networks is set).
+	"""
+	intervals = to_intervals(host_ips)
+	intervals6 = to_intervals(host_ips_v6, 6) if host_ips_v6 else []
+	original_ips = count_hosts(intervals) + count_hosts(intervals6)
+	
+	roots = [root for root in (_family_frontier(intervals, 4), _family_frontier(intervals6, 6)) if root is not None]
+	if not roots:
+		return []
+	root = roots[0] if len(roots) == 1 else _merge_frontiers(roots[0], roots[1])
+	
+	frontier = []
+	for i, (objects, added, _) in enumerate(root.points):
+		result = {
+			'objects_defined': objects,
+			'original_ips': original_ips,
+			'missing_ips_included': added,
+			'expansion_percent': (added / original_ips) * 100
+		}
+		if with_networks:
+			result['networks'] = _frontier_networks(root, i)
+		frontier.append(result)
+	return frontier
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for consolidation analysis results.
+Keys are the upload's SHA-256 plus the threshold list; entries live in an
+in-memory LRU and in a size-capped directory on disk.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+class AnalysisCache:
+	"""Two-level (memory LRU + disk) cache of serialized analysis data."""
+
+	# Bumped whenever the shape of cached values changes, so stale disk entries are never read
+	FORMAT_VERSION = 4
+
+	def __init__(self, cache_dir: Optional[str] = None, max_memory_entries: int = 32, max_disk_bytes: int = 512 * 1024 * 1024):
+		self.cache_dir = cache_dir
+		self.max_memory_entries = max_memory_entries
+		self.max_disk_bytes = max_disk_bytes
+		self._memory = OrderedDict()
+		self._lock = threading.Lock()
+		self.memory_hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+
+		if self.cache_dir and not os.path.exists(self.cache_dir):
+			os.makedirs(self.cache_dir)
+
+	@classmethod
+	def make_key(cls, content_hash: str, thresholds: List[int]) -> str:
+		"""Build the cache key for a content hash and threshold list."""
+		return f"v{cls.FORMAT_VERSION}_{content_hash}_{'-'.join(str(t) for t in thresholds)}"
+
+	def _disk_path(self, key: str) -> str:
+		return os.path.join(self.cache_dir, f"{key}.json")
+
+	def _remember(self, key: str, value: Dict):
+		"""Insert into the memory LRU, evicting the least recently used entry when full."""
+		self._memory[key] = value
+		self._memory.move_to_end(key)
+		while len(self._memory) > self.max_memory_entries:
+			self._memory.popitem(last=False)
+
+	def get(self, content_hash: str, thresholds: List[int]) -> Optional[Dict]:
+		"""Return cached analysis data, or None on a miss."""
+		key = self.make_key(content_hash, thresholds)
+		with self._lock:
+			if key in self._memory:
+				self._memory.move_to_end(key)
+				self.memory_hits += 1
+				return self._memory[key]
+
+			if self.cache_dir:
+				path = self._disk_path(key)
+				try:
+					with open(path, 'r') as f:
+						value = json.load(f)
+					os.utime(path)  # Refresh recency for disk eviction
+					self.disk_hits += 1
+					self._remember(key, value)
+					return value
+				except (OSError, ValueError):
+					pass
+
+			self.misses += 1
+			return None
+
+	def put(self, content_hash: str, thresholds: List[int], value: Dict):
+		"""Store analysis data in memory and, if configured, on disk."""
+		key = self.make_key(content_hash, thresholds)
+		with self._lock:
+			self._remember(key, value)
+			if not self.cache_dir:
+				return
+			try:
+				tmp_path = self._disk_path(key) + '.tmp'
+				with open(tmp_path, 'w') as f:
+					json.dump(value, f, default=str)
+				os.replace(tmp_path, self._disk_path(key))
+				self._enforce_disk_limit()
+			except OSError as e:
+				print(f"Error writing analysis cache entry: {e}")
+
+	def _enforce_disk_limit(self):
+		"""Delete least recently used disk entries until the directory fits max_disk_bytes."""
+		entries = []
+		for filename in os.listdir(self.cache_dir):
+			if not filename.endswith('.json'):
+				continue
+			path = os.path.join(self.cache_dir, filename)
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			entries.append((stat.st_mtime, stat.st_size, path))
+
+		total = sum(size for _, size, _ in entries)
+		for _, size, path in sorted(entries):
+			if total <= self.max_disk_bytes:
+				break
+			try:
+				os.unlink(path)
+				total -= size
+			except OSError:
+				continue
+
+	def disk_usage(self) -> int:
+		"""Total bytes used by disk entries."""
+		if not self.cache_dir:
+			return 0
+		total = 0
+		for filename in os.listdir(self.cache_dir):
+			if filename.endswith('.json'):
+				try:
+					total += os.path.getsize(os.path.join(self.cache_dir, filename))
+				except OSError:
+					continue
+		return total
+
+	def stats(self) -> Dict:
+		"""Hit/miss counters and current sizes, for sizing the cache."""
+		with self._lock:
+			lookups = self.memory_hits + self.disk_hits + self.misses
+			return {
+				'memory_hits': self.memory_hits,
+				'disk_hits': self.disk_hits,
+				'hits': self.memory_hits + self.disk_hits,
+				'misses': self.misses,
+				'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+				'memory_entries': len(self._memory),
+				'max_memory_entries': self.max_memory_entries,
+				'disk_bytes': self.disk_usage(),
+				'max_disk_bytes': self.max_disk_bytes,
+			}
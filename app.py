@@ -4,18 +4,27 @@ Flask web application for IP Consolidator
 Provides a simple web interface for the consolidation tool
 """
 
-from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for, session
+from flask import Flask, Request, Response, g, render_template, request, jsonify, flash, redirect, url_for, session
 from flask_compress import Compress
 import os
-import json
 import hashlib
+import ipaddress
+import re
 import time
-import threading
+import tracemalloc
+from contextlib import ExitStack
 
 from dotenv import load_dotenv
-from core_consolidation import extract_host_ips
-from analysis import run_consolidation_analysis
-from output_generator import generate_asa_output, write_asa_file
+import metrics
+from core_consolidation import count_hosts, scan_dual_stack
+from analysis import DEFAULT_THRESHOLDS, optimal_frontier, run_budget_analysis, run_consolidation_analysis
+from analysis_cache import AnalysisCache
+from decompression import COMPRESSED_EXTENSIONS
+from delta import apply_delta
+from jobs import JobQueue, QueueFullError
+from output_generator import RENDERERS, ExportSection, format_address6, iter_bundle, iter_chunks
+from result_store import (HOSTS_SECTION, HOSTS_SECTION_V6, ResultStore, format_network, threshold_section,
+                          update_result_store, write_result_store)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -39,6 +48,7 @@ app.config['COMPRESS_MIMETYPES'] = [
 
 app.config['COMPRESS_LEVEL'] = 6  # Balance between compression and speed
 app.config['COMPRESS_MIN_SIZE'] = 500  # Only compress files larger than 500 bytes
+app.config['COMPRESS_STREAMS'] = False  # Compressing would buffer streamed downloads in full
 
 # Improved secret key handling
 def get_secret_key():
@@ -56,43 +66,25 @@ def get_secret_key():
 
 app.secret_key = get_secret_key()
 
+# Per-stage peak memory comes from tracemalloc when enabled; it slows Python allocations noticeably
+if os.environ.get('METRICS_TRACE_MEMORY', 'False').lower() == 'true':
+    tracemalloc.start()
 
 
-def immediate_file_cleanup(file_path):
-    """Clean up file after 30 second delay with retry mechanism every 30 seconds"""
-    def cleanup():
-        # Wait 30 seconds before first attempt
-        initial_delay = 30  # seconds
-        time.sleep(initial_delay)
-        
-        retry_interval = 30  # seconds
-        max_retries = 10  # Maximum 5 minutes of retries (10 * 30 seconds)
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                if os.path.exists(file_path):
-                    os.unlink(file_path)
-                    print(f"Cleaned up file after {initial_delay + (retry_count * retry_interval)} seconds: {os.path.basename(file_path)}")
-                    return  # Successfully cleaned up, exit the loop
-                else:
-                    print(f"File no longer exists: {os.path.basename(file_path)}")
-                    return  # File already gone, exit the loop
-            except PermissionError:
-                # File might be in use (being downloaded), retry
-                retry_count += 1
-                if retry_count < max_retries:
-                    print(f"File in use, retrying cleanup in {retry_interval} seconds: {os.path.basename(file_path)} (attempt {retry_count}/{max_retries})")
-                    time.sleep(retry_interval)
-                else:
-                    print(f"Failed to clean up file after {initial_delay + (max_retries * retry_interval)} seconds: {os.path.basename(file_path)}")
-            except Exception as e:
-                print(f"Error cleaning up file {os.path.basename(file_path)}: {e}")
-                return  # Exit on other errors
-    
-    # Start cleanup thread
-    cleanup_thread = threading.Thread(target=cleanup, daemon=True)
-    cleanup_thread.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Time every request by endpoint; streamed bodies are rendered later and timed in iter_chunks"""
+    started = getattr(g, 'request_started', None)
+    endpoint = request.endpoint or 'unknown'
+    if started is not None:
+        metrics.observe('http_request', time.perf_counter() - started, endpoint=endpoint)
+    metrics.inc('http_requests', endpoint=endpoint, status=response.status_code)
+    return response
 
 # Security headers
 @app.after_request
@@ -111,21 +103,121 @@ def add_security_headers(response):
     
     # Add compression-friendly headers
     response.headers['Vary'] = 'Accept-Encoding'
-    response.headers['Cache-Control'] = 'public, max-age=3600'  # Cache for 1 hour
+    response.headers.setdefault('Cache-Control', 'public, max-age=3600')  # Cache for 1 hour unless the view set a policy
     return response
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'txt', 'cfg', 'conf', 'csv', 'log', 'dat', 'lst', 'ip', 'hosts'}
+ALLOWED_EXTENSIONS = {'txt', 'cfg', 'conf', 'csv', 'log', 'dat', 'lst', 'ip', 'hosts'} | COMPRESSED_EXTENSIONS
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-def generate_secure_filename(original_filename, file_content=None):
+class HashingFile:
+    """
+    File that hashes the bytes written to it as they arrive.
+    
+    Everything but write() is passed to the wrapped file. hexdigest() is the SHA-256 of what
+    was written, size its length and seconds the time spent hashing.
+    """
+    def __init__(self, file):
+        self._file = file
+        self._hasher = hashlib.sha256()
+        self.size = 0
+        self.seconds = 0.0
+    
+    def write(self, data):
+        started = time.perf_counter()
+        self._hasher.update(data)
+        self.seconds += time.perf_counter() - started
+        self.size += len(data)
+        return self._file.write(data)
+    
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+    
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+class UploadRequest(Request):
+    """
+    Request that receives multipart file parts straight into files in the upload folder.
+    
+    Werkzeug's default spools them to anonymous temporary files that close with the request,
+    while the upload job reads the file after the request has returned. Each part is hashed
+    as it is written (see HashingFile), so the job finds a cached analysis without reading
+    the file. The paths are listed in received_files; whoever does not hand one to a job must remove it.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        path = os.path.join(app.config['UPLOAD_FOLDER'], generate_secure_filename(filename or ''))
+        stream = HashingFile(open(path, 'wb+'))
+        self.__dict__.setdefault('received_files', []).append(path)
+        return stream
+
+app.request_class = UploadRequest
+
+# Number of processes used to evaluate thresholds (1 keeps analysis in the request process)
+ANALYSIS_WORKERS = max(1, int(os.environ.get('ANALYSIS_WORKERS', 1)))
+
+# Number of processes used to scan large uploads for IPs
+SCAN_WORKERS = max(1, int(os.environ.get('SCAN_WORKERS', 1)))
+
+# Uploads above this size are scanned in parallel (only when SCAN_WORKERS > 1)
+PARALLEL_SCAN_MIN_MB = int(os.environ.get('PARALLEL_SCAN_MIN_MB', 64))
+
+# Room for the other form fields in a request body, beyond the upload itself
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Content-addressed cache of analysis results, shared by all sessions
+analysis_cache = AnalysisCache(
+    cache_dir=os.environ.get('ANALYSIS_CACHE_DIR', 'analysis_cache'),
+    max_memory_entries=int(os.environ.get('ANALYSIS_CACHE_ENTRIES', 32)),
+    max_disk_bytes=int(os.environ.get('ANALYSIS_CACHE_DISK_MB', 512)) * 1024 * 1024
+)
+
+# Background job queue for uploads; /upload answers 429 once JOB_QUEUE_SIZE jobs are unfinished
+job_queue = JobQueue(
+    workers=max(1, int(os.environ.get('JOB_WORKERS', 2))),
+    max_pending=max(1, int(os.environ.get('JOB_QUEUE_SIZE', 8)))
+)
+
+# Upload size ceiling; the memory-mapped scanner keeps memory flat regardless of file size
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 1024))
+
+# Maximum decompressed size of a gzip, bz2, xz or zip upload in megabytes
+MAX_DECOMPRESSED_MB = int(os.environ.get('MAX_DECOMPRESSED_MB', 20480))
+
+# Request bodies are refused beyond the upload ceiling plus room for the other form fields
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024 + UPLOAD_CHUNK_SIZE
+
+# Sections holding the object-budget networks, replaced whenever a new budget is requested
+BUDGET_SECTION = 'budget'
+BUDGET_SECTION_V6 = 'budget.v6'
+
+# Most points of the optimal trade-off curve kept for the results chart
+CURVE_POINTS = 1000
+
+# Networks per /api/networks page, by default and at most
+NETWORKS_PAGE_SIZE = 1000
+MAX_NETWORKS_PAGE_SIZE = 10000
+
+# Each stored analysis is uploads/result_<analysis id>.ipcs
+ANALYSIS_ID_RE = re.compile(r'session_[0-9a-f]+')
+
+def new_analysis_id():
+    """Generate a unique, unguessable analysis id"""
+    return f"session_{int(time.time() * 1000000)}{os.urandom(8).hex()}"
+
+def result_filename(analysis_id):
+    return f"result_{analysis_id}.ipcs"
+
+def generate_secure_filename(original_filename, file_content=None, content_hash=None):
     """
     Generate a secure, hashed filename to prevent information leakage
+    
+    Pass content_hash when the SHA-256 of the upload is already known to avoid hashing it twice.
     """
     # Get file extension from original filename
     if '.' in original_filename:
@@ -138,9 +230,10 @@ def generate_secure_filename(original_filename, file_content=None):
     random_salt = os.urandom(16).hex()  # 32 character random salt
     
     # If we have file content, hash it for additional uniqueness
-    if file_content:
-        content_hash = hashlib.sha256(file_content).hexdigest()[:16]
-        base_name = f"{content_hash}_{timestamp}{random_salt}"
+    if file_content and not content_hash:
+        content_hash = hashlib.sha256(file_content).hexdigest()
+    if content_hash:
+        base_name = f"{content_hash[:16]}_{timestamp}{random_salt}"
     else:
         base_name = f"{timestamp}{random_salt}"
     
@@ -178,23 +271,15 @@ def cleanup_uploads():
 def cleanup_session_files():
     """Clean up session-specific files"""
     try:
-        # Get current session file references
-        analysis_file = session.get('analysis_file')
-        networks_file = session.get('networks_file')
-        
-        # Clean up analysis file
-        if analysis_file:
-            analysis_filepath = os.path.join(UPLOAD_FOLDER, analysis_file)
-            if os.path.exists(analysis_filepath):
-                os.unlink(analysis_filepath)
-                print(f"Cleaned up session analysis file: {analysis_file}")
+        # Get current session file reference
+        result_file = session.get('result_file')
         
-        # Clean up networks file
-        if networks_file:
-            networks_filepath = os.path.join(UPLOAD_FOLDER, networks_file)
-            if os.path.exists(networks_filepath):
-                os.unlink(networks_filepath)
-                print(f"Cleaned up session networks file: {networks_file}")
+        # Clean up result store
+        if result_file:
+            result_filepath = os.path.join(UPLOAD_FOLDER, result_file)
+            if os.path.exists(result_filepath):
+                os.unlink(result_filepath)
+                print(f"Cleaned up session result file: {result_file}")
                 
     except Exception as e:
         print(f"Error cleaning session files: {e}")
@@ -220,165 +305,283 @@ def index():
     # Clean up any existing session files
     cleanup_session_files()
     # Clear any existing session data when starting fresh
-    session.pop('analysis_file', None)
-    session.pop('networks_file', None)
+    session.pop('result_file', None)
     return render_template('index.html')
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    """Handle file upload and run analysis"""
-    if 'file' not in request.files:
-        flash('No file selected')
-        return redirect(request.url)
-    
-    file = request.files['file']
-    if file.filename == '':
-        flash('No file selected')
-        return redirect(request.url)
-    
-    if file and allowed_file(file.filename):
-        # Check file size (limit to 100MB for performance)
-        file.seek(0, 2)  # Seek to end
-        file_size = file.tell()
-        file.seek(0)  # Reset to beginning
-        
-        max_size = 100 * 1024 * 1024  # 100MB
-        if file_size > max_size:
-            flash(f'File too large. Maximum size is 100MB. Your file is {file_size / (1024*1024):.1f}MB')
-            return redirect(url_for('index'))
-        
-        # Read file content for hashing
-        file_content = file.read()
-        file.seek(0)  # Reset file pointer for processing
-        
-        # Generate secure filename
-        secure_filename_hash = generate_secure_filename(file.filename, file_content)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename_hash)
-        file.save(filepath)
-        
-        try:
-            # Use chunked processing for large files
-            chunk_size = 5000 if file_size > 10 * 1024 * 1024 else 10000  # 10MB threshold
-            host_ips = extract_host_ips(filepath, chunk_size)
-            
-            if not host_ips:
-                flash('No host IPs found in the file')
-                return redirect(url_for('index'))
-            
-            # Run analysis
-            results, frontier = run_consolidation_analysis(host_ips)
+def _scaled_progress(progress_callback, start, end):
+    """Map a stage's 0-100 progress onto the [start, end] slice of the overall job"""
+    def callback(stage, percent):
+        progress_callback(stage, start + (end - start) * percent / 100)
+    return callback
 
-            # Compute recommended (minimum score among Pareto frontier)
-            recommended = min(frontier, key=lambda r: r['score'])
-            
-            # Store results in session or temporary storage
-            # Convert IPv4Network objects to strings for JSON serialization
-            serializable_results = []
-            for result in results:
-                serializable_result = result.copy()
-                serializable_result['networks'] = [str(network) for network in result['networks']]
-                serializable_results.append(serializable_result)
-            
-            serializable_frontier = []
-            for frontier_result in frontier:
-                serializable_frontier_result = frontier_result.copy()
-                serializable_frontier_result['networks'] = [str(network) for network in frontier_result['networks']]
-                serializable_frontier.append(serializable_frontier_result)
-            
-            analysis_data = {
-                'host_ips_count': len(host_ips),
-                'results': serializable_results,
-                'frontier': serializable_frontier,
-                'filepath': filepath,
-                'recommended': {
+def parse_max_objects(value):
+    """Validate an optional object budget; returns (max_objects or None, error message or None)"""
+    if value in (None, ''):
+        return None, None
+    try:
+        max_objects = int(value)
+    except (ValueError, TypeError):
+        return None, 'Invalid object budget'
+    if max_objects < 1:
+        return None, 'Invalid object budget'
+    return max_objects, None
+
+def budget_sections(host_ips, host_ips_v6, max_objects):
+    """Consolidate to at most max_objects entries; returns (budget summary, IPv4 sections, IPv6 sections)"""
+    result = run_budget_analysis(host_ips, max_objects, host_ips_v6)
+    networks = result.pop('networks')
+    sections = {BUDGET_SECTION: [(int(net.network_address), net.prefixlen) for net in networks if net.version == 4]}
+    sections_v6 = {BUDGET_SECTION_V6: [(int(net.network_address), net.prefixlen) for net in networks if net.version == 6]}
+    return result, sections, sections_v6
+
+def process_upload(content_hash, host_ips=None, host_ips_v6=None, filepath=None, cached=None, max_objects=None,
+                   run_metrics=None, progress_callback=None):
+    """
+    Run the analysis and write the result store for one upload.
+    
+    host_ips and host_ips_v6 are the IPv4 and IPv6 host intervals; when they are None and
+    nothing is cached, the upload at filepath is scanned here first. With max_objects
+    the store also holds a consolidation to at most that many entries. Metrics recorded while it
+    runs are added to run_metrics (a fresh recorder if None) and saved in the summary. Runs on the job queue, so it must not
+    touch the request or session; it returns the file reference that the status
+    endpoint later puts into the session.
+    """
+    progress_callback = progress_callback or (lambda stage, percent: None)
+    try:
+        # Metrics recorded on this thread are attached to the result
+        with metrics.collect(run_metrics) as run_metrics:
+            if cached is not None:
+                summary = cached['summary']
+                sections = {name: [tuple(network) for network in networks] for name, networks in cached['networks'].items()}
+                sections_v6 = {name: [tuple(network) for network in networks] for name, networks in cached['networks_v6'].items()}
+                host_ips = [tuple(interval) for interval in cached['hosts']]
+                host_ips_v6 = [tuple(interval) for interval in cached['hosts_v6']]
+                metrics.inc('analysis_cache_hits')
+            else:
+                if host_ips is None:
+                    # Memory-mapped scan, split across processes for large uploads; compressed uploads are streamed
+                    workers = SCAN_WORKERS if os.path.getsize(filepath) > PARALLEL_SCAN_MIN_MB * 1024 * 1024 else 1
+                    host_ips, host_ips_v6 = scan_dual_stack(filepath, workers=workers,
+                                                            progress_callback=_scaled_progress(progress_callback, 0, 40),
+                                                            max_output=MAX_DECOMPRESSED_MB * 1024 * 1024)
+                host_ips_v6 = host_ips_v6 or []
+                host_ips_count = count_hosts(host_ips) + count_hosts(host_ips_v6)
+                
+                if not host_ips and not host_ips_v6:
+                    raise ValueError('No host IPs found in the file')
+                
+                # Run analysis; IPv4 and IPv6 are consolidated independently
+                results, frontier = run_consolidation_analysis(host_ips, thresholds=DEFAULT_THRESHOLDS, workers=ANALYSIS_WORKERS,
+                                                               progress_callback=_scaled_progress(progress_callback, 40, 90),
+                                                               host_ips_v6=host_ips_v6)
+                
+                # Exact objects/missing trade-off curve, plotted next to the threshold results
+                progress_callback('Computing optimal trade-off curve', 90)
+                optimal = optimal_frontier(host_ips, host_ips_v6)
+                
+                # Compute recommended (minimum score among Pareto frontier)
+                recommended = min(frontier, key=lambda r: r['score'])
+                recommended_summary = {
                     'threshold': recommended['threshold'],
                     'score': recommended['score'],
                     'objects_defined': recommended['objects_defined'],
                     'missing_ips_included': recommended['missing_ips_included'],
                     'expansion_percent': recommended['expansion_percent']
                 }
-            }
-            
-            # Store data in temporary files to avoid session size limits
-            # Generate unique session ID for this analysis
-            session_id = f"session_{int(time.time() * 1000000)}{os.urandom(8).hex()}"
-            
-            # Create networks data
-            networks_data = {
-                'host_ips_count': len(host_ips),
-                'results': serializable_results,
-                'frontier': serializable_frontier,
-                'filepath': filepath,
-                'recommended': {
-                    'threshold': recommended['threshold'],
-                    'score': recommended['score'],
-                    'objects_defined': recommended['objects_defined'],
-                    'missing_ips_included': recommended['missing_ips_included'],
-                    'expansion_percent': recommended['expansion_percent']
-                },
-                'networks_by_threshold': {}
-            }
-            
-            # Store networks as strings for each threshold
-            for result in results:
-                threshold = result['threshold']
-                networks_data['networks_by_threshold'][str(threshold)] = [
-                    str(network) for network in result['networks']
-                ]
+                
+                # The summary carries the statistics only; networks go into packed sections
+                summary = {
+                    'host_ips_count': host_ips_count,
+                    'results': [{key: value for key, value in r.items() if key != 'networks'} for r in results],
+                    'frontier': [{key: value for key, value in r.items() if key != 'networks'} for r in frontier],
+                    'recommended': recommended_summary,
+                    'optimal_frontier': chart_curve(optimal, results)
+                }
+                sections = {}
+                sections_v6 = {}
+                for r in results:
+                    sections[threshold_section(r['threshold'])] = [
+                        (int(network.network_address), network.prefixlen) for network in r['networks'] if network.version == 4
+                    ]
+                    if host_ips_v6:
+                        sections_v6[threshold_section(r['threshold'], 6)] = [
+                            (int(network.network_address), network.prefixlen) for network in r['networks'] if network.version == 6
+                        ]
+                
+                analysis_cache.put(content_hash, DEFAULT_THRESHOLDS, {'summary': summary, 'networks': sections, 'networks_v6': sections_v6,
+                                                                      'hosts': host_ips, 'hosts_v6': host_ips_v6})
             
-            # Store analysis data in file
-            analysis_filename = f"analysis_{session_id}.json"
-            analysis_filepath = os.path.join(app.config['UPLOAD_FOLDER'], analysis_filename)
-            with open(analysis_filepath, 'w') as f:
-                json.dump(analysis_data, f, default=str)
+            if max_objects:
+                progress_callback(f'Consolidating to {max_objects} entries', 92)
+                summary = dict(summary)
+                summary['budget'], budget, budget_v6 = budget_sections(host_ips, host_ips_v6, max_objects)
+                sections = {**sections, **budget}
+                sections_v6 = {**sections_v6, **budget_v6}
             
-            # Store networks data in file
-            networks_filename = f"networks_{session_id}.json"
-            networks_filepath = os.path.join(app.config['UPLOAD_FOLDER'], networks_filename)
-            with open(networks_filepath, 'w') as f:
-                json.dump(networks_data, f, default=str)
+            progress_callback('Generating results...', 95)
+            # Store data in a file to avoid session size limits
+            analysis_id = new_analysis_id()
+            summary = dict(summary, metrics=run_metrics.snapshot(), analysis_id=analysis_id)
             
-            # Store only file references in session
-            session['analysis_file'] = analysis_filename
-            session['networks_file'] = networks_filename
+            # Host intervals are kept so other budgets and deltas can be computed later without the upload
+            write_result_store(os.path.join(app.config['UPLOAD_FOLDER'], result_filename(analysis_id)), summary, sections, sections_v6,
+                               intervals={HOSTS_SECTION: host_ips}, intervals_v6={HOSTS_SECTION_V6: host_ips_v6})
             
-            # Clean up uploaded file after processing
+            return {
+                'result_file': result_filename(analysis_id),
+                'host_ips_count': summary['host_ips_count']
+            }
+    finally:
+        # Clean up uploaded file after processing
+        if filepath and os.path.exists(filepath):
             try:
                 os.unlink(filepath)
-                print(f"Cleaned up uploaded file: {secure_filename_hash}")
+                print(f"Cleaned up uploaded file: {os.path.basename(filepath)}")
             except Exception as e:
                 print(f"Error cleaning up uploaded file: {e}")
-            
 
-            
-            flash(f'Successfully processed {len(host_ips)} host IPs')
-            return redirect(url_for('results'))
-            
-        except Exception as e:
-            flash(f'Error processing file: {str(e)}')
+def analyze_upload(filepath, content_hash, max_objects=None, progress_callback=None, ingest_seconds=0.0):
+    """
+    Job body for an upload received into filepath and hashed while it arrived: run process_upload.
+    
+    Identical uploads are found by their hash alone, so a cache hit never reads the file and
+    a miss reads it once, to scan it. ingest_seconds, the time spent hashing, is recorded as
+    the ingest stage. The file is removed whether or not this succeeds.
+    """
+    run_metrics = metrics.MetricsRecorder()
+    try:
+        with metrics.collect(run_metrics):
+            metrics.observe('ingest', ingest_seconds)
+        
+        # Identical uploads skip analysis entirely
+        cached = analysis_cache.get(content_hash, DEFAULT_THRESHOLDS)
+    except Exception:
+        os.unlink(filepath)
+        raise
+    
+    return process_upload(content_hash, filepath=filepath, cached=cached, max_objects=max_objects,
+                          run_metrics=run_metrics, progress_callback=progress_callback)
+
+def claim_job_result(job):
+    """Move a finished job's file reference into the current session"""
+    cleanup_session_files()
+    session['result_file'] = job.result['result_file']
+    session.pop('pending_job', None)
+    flash(f"Successfully processed {job.result['host_ips_count']} host IPs")
+
+def wants_json():
+    """True for the upload page's fetch() requests, which poll the job instead of waiting"""
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    """Handle file upload and queue the analysis job"""
+    # Refuse oversized and excess uploads before their body is read
+    if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+        flash(f'File too large. Maximum size is {MAX_UPLOAD_MB}MB.')
+        return redirect(url_for('index'))
+    
+    try:
+        job = job_queue.reserve()
+    except QueueFullError:
+        if wants_json():
+            return jsonify({'error': 'Server is busy. Please try again shortly.'}), 429
+        flash('Server is busy. Please try again shortly.')
+        return render_template('index.html'), 429
+    
+    filepath = None
+    try:
+        if 'file' not in request.files:
+            flash('No file selected')
+            return redirect(request.url)
+        
+        file = request.files['file']
+        if file.filename == '':
+            flash('No file selected')
+            return redirect(request.url)
+        
+        if not allowed_file(file.filename):
+            flash('Invalid file type')
+            return redirect(url_for('index'))
+        
+        max_objects, error = parse_max_objects(request.form.get('max_objects'))
+        if error:
+            if wants_json():
+                return jsonify({'error': error}), 400
+            flash(error)
+            return redirect(url_for('index'))
+        
+        if file.stream.size > MAX_UPLOAD_MB * 1024 * 1024:
+            flash(f'File too large. Maximum size is {MAX_UPLOAD_MB}MB.')
             return redirect(url_for('index'))
+        
+        # The upload was received into its own file and hashed on the way; tokenizing happens in the job
+        file.stream.flush()
+        job_queue.start(job, analyze_upload, file.stream.name, file.stream.hexdigest(), max_objects=max_objects,
+                        ingest_seconds=file.stream.seconds)
+        filepath = file.stream.name
+    finally:
+        job_queue.cancel(job)
+        for received in getattr(request, 'received_files', ()):
+            if received != filepath and os.path.exists(received):
+                os.unlink(received)
+    
+    session['pending_job'] = job.id
+    
+    if wants_json():
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+    
+    # Plain form posts wait for their job to finish
+    job.future.result()
+    if job.status == 'done':
+        claim_job_result(job)
+        return redirect(url_for('results'))
     
-    flash('Invalid file type')
+    session.pop('pending_job', None)
+    flash(f'Error processing file: {job.error}')
     return redirect(url_for('index'))
 
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Report stage and percent for a queued upload; claims the result when it finishes"""
+    job = job_queue.get(job_id)
+    if job is None or session.get('pending_job') != job_id:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    payload = job.to_dict()
+    if job.status == 'done':
+        claim_job_result(job)
+        payload['redirect'] = url_for('results')
+    elif job.status == 'error':
+        session.pop('pending_job', None)
+    
+    response = jsonify(payload)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def open_session_store():
+    """Open the current session's result store, or return None when there is none"""
+    result_file = session.get('result_file')
+    if not result_file:
+        return None
+    
+    result_filepath = os.path.join(app.config['UPLOAD_FOLDER'], result_file)
+    if not os.path.exists(result_filepath):
+        return None
+    
+    return ResultStore(result_filepath)
+
 @app.route('/results')
 def results():
     """Display analysis results"""
-    # Get file references from session
-    analysis_file = session.get('analysis_file')
-    
-    if not analysis_file:
+    # Only the summary is decoded; the page never needs the network lists
+    store = open_session_store()
+    if store is None:
         flash('No analysis data found. Please upload a file first.')
         return redirect(url_for('index'))
     
-    # Load data from file
-    analysis_filepath = os.path.join(app.config['UPLOAD_FOLDER'], analysis_file)
-    if not os.path.exists(analysis_filepath):
-        flash('Analysis data not found. Please upload a file first.')
-        return redirect(url_for('index'))
-    
-    with open(analysis_filepath, 'r') as f:
-        analysis_data = json.load(f)
+    with store:
+        analysis_data = summary_payload(store)
     
     # Backfill recommended if missing (for older analysis files)
     if 'recommended' not in analysis_data or not analysis_data.get('recommended'):
@@ -393,96 +596,125 @@ def results():
                 'expansion_percent': best.get('expansion_percent'),
             }
     
-    return render_template('results.html', data=analysis_data)
+    # Pareto membership by threshold; the frontier entries are separate dicts
+    frontier_thresholds = [r['threshold'] for r in analysis_data.get('frontier', [])]
+    return render_template('results.html', data=analysis_data, frontier_thresholds=frontier_thresholds)
 
-@app.route('/api/generate_output', methods=['POST'])
-def generate_output():
-    """Generate output for a specific threshold in specified format"""
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'error': 'Invalid request data'}), 400
-        
-        threshold = data.get('threshold', 25)
-        output_format = data.get('output_format', 'asa')
-        
-        # Validate threshold
-        try:
-            threshold = int(threshold)
-            if threshold < 0 or threshold > 100:
-                return jsonify({'error': 'Invalid threshold value'}), 400
-        except (ValueError, TypeError):
-            return jsonify({'error': 'Invalid threshold value'}), 400
-        
-        # Validate output format
-        if output_format not in ['asa', 'raw']:
-            return jsonify({'error': 'Invalid output format'}), 400
-        
-        # Load the networks data from file
-        networks_file = session.get('networks_file')
-        
-        if not networks_file:
-            return jsonify({'error': 'No networks data found. Please upload a file first.'}), 404
-        
-        # Load data from file
-        networks_filepath = os.path.join(app.config['UPLOAD_FOLDER'], networks_file)
-        if not os.path.exists(networks_filepath):
-            return jsonify({'error': 'Networks data not found. Please upload a file first.'}), 404
-        
-        with open(networks_filepath, 'r') as f:
-            networks_data = json.load(f)
-        
+def chart_curve(points, results, max_points=CURVE_POINTS):
+    """
+    The part of the optimal trade-off curve within the thresholds' missing-IP range, cut down
+    to at most max_points evenly spaced points (both ends kept). The full curve has a point
+    per object count, which would make pages and payloads grow with the analysis.
+    """
+    if results:
+        max_missing = max(r['missing_ips_included'] for r in results)
+        points = [p for p in points if p['missing_ips_included'] <= max_missing]
+    if len(points) > max_points:
+        step = (len(points) - 1) / (max_points - 1)
+        points = [points[round(i * step)] for i in range(max_points)]
+    return points
 
-        
+def summary_payload(store):
+    """
+    The stored summary as sent to the results page and /api/analysis_data: statistics only.
+    
+    Each result (and the budget) gets its network count and the /api/networks URL that pages
+    through its networks; the networks themselves are never included.
+    """
+    summary = store.summary()
+    for r in summary['results']:
+        section = threshold_section(r['threshold'])
+        if section in store:
+            section_v6 = threshold_section(r['threshold'], 6)
+            r['network_count'] = store.count(section) + (store.count(section_v6) if section_v6 in store else 0)
+            r['networks_url'] = url_for('api_networks', threshold=r['threshold'])
+    if summary.get('budget') and BUDGET_SECTION in store:
+        summary['budget']['network_count'] = store.count(BUDGET_SECTION) + store.count(BUDGET_SECTION_V6)
+        summary['budget']['networks_url'] = url_for('api_budget_networks')
+    # Older summaries (and cached analyses) may hold the full curve
+    summary['optimal_frontier'] = chart_curve(summary.get('optimal_frontier', []), summary['results'])
+    return summary
+
+def threshold_label(threshold):
+    """Output file name suffix of a threshold's consolidation"""
+    return f"{threshold}percent"
+
+def budget_label(budget):
+    """Output file name suffix of the object-budget consolidation"""
+    return f"budget{budget['max_entries']}"
+
+def budget_export_section(store, budget):
+    """The stored object-budget consolidation, read from an open store"""
+    return ExportSection(budget_label(budget), None, f"a budget of {budget['max_entries']} entries", budget,
+                         store.networks(BUDGET_SECTION), store.networks(BUDGET_SECTION_V6))
+
+def load_threshold_output(threshold, output_format):
+    """
+    Validate an output request and load that threshold's statistics and networks.
+    
+    Returns (result, networks, networks_v6, None) on success or (None, None, None, (message, status)).
+    Networks are (address, prefix) pairs read from the session's result store.
+    """
+    # Validate threshold
+    try:
+        threshold = int(threshold)
+        if threshold < 0 or threshold > 100:
+            return None, None, None, ('Invalid threshold value', 400)
+    except (ValueError, TypeError):
+        return None, None, None, ('Invalid threshold value', 400)
+    
+    # Validate output format
+    if output_format not in RENDERERS:
+        return None, None, None, ('Invalid output format', 400)
+    
+    # Open the result store; only this threshold's section is read
+    store = open_session_store()
+    if store is None:
+        return None, None, None, ('No networks data found. Please upload a file first.', 404)
+    
+    with store:
         # Find the result for the specified threshold
         result = None
-        for r in networks_data['results']:
+        for r in store.summary()['results']:
             if r['threshold'] == threshold:
                 result = r
                 break
         
         if not result:
-            return jsonify({'error': 'Threshold not found'}), 400
+            return None, None, None, ('Threshold not found', 400)
         
         # Get networks for this threshold
-        threshold_str = str(threshold)
-        if threshold_str not in networks_data['networks_by_threshold']:
-            return jsonify({'error': 'Network data not found for threshold'}), 400
+        section = threshold_section(threshold)
+        if section not in store.section_names():
+            return None, None, None, ('Network data not found for threshold', 400)
         
-        networks = networks_data['networks_by_threshold'][threshold_str]
+        section_v6 = threshold_section(threshold, 6)
+        networks_v6 = store.networks(section_v6) if section_v6 in store else []
+        return result, store.networks(section), networks_v6, None
+
+@app.route('/api/generate_output', methods=['POST'])
+def generate_output():
+    """Validate an output request and return the URL that streams it"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'Invalid request data'}), 400
         
-        # Generate output based on format
-        if output_format == 'asa':
-            # Generate ASA output
-            object_lines, group_lines = generate_asa_output(networks, threshold)
-            
-            # Create temporary file with unique naming
-            timestamp = int(time.time() * 1000000)  # Microsecond precision
-            random_suffix = os.urandom(8).hex()  # 16 character random suffix
-            output_filename = f"asa_output_{threshold}percent_{timestamp}{random_suffix}.txt"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            
-            write_asa_file(object_lines, group_lines, threshold, output_path)
-        else:  # raw format
-            # Generate raw IP addresses
-            timestamp = int(time.time() * 1000000)  # Microsecond precision
-            random_suffix = os.urandom(8).hex()  # 16 character random suffix
-            output_filename = f"raw_ips_{threshold}percent_{timestamp}{random_suffix}.txt"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            
-            with open(output_path, 'w') as f:
-                f.write(f"# Raw IP Addresses for {threshold}% threshold\n")
-                f.write(f"# Generated from uploaded file\n")
-                f.write(f"# Objects: {result['objects_defined']}\n")
-                f.write(f"# Missing IPs: {result['missing_ips_included']}\n")
-                f.write(f"# Expansion: {result['expansion_percent']:.1f}%\n\n")
-                
-                for network in networks:
-                    f.write(f"{network}\n")
+        output_format = data.get('output_format', 'asa')
+        if data.get('max_objects') not in (None, ''):
+            return generate_budget_output(data['max_objects'], output_format)
         
+        result, _, _, error = load_threshold_output(data.get('threshold', 25), output_format)
+        if error:
+            message, status = error
+            return jsonify({'error': message}), status
+        
+        threshold = result['threshold']
+        section = ExportSection(threshold_label(threshold), threshold, None, result, (), ())
         return jsonify({
             'success': True,
-            'filename': output_filename,
+            'filename': RENDERERS[output_format].filename(section),
+            'download_url': url_for('download_output', output_format=output_format, threshold=threshold),
             'objects_count': result['objects_defined'],
             'missing_ips': result['missing_ips_included'],
             'expansion_percent': result['expansion_percent']
@@ -493,78 +725,305 @@ def generate_output():
     except Exception as e:
         return jsonify({'error': f'Error generating output: {str(e)}'}), 500
 
-@app.route('/download/<filename>')
-def download_file(filename):
-    """Download generated ASA output file"""
-    try:
-        # Validate filename to prevent path traversal
-        if not filename or '..' in filename or '/' in filename or '\\' in filename:
-            flash('Invalid filename')
-            return redirect(url_for('index'))
-        
-        # Only allow specific generated file patterns
-        allowed_patterns = [
-            'asa_output_',
-            'raw_ips_'
-        ]
-        
-        # Validate that filename matches expected pattern with unique suffix
-        if not any(filename.startswith(pattern) for pattern in allowed_patterns):
-            flash('Invalid file type')
-            return redirect(url_for('index'))
-        
-        # Additional validation: ensure filename has the expected format with timestamp and random suffix
-        if not (filename.endswith('.txt') and 
-                ('percent_' in filename) and 
-                len(filename.split('_')) >= 4):  # Should have at least 4 parts: type, threshold, percent, timestamp+suffix
-            flash('Invalid filename format')
+def generate_budget_output(max_objects, output_format):
+    """Consolidate the session's hosts to an object budget, store it, and return the URL that streams it"""
+    max_objects, error = parse_max_objects(max_objects)
+    if error:
+        return jsonify({'error': error}), 400
+    if output_format not in RENDERERS:
+        return jsonify({'error': 'Invalid output format'}), 400
+    
+    store = open_session_store()
+    if store is None:
+        return jsonify({'error': 'No networks data found. Please upload a file first.'}), 404
+    
+    with store:
+        summary = store.summary()
+        budget = summary.get('budget')
+        if budget is None or budget['max_entries'] != max_objects:
+            if HOSTS_SECTION not in store:
+                return jsonify({'error': 'Host data not found. Please upload the file again.'}), 400
+            host_ips = store.intervals(HOSTS_SECTION)
+            host_ips_v6 = store.intervals(HOSTS_SECTION_V6) if HOSTS_SECTION_V6 in store else []
+        else:
+            host_ips = None
+    
+    # Budgets other than the stored one are computed now and replace it in the store
+    if host_ips is not None:
+        summary['budget'], sections, sections_v6 = budget_sections(host_ips, host_ips_v6, max_objects)
+        update_result_store(os.path.join(app.config['UPLOAD_FOLDER'], session['result_file']), summary, sections, sections_v6)
+        budget = summary['budget']
+    
+    section = ExportSection(budget_label(budget), None, None, budget, (), ())
+    return jsonify({
+        'success': True,
+        'filename': RENDERERS[output_format].filename(section),
+        'download_url': url_for('download_budget_output', output_format=output_format),
+        'entries': budget['entries'],
+        'objects_count': budget['objects_defined'],
+        'missing_ips': budget['missing_ips_included'],
+        'expansion_percent': budget['expansion_percent']
+    })
+
+@app.route('/download/<output_format>/<int:threshold>')
+def download_output(output_format, threshold):
+    """Stream generated output for a threshold; rendering starts as soon as the request arrives"""
+    result, networks, networks_v6, error = load_threshold_output(threshold, output_format)
+    if error:
+        flash(error[0])
+        return redirect(url_for('index'))
+    
+    renderer = RENDERERS[output_format]
+    section = ExportSection(threshold_label(threshold), threshold, None, result, networks, networks_v6)
+    response = Response(iter_chunks(renderer.render(section)), mimetype=renderer.mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{renderer.filename(section)}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/download/<output_format>/budget')
+def download_budget_output(output_format):
+    """Stream the stored object-budget consolidation"""
+    store = open_session_store()
+    if output_format not in RENDERERS or store is None:
+        if store is not None:
+            store.close()
+        flash('No budget output found. Please upload a file first.')
+        return redirect(url_for('index'))
+    
+    with store:
+        budget = store.summary().get('budget')
+        if budget is None:
+            flash('No budget output found. Please upload a file first.')
             return redirect(url_for('index'))
-        
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Additional security check - ensure file is within upload directory
-        real_file_path = os.path.realpath(file_path)
-        real_upload_path = os.path.realpath(app.config['UPLOAD_FOLDER'])
-        
-        if not real_file_path.startswith(real_upload_path):
-            flash('Access denied')
+        section = budget_export_section(store, budget)
+    
+    renderer = RENDERERS[output_format]
+    response = Response(iter_chunks(renderer.render(section)), mimetype=renderer.mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{renderer.filename(section)}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def bundle_sections(store, results, include_budget):
+    """Load the requested consolidations from the open store one at a time, closing it once all are read"""
+    with store:
+        for result in results:
+            threshold = result['threshold']
+            section_v6 = threshold_section(threshold, 6)
+            yield ExportSection(threshold_label(threshold), threshold, None, result,
+                                store.networks(threshold_section(threshold)),
+                                store.networks(section_v6) if section_v6 in store else [])
+        if include_budget:
+            yield budget_export_section(store, store.summary()['budget'])
+
+@app.route('/download/bundle')
+def download_bundle():
+    """
+    Stream a zip of several consolidations in several formats, reading each stored one once.
+    
+    Query parameters (comma separated, all by default): formats, and thresholds, which may
+    include "budget" for the stored object-budget consolidation.
+    """
+    formats = [name for name in request.args.get('formats', ','.join(RENDERERS)).split(',') if name]
+    if not formats or any(name not in RENDERERS for name in formats):
+        flash('Invalid output format')
+        return redirect(url_for('index'))
+    
+    store = open_session_store()
+    if store is None:
+        flash('No networks data found. Please upload a file first.')
+        return redirect(url_for('index'))
+    
+    with ExitStack() as stack:
+        stack.enter_context(store)
+        summary = store.summary()
+        results = {r['threshold']: r for r in summary['results'] if threshold_section(r['threshold']) in store}
+        has_budget = summary.get('budget') is not None
+        names = [name for name in request.args.get('thresholds', '').split(',') if name]
+        if not names:
+            names = list(results) + (['budget'] if has_budget else [])
+        try:
+            thresholds = [int(name) for name in dict.fromkeys(names) if name != 'budget']
+        except ValueError:
+            thresholds = None
+        include_budget = 'budget' in names
+        if not names or thresholds is None or any(t not in results for t in thresholds) or (include_budget and not has_budget):
+            flash('Threshold not found')
             return redirect(url_for('index'))
         
-        # Send file
-        response = send_file(
-            file_path,
-            as_attachment=True,
-            download_name=filename
-        )
-        
-        # Schedule cleanup with 30-second initial delay and retry mechanism
-        # This will wait 30 seconds, then try to delete the file and retry every 30 seconds
-        immediate_file_cleanup(file_path)
-        print(f"Scheduled cleanup for {filename} with 30-second initial delay and retries")
-        
-        return response
-    except FileNotFoundError:
-        flash('File not found')
-        return redirect(url_for('index'))
+        # The store stays open while the archive streams and is closed by bundle_sections
+        sections = bundle_sections(store, [results[t] for t in thresholds], include_budget)
+        stack.pop_all()
+    response = Response(iter_bundle(sections, list(dict.fromkeys(formats))), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="ip_consolidation_export.zip"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @app.route('/api/analysis_data')
 def get_analysis_data():
     """Get analysis data for AJAX requests"""
-    # Get file references from session
-    analysis_file = session.get('analysis_file')
+    store = open_session_store()
+    if store is None:
+        return jsonify({'error': 'No analysis data found'}), 404
+    
+    # Statistics only; each result's networks_url pages through its networks
+    with store:
+        analysis_data = summary_payload(store)
+    
+    with metrics.stage('json_serialization', endpoint='analysis_data'):
+        return jsonify(analysis_data)
+
+def parse_networks_query(args):
+    """
+    Validate /api/networks query parameters.
+    
+    Returns ((version, offset, limit, low, high), None) or (None, error message); low and high
+    are the integer start and end addresses, None when not given.
+    """
+    version = args.get('version', '4')
+    if version not in ('4', '6'):
+        return None, 'Invalid version'
+    version = int(version)
+    try:
+        offset = int(args.get('offset', 0))
+        limit = int(args.get('limit', NETWORKS_PAGE_SIZE))
+    except ValueError:
+        return None, 'Invalid offset or limit'
+    if offset < 0 or not 1 <= limit <= MAX_NETWORKS_PAGE_SIZE:
+        return None, f'Offset must be at least 0 and limit between 1 and {MAX_NETWORKS_PAGE_SIZE}'
+    
+    bounds = []
+    for name in ('start', 'end'):
+        value = args.get(name)
+        if value is None:
+            bounds.append(None)
+            continue
+        try:
+            address = ipaddress.ip_address(value)
+        except ValueError:
+            return None, f'Invalid {name} address'
+        if address.version != version:
+            return None, f'The {name} address is not an IPv{version} address'
+        bounds.append(int(address))
+    if None not in bounds and bounds[0] > bounds[1]:
+        return None, 'The start address must not be after the end address'
+    return (version, offset, limit, bounds[0], bounds[1]), None
+
+def etag_matches(etag):
+    """True when If-None-Match names etag, with or without the content-coding suffix Flask-Compress adds to it"""
+    if_none_match = request.if_none_match
+    return if_none_match.star_tag or etag in {tag.split(':', 1)[0] for tag in if_none_match.as_set(include_weak=True)}
+
+def networks_page_response(label, section, section_v6):
+    """One page of a stored consolidation's networks as JSON, answering 304 when the client's copy is current"""
+    query, error = parse_networks_query(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    version, offset, limit, low, high = query
     
-    if not analysis_file:
+    store = open_session_store()
+    if store is None:
         return jsonify({'error': 'No analysis data found'}), 404
     
-    # Load data from file
-    analysis_filepath = os.path.join(app.config['UPLOAD_FOLDER'], analysis_file)
-    if not os.path.exists(analysis_filepath):
-        return jsonify({'error': 'Analysis data not found'}), 404
+    with store:
+        if section not in store:
+            return jsonify({'error': 'Network data not found'}), 404
+        # Threshold sections never change within an analysis; the budget ones change with max_entries
+        identity = [session['result_file'], section, version, offset, limit, low, high]
+        if label == 'budget':
+            identity.append(store.summary()['budget']['max_entries'])
+        etag = hashlib.sha256(repr(identity).encode('utf-8')).hexdigest()[:32]
+        
+        if etag_matches(etag):
+            response = Response(status=304)
+        else:
+            name = section if version == 4 else section_v6
+            total, networks = store.networks_page(name, low, high, offset, limit) if name in store else (0, [])
+            if version == 4:
+                strings = [format_network(address, prefix) for address, prefix in networks]
+            else:
+                strings = [f"{format_address6(address)}/{prefix}" for address, prefix in networks]
+            response = jsonify({
+                'threshold': label,
+                'version': version,
+                'total': total,
+                'offset': offset,
+                'limit': limit,
+                'next_offset': offset + len(strings) if offset + len(strings) < total else None,
+                'networks': strings
+            })
     
-    with open(analysis_filepath, 'r') as f:
-        analysis_data = json.load(f)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/networks/<int:threshold>')
+def api_networks(threshold):
+    """
+    Page through one threshold's networks.
     
-    return jsonify(analysis_data)
+    Query parameters: version (4 or 6, default 4), offset and limit, and start/end addresses
+    keeping only networks whose address lies between them. Responses carry an ETag, and a
+    matching If-None-Match is answered with 304 without reading the networks.
+    """
+    return networks_page_response(threshold, threshold_section(threshold), threshold_section(threshold, 6))
+
+@app.route('/api/networks/budget')
+def api_budget_networks():
+    """Page through the stored object-budget networks, with the same parameters as api_networks"""
+    return networks_page_response('budget', BUDGET_SECTION, BUDGET_SECTION_V6)
+
+@app.route('/api/delta', methods=['POST'])
+def api_delta():
+    """
+    Add and remove hosts in a stored analysis without re-running it.
+    
+    Takes {"analysis_id": ..., "added": [...], "removed": [...]} with IPs or CIDRs; analysis_id
+    defaults to the session's analysis and may name no other, since the session owns (and
+    cleans up) every result file it derives. Only the address blocks the change reaches are
+    re-consolidated, and the result is stored as a new analysis whose id is returned; the
+    session moves to it and the old analysis is removed.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid request data'}), 400
+    
+    added = data.get('added', [])
+    removed = data.get('removed', [])
+    if not isinstance(added, list) or not isinstance(removed, list) or not (added or removed):
+        return jsonify({'error': 'Provide lists of IPs or CIDRs to add and/or remove'}), 400
+    
+    session_file = session.get('result_file')
+    analysis_id = data.get('analysis_id')
+    if analysis_id is None and session_file:
+        analysis_id = session_file[len('result_'):-len('.ipcs')]
+    if not isinstance(analysis_id, str) or not ANALYSIS_ID_RE.fullmatch(analysis_id):
+        return jsonify({'error': 'Invalid analysis id'}), 400
+    # Other sessions' analyses are treated as missing, so their ids reveal nothing
+    if session_file != result_filename(analysis_id):
+        return jsonify({'error': 'Analysis not found. Please upload the file again.'}), 404
+    
+    new_id = new_analysis_id()
+    try:
+        summary = apply_delta(os.path.join(app.config['UPLOAD_FOLDER'], result_filename(analysis_id)),
+                              os.path.join(app.config['UPLOAD_FOLDER'], result_filename(new_id)),
+                              added, removed, new_id, drop=(BUDGET_SECTION, BUDGET_SECTION_V6))
+    except FileNotFoundError:
+        return jsonify({'error': 'Analysis not found. Please upload the file again.'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    cleanup_session_files()
+    session['result_file'] = result_filename(new_id)
+    
+    return jsonify({
+        'success': True,
+        'analysis_id': new_id,
+        'host_ips_count': summary['host_ips_count'],
+        'delta': summary['delta'],
+        'recommended': summary['recommended'],
+        'results': summary['results'],
+        'frontier': summary['frontier']
+    })
 
 @app.route('/api/cleanup', methods=['POST'])
 def api_cleanup():
@@ -572,12 +1031,23 @@ def api_cleanup():
     try:
         cleanup_uploads()
         # Clear session data
-        session.pop('analysis_file', None)
-        session.pop('networks_file', None)
+        session.pop('result_file', None)
         return jsonify({'success': True, 'message': 'Uploads directory and session data cleaned successfully'})
     except Exception as e:
         return jsonify({'error': f'Error cleaning up: {str(e)}'}), 500
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of stage timings and counters"""
+    response = Response(metrics.REGISTRY.render_prometheus(), mimetype='text/plain; version=0.0.4')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/cache_stats')
+def api_cache_stats():
+    """Report analysis cache hit/miss counts and sizes"""
+    return jsonify(analysis_cache.stats())
+
 @app.route('/api/compression-test')
 def api_compression_test():
     """Test endpoint to demonstrate compression with large JSON response"""
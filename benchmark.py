@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the consolidation pipeline.
+Generates seeded synthetic corpora, times and memory-profiles each stage at several
+input sizes, saves the results as JSON and gates them against a stored baseline.
+
+Usage:
+	python benchmark.py --save-baseline                 # record benchmark_baseline.json
+	python benchmark.py --tolerance 0.25                # exit 1 if a stage regressed >25%
+	python benchmark.py --corpora dense,sparse --sizes 1000,50000 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+from analysis import analyze_consolidation
+from core_consolidation import (
+	_np_backend, _scan_tokens, consolidate_networks, consolidate_with_bias, extract_host_ips, scan_host_intervals,
+)
+from output_generator import generate_asa_output
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# Threshold used by the bias and analysis stages
+BENCHMARK_THRESHOLD = 25
+
+# Stages faster than this are too noisy to gate on
+MIN_GATED_SECONDS = 0.005
+
+# The plain address pattern the scanner grew from; the tokenize stage must keep pace with it on
+# corpora without firewall syntax, where there are no masks or ranges to read
+ADDRESS_RE = re.compile(r'\b([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})(?:/([0-9]{1,2}))?\b', re.ASCII)
+
+def _address(value: int) -> str:
+	return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+def _public_address(rng: random.Random) -> int:
+	"""A random address outside 0/8, 127/8 and multicast/reserved space."""
+	while True:
+		value = rng.getrandbits(32)
+		if 1 <= value >> 24 < 224 and value >> 24 != 127:
+			return value
+
+# Each generator returns text with roughly `size` host addresses in it
+
+def dense_clusters(rng: random.Random, size: int) -> str:
+	"""Hosts packed into random /24s, each 80-100% full: collapses and climbs well."""
+	lines = []
+	while len(lines) < size:
+		base = _public_address(rng) & 0xFFFFFF00
+		for host in rng.sample(range(1, 255), rng.randint(203, 254)):
+			lines.append(_address(base | host))
+	return '\n'.join(lines[:size]) + '\n'
+
+def sparse_hosts(rng: random.Random, size: int) -> str:
+	"""Hosts scattered uniformly over public space: almost nothing merges."""
+	return '\n'.join(_address(_public_address(rng)) for _ in range(size)) + '\n'
+
+def large_cidrs(rng: random.Random, size: int) -> str:
+	"""A few large CIDR blocks (/16 to /24) cover most addresses, with stray hosts between them."""
+	lines = []
+	covered = 0
+	while covered < size:
+		if rng.random() < 0.8:
+			prefix = rng.randint(16, 24)
+			lines.append(f"{_address(_public_address(rng) & (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF)}/{prefix}")
+			covered += 1 << (32 - prefix)
+		else:
+			lines.append(_address(_public_address(rng)))
+			covered += 1
+	return '\n'.join(lines) + '\n'
+
+def noisy_logs(rng: random.Random, size: int) -> str:
+	"""Syslog-style lines where most dotted numbers are versions, OIDs, times or invalid octets."""
+	lines = []
+	for i in range(size):
+		noise = rng.choice((
+			f"version {rng.randint(1, 20)}.{rng.randint(0, 99)}.{rng.randint(0, 999)}",
+			f"oid 1.3.6.1.4.1.{rng.randint(1, 99999)}.{rng.randint(1, 99)}.{rng.randint(1, 9)}",
+			f"peer {rng.randint(256, 999)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}",
+			f"ratio {rng.random():.6f} load {rng.randint(0, 99)}.{rng.randint(0, 99)}",
+		))
+		lines.append(
+			f"Jan {rng.randint(1, 28):2d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}.{rng.randint(0, 999):03d} "
+			f"fw{i % 16} %ASA-6-302013: Built connection {rng.getrandbits(32)} for {_address(_public_address(rng))}/{rng.randint(1024, 65535)} "
+			f"{noise} build 4.{rng.randint(0, 9)}.{rng.randint(0, 99)}.{rng.randint(0, 999)}"
+		)
+	return '\n'.join(lines) + '\n'
+
+def asa_config(rng: random.Random, size: int) -> str:
+	"""ASA objects and ACLs where every subnet is followed by a dotted netmask and wildcard."""
+	lines = []
+	for i in range(size):
+		address = _public_address(rng)
+		kind = rng.random()
+		if kind < 0.4:
+			lines.append(f"object network obj-{i}")
+			lines.append(f" host {_address(address)}")
+		elif kind < 0.8:
+			prefix = rng.randint(24, 30)
+			mask = (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF
+			lines.append(f" network-object {_address(address & mask)} {_address(mask)}")
+		else:
+			lines.append(f"access-list outside extended permit ip host {_address(address)} 0.0.0.0 255.255.255.255 eq 443")
+	return '\n'.join(lines) + '\n'
+
+CORPORA: Dict[str, Callable[[random.Random, int], str]] = {
+	'dense': dense_clusters,
+	'sparse': sparse_hosts,
+	'large_cidrs': large_cidrs,
+	'noisy_logs': noisy_logs,
+	'asa_config': asa_config,
+}
+
+# Corpora gated on tokenize keeping pace with address_regex, and the fewest runs of each
+PARITY_CORPORA = ('dense', 'sparse', 'large_cidrs', 'noisy_logs')
+PARITY_REPEAT = 7
+
+def measure(fn: Callable, repeat: int) -> Dict:
+	"""Best wall time over repeat runs, then one run under tracemalloc for peak Python memory."""
+	best = float('inf')
+	for _ in range(repeat):
+		started = time.perf_counter()
+		result = fn()
+		best = min(best, time.perf_counter() - started)
+	tracemalloc.start()
+	try:
+		fn()
+		_, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return {'seconds': best, 'peak_bytes': peak, 'result': result}
+
+def measure_interleaved(first: Callable, second: Callable, repeat: int) -> Tuple[Dict, Dict]:
+	"""measure() for two functions compared with each other, alternating their runs so machine noise hits both alike."""
+	measured = [{'seconds': float('inf')}, {'seconds': float('inf')}]
+	for _ in range(repeat):
+		for fn, stage in zip((first, second), measured):
+			started = time.perf_counter()
+			stage['result'] = fn()
+			stage['seconds'] = min(stage['seconds'], time.perf_counter() - started)
+	for fn, stage in zip((first, second), measured):
+		tracemalloc.start()
+		try:
+			fn()
+			_, stage['peak_bytes'] = tracemalloc.get_traced_memory()
+		finally:
+			tracemalloc.stop()
+	return measured[0], measured[1]
+
+def benchmark_corpus(name: str, size: int, seed: int, repeat: int) -> Tuple[Dict[str, Dict], Dict]:
+	"""
+	Generate one corpus and measure every stage on it; each stage gets the previous stage's output.
+
+	Returns (stage measurements, corpus statistics).
+	"""
+	text = CORPORA[name](random.Random(f"{seed}:{name}:{size}"), size)
+	fd, path = tempfile.mkstemp(suffix='.txt', prefix=f'bench_{name}_')
+	try:
+		with os.fdopen(fd, 'w') as f:
+			f.write(text)
+
+		stages = {}
+		stages['address_regex'], stages['tokenize'] = measure_interleaved(
+			lambda: len(ADDRESS_RE.findall(text)), lambda: len(_scan_tokens(text)), max(repeat, PARITY_REPEAT))
+		extracted = measure(lambda: extract_host_ips(path), repeat)
+		stages['extract_host_ips'] = extracted
+		scanned = measure(lambda: scan_host_intervals(path), repeat)
+		stages['scan_host_intervals'] = scanned
+	finally:
+		os.unlink(path)
+
+	intervals = scanned['result']
+	stages['consolidate_networks'] = measure(lambda: consolidate_networks(intervals), repeat)
+	biased = measure(lambda: consolidate_with_bias(intervals, BENCHMARK_THRESHOLD), repeat)
+	stages['consolidate_with_bias'] = biased
+	stages['analyze_consolidation'] = measure(lambda: analyze_consolidation(intervals, BENCHMARK_THRESHOLD), repeat)
+	network_strings = [str(net) for net in biased['result']]
+	stages['generate_asa_output'] = measure(lambda: generate_asa_output(network_strings, BENCHMARK_THRESHOLD), repeat)
+
+	return {
+		stage: {'seconds': measured['seconds'], 'peak_bytes': measured['peak_bytes']}
+		for stage, measured in stages.items()
+	}, {'bytes': len(text), 'tokens': len(extracted['result']), 'intervals': len(intervals)}
+
+def run_benchmarks(corpora: List[str], sizes: List[int], seed: int = 0, repeat: int = 3, log=print) -> Dict:
+	"""Benchmark every corpus at every size; results are keyed 'corpus/size' then by stage."""
+	results = {}
+	for name in corpora:
+		for size in sizes:
+			key = f"{name}/{size}"
+			stages, corpus = benchmark_corpus(name, size, seed, repeat)
+			results[key] = {'corpus': corpus, 'stages': stages}
+			log(f"{key}: " + ', '.join(f"{stage} {measured['seconds'] * 1000:.1f}ms/{measured['peak_bytes'] / 1048576:.1f}MB"
+			                             for stage, measured in stages.items()))
+	return {
+		'environment': {
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'backend': 'numpy' if _np_backend is not None else 'python',
+			'seed': seed,
+			'repeat': repeat,
+		},
+		'results': results,
+	}
+
+def compare_to_baseline(current: Dict, baseline: Dict, tolerance: float, memory_tolerance: float) -> List[str]:
+	"""
+	List the stages that regressed: slower than baseline by more than tolerance, or using more
+	peak memory than baseline by more than memory_tolerance (both fractions, 0.25 = 25%).
+	Stages under MIN_GATED_SECONDS are not timed against it; missing_from_baseline lists the
+	stages it has no measurement for.
+	"""
+	regressions = []
+	for key, result in current['results'].items():
+		baseline_stages = baseline.get('results', {}).get(key, {}).get('stages', {})
+		for stage, measured in result['stages'].items():
+			previous = baseline_stages.get(stage)
+			if previous is None:
+				continue
+			if max(measured['seconds'], previous['seconds']) >= MIN_GATED_SECONDS and \
+					measured['seconds'] > previous['seconds'] * (1 + tolerance):
+				regressions.append(f"{key} {stage}: {previous['seconds'] * 1000:.1f}ms -> {measured['seconds'] * 1000:.1f}ms")
+			if measured['peak_bytes'] > previous['peak_bytes'] * (1 + memory_tolerance):
+				regressions.append(f"{key} {stage}: peak {previous['peak_bytes']} -> {measured['peak_bytes']} bytes")
+	return regressions
+
+def missing_from_baseline(current: Dict, baseline: Dict) -> List[str]:
+	"""
+	List the corpus/size keys and stages of current that baseline has no measurement for, since
+	compare_to_baseline cannot gate them. When nothing overlaps at all, that is listed too.
+	"""
+	missing = []
+	compared = 0
+	baseline_results = baseline.get('results', {})
+	for key, result in current['results'].items():
+		if key not in baseline_results:
+			missing.append(f"{key}: not in baseline")
+			continue
+		baseline_stages = baseline_results[key].get('stages', {})
+		for stage in result['stages']:
+			if stage in baseline_stages:
+				compared += 1
+			else:
+				missing.append(f"{key} {stage}: not in baseline")
+	if not compared:
+		missing.append(f"no stage of this run is in the baseline (it has {', '.join(baseline_results) or 'no results'})")
+	return missing
+
+def compare_scanner_parity(current: Dict, tolerance: float) -> List[str]:
+	"""
+	List the PARITY_CORPORA where the scanner's tokenizer (tokenize) is slower than the plain
+	address pattern (address_regex) by more than tolerance. Needs no baseline, since both run on this machine.
+	"""
+	regressions = []
+	for key, result in current['results'].items():
+		if key.split('/')[0] not in PARITY_CORPORA:
+			continue
+		reference = result['stages'].get('address_regex')
+		scanned = result['stages'].get('tokenize')
+		if reference is None or scanned is None:
+			continue
+		if max(scanned['seconds'], reference['seconds']) >= MIN_GATED_SECONDS and \
+				scanned['seconds'] > reference['seconds'] * (1 + tolerance):
+			regressions.append(f"{key} tokenize: {scanned['seconds'] * 1000:.1f}ms against "
+			                   f"{reference['seconds'] * 1000:.1f}ms for address_regex")
+	return regressions
+
+def _csv(value: str, cast=str) -> list:
+	return [cast(part) for part in value.split(',') if part.strip()]
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(description='Benchmark the consolidation stages on synthetic corpora.')
+	parser.add_argument('--corpora', type=_csv, default=list(CORPORA), help=f"Comma-separated subset of: {', '.join(CORPORA)}")
+	parser.add_argument('--sizes', type=lambda value: _csv(value, int), default=DEFAULT_SIZES,
+	                    help='Comma-separated host counts per corpus (default: %(default)s)')
+	parser.add_argument('--seed', type=int, default=0, help='Generator seed')
+	parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage; the best is kept')
+	parser.add_argument('--output', help='Write results JSON here')
+	parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON to compare against (default: %(default)s)')
+	parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline instead of comparing')
+	parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown as a fraction (default: %(default)s)')
+	parser.add_argument('--memory-tolerance', type=float, default=0.25, help='Allowed peak memory growth as a fraction (default: %(default)s)')
+	args = parser.parse_args(argv)
+
+	unknown = [name for name in args.corpora if name not in CORPORA]
+	if unknown:
+		parser.error(f"unknown corpora: {', '.join(unknown)}")
+
+	current = run_benchmarks(args.corpora, args.sizes, args.seed, max(1, args.repeat))
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(current, f, indent=2)
+
+	parity = compare_scanner_parity(current, args.tolerance)
+	for regression in parity:
+		print(f"REGRESSION {regression}")
+
+	if args.save_baseline:
+		with open(args.baseline, 'w') as f:
+			json.dump(current, f, indent=2)
+		print(f"Baseline written to {args.baseline}")
+		return 1 if parity else 0
+
+	# A gate without a baseline has checked nothing, so it fails until one is recorded explicitly
+	if not os.path.exists(args.baseline):
+		print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+		return 1
+
+	with open(args.baseline, 'r') as f:
+		baseline = json.load(f)
+	if baseline.get('environment', {}).get('backend') != current['environment']['backend']:
+		print(f"Warning: baseline used the {baseline.get('environment', {}).get('backend')} backend, "
+		      f"this run used {current['environment']['backend']}")
+
+	# Stages the baseline never measured would otherwise pass unchecked
+	missing = missing_from_baseline(current, baseline)
+	for entry in missing:
+		print(f"MISSING {entry}")
+	regressions = compare_to_baseline(current, baseline, args.tolerance, args.memory_tolerance)
+	for regression in regressions:
+		print(f"REGRESSION {regression}")
+	if parity or missing or regressions:
+		return 1
+	print(f"No regressions against {args.baseline}")
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Command-line batch consolidation.
+Consolidates every matching file across a process pool, writing per-file ASA and raw
+output plus one JSON summary, and skips files whose content is unchanged since the last run.
+
+Usage:
+	python cli.py configs/ -o consolidated
+	python cli.py "configs/**/*.cfg" --threshold 25 --format asa --workers 8
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from analysis import DEFAULT_THRESHOLDS, run_consolidation_analysis
+from core_consolidation import count_hosts, scan_dual_stack
+from output_generator import iter_chunks, render_asa_lines, render_raw_lines
+
+# Output filename prefix for each format, matching the web downloads
+OUTPUT_FORMATS = {'asa': 'asa_output', 'raw': 'raw_ips'}
+
+MANIFEST_NAME = 'manifest.json'
+SUMMARY_NAME = 'summary.json'
+
+# Read size when hashing input files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_sha256(path: str) -> str:
+	"""SHA-256 of a file, read in chunks."""
+	hasher = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+			hasher.update(chunk)
+	return hasher.hexdigest()
+
+def collect_inputs(patterns: List[str], exclude: Optional[str] = None) -> List[str]:
+	"""
+	Expand directories (every file inside, recursively) and glob patterns into a sorted list of files.
+
+	Nothing inside the exclude directory is collected, so a run never reads its own outputs.
+	"""
+	exclude = os.path.abspath(exclude) if exclude else None
+
+	def excluded(path: str) -> bool:
+		return exclude is not None and (path == exclude or path.startswith(exclude + os.sep))
+
+	paths = set()
+	for pattern in patterns:
+		if os.path.isdir(pattern):
+			for root, dirnames, filenames in os.walk(pattern):
+				dirnames[:] = [name for name in dirnames if not excluded(os.path.abspath(os.path.join(root, name)))]
+				paths.update(os.path.join(root, filename) for filename in filenames)
+		else:
+			paths.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+	return sorted(path for path in (os.path.abspath(path) for path in paths) if not excluded(path))
+
+def output_names(paths: List[str]) -> Dict[str, str]:
+	"""Map each input to its output directory name: the file name, plus a path hash when names collide."""
+	basenames = [os.path.basename(path) for path in paths]
+	names = {}
+	for path, basename in zip(paths, basenames):
+		if basenames.count(basename) > 1:
+			basename = f"{basename}_{hashlib.sha256(path.encode('utf-8')).hexdigest()[:8]}"
+		names[path] = basename
+	return names
+
+def consolidate_file(path: str, output_dir: str, thresholds: List[int], threshold: Optional[int],
+                     formats: List[str]) -> Dict:
+	"""
+	Worker entry point: analyze one file and write its output files into output_dir.
+
+	Writes the given threshold, or the recommended one when threshold is None. Returns the
+	file's summary entry.
+	"""
+	started = time.perf_counter()
+	host_ips, host_ips_v6 = scan_dual_stack(path)
+	if not host_ips and not host_ips_v6:
+		raise ValueError('No host IPs found in the file')
+	results, frontier = run_consolidation_analysis(host_ips, thresholds=thresholds, host_ips_v6=host_ips_v6)
+
+	recommended = min(frontier, key=lambda r: r['score'])
+	chosen = recommended if threshold is None else next(r for r in results if r['threshold'] == threshold)
+	networks = [(int(net.network_address), net.prefixlen) for net in chosen['networks'] if net.version == 4]
+	networks_v6 = [(int(net.network_address), net.prefixlen) for net in chosen['networks'] if net.version == 6]
+
+	os.makedirs(output_dir, exist_ok=True)
+	outputs = []
+	for output_format in formats:
+		if output_format == 'asa':
+			lines = render_asa_lines(networks, chosen['threshold'], networks_v6)
+		else:  # raw format
+			lines = render_raw_lines(networks, chosen['threshold'], chosen, networks_v6)
+		output_path = os.path.join(output_dir, f"{OUTPUT_FORMATS[output_format]}_{chosen['threshold']}percent.txt")
+		with open(output_path, 'wb') as f:
+			for chunk in iter_chunks(lines):
+				f.write(chunk)
+		outputs.append(output_path)
+
+	return {
+		'host_ips_count': count_hosts(host_ips) + count_hosts(host_ips_v6),
+		'threshold': chosen['threshold'],
+		'recommended_threshold': recommended['threshold'],
+		'objects_defined': chosen['objects_defined'],
+		'missing_ips_included': chosen['missing_ips_included'],
+		'expansion_percent': chosen['expansion_percent'],
+		'outputs': outputs,
+		'seconds': time.perf_counter() - started
+	}
+
+def load_manifest(path: str, options: Dict) -> Dict[str, Dict]:
+	"""Previous run's entries by input path; empty when missing, unreadable or made with other options."""
+	try:
+		with open(path, 'r') as f:
+			manifest = json.load(f)
+	except (OSError, ValueError):
+		return {}
+	if manifest.get('options') != options:
+		return {}
+	return manifest.get('files', {})
+
+def write_json(path: str, data: Dict):
+	"""Write JSON through a temporary file so an interrupted run never leaves a truncated file."""
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(data, f, indent=2)
+	os.replace(tmp_path, path)
+
+def run_batch(paths: List[str], output_root: str, thresholds: List[int], threshold: Optional[int] = None,
+              formats: Optional[List[str]] = None, workers: int = 1, force: bool = False, log=print) -> Dict:
+	"""
+	Consolidate paths on a pool of worker processes and write the summary and manifest.
+
+	Files whose SHA-256 matches the manifest entry from a previous run with the same options,
+	and whose outputs still exist, are skipped and keep their previous summary entry.
+	Returns the summary, whose 'totals' include files/s and IPs/s for the files processed.
+	"""
+	formats = formats or list(OUTPUT_FORMATS)
+	options = {'thresholds': thresholds, 'threshold': threshold, 'formats': formats}
+	output_root = os.path.abspath(output_root)
+	os.makedirs(output_root, exist_ok=True)
+	manifest_path = os.path.join(output_root, MANIFEST_NAME)
+	previous = {} if force else load_manifest(manifest_path, options)
+
+	started = time.perf_counter()
+	names = output_names(paths)
+	entries = {}
+	pending = {}
+	for path in paths:
+		content_hash = file_sha256(path)
+		entry = previous.get(path)
+		if entry and entry.get('sha256') == content_hash and entry.get('status') == 'ok' and \
+				all(os.path.exists(output) for output in entry['outputs']):
+			entries[path] = dict(entry, status='skipped')
+		else:
+			pending[path] = content_hash
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = {
+			executor.submit(consolidate_file, path, os.path.join(output_root, names[path]), thresholds, threshold, formats): path
+			for path in pending
+		}
+		for done, future in enumerate(as_completed(futures), 1):
+			path = futures[future]
+			try:
+				entry = dict(future.result(), status='ok')
+				log(f"[{done}/{len(futures)}] {path}: {entry['host_ips_count']} IPs -> "
+				    f"{entry['objects_defined']} objects at {entry['threshold']}% ({entry['seconds']:.2f}s)")
+			except Exception as e:
+				entry = {'status': 'error', 'error': str(e)}
+				log(f"[{done}/{len(futures)}] {path}: error: {e}")
+			entries[path] = dict(entry, sha256=pending[path])
+	elapsed = time.perf_counter() - started
+
+	processed = [entries[path] for path in pending if entries[path]['status'] == 'ok']
+	processed_ips = sum(entry['host_ips_count'] for entry in processed)
+	summary = {
+		'files': [dict(entries[path], path=path) for path in paths],
+		'totals': {
+			'files': len(paths),
+			'processed': len(processed),
+			'skipped': len(paths) - len(pending),
+			'failed': len(pending) - len(processed),
+			'host_ips': processed_ips,
+			'seconds': elapsed,
+			'files_per_second': len(processed) / elapsed if elapsed > 0 else 0.0,
+			'ips_per_second': processed_ips / elapsed if elapsed > 0 else 0.0
+		}
+	}
+	write_json(os.path.join(output_root, SUMMARY_NAME), summary)
+	write_json(manifest_path, {
+		'options': options,
+		'files': {path: dict(entry, status='ok') for path, entry in entries.items() if entry['status'] != 'error'}
+	})
+	return summary
+
+def parse_threshold(value: str) -> int:
+	try:
+		threshold = int(value)
+	except ValueError:
+		threshold = None
+	if threshold is None or threshold < 0 or threshold > 100:
+		raise argparse.ArgumentTypeError('threshold must be an integer between 0 and 100')
+	return threshold
+
+def parse_thresholds(value: str) -> List[int]:
+	thresholds = sorted({int(part) for part in value.split(',') if part.strip()})
+	if not thresholds or any(t < 0 or t > 100 for t in thresholds):
+		raise argparse.ArgumentTypeError('thresholds must be comma-separated integers between 0 and 100')
+	return thresholds
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(description='Consolidate the host IPs of many configuration files in parallel.')
+	parser.add_argument('inputs', nargs='+', help='Files, directories or glob patterns ("**" recurses)')
+	parser.add_argument('-o', '--output-dir', default='consolidated', help='Directory for outputs, summary and manifest')
+	parser.add_argument('-t', '--threshold', type=parse_threshold, help='Threshold to write (default: each file\'s recommended one)')
+	parser.add_argument('--thresholds', type=parse_thresholds, default=DEFAULT_THRESHOLDS,
+	                    help='Comma-separated thresholds to analyze (default: %(default)s)')
+	parser.add_argument('-f', '--format', choices=['asa', 'raw', 'both'], default='both', help='Output format')
+	parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+	parser.add_argument('--force', action='store_true', help='Reprocess files even when unchanged')
+	args = parser.parse_args(argv)
+
+	thresholds = args.thresholds
+	if args.threshold is not None and args.threshold not in thresholds:
+		thresholds = sorted(thresholds + [args.threshold])
+
+	paths = collect_inputs(args.inputs, exclude=args.output_dir)
+	if not paths:
+		print('No input files found', file=sys.stderr)
+		return 1
+
+	summary = run_batch(paths, args.output_dir, thresholds, args.threshold,
+	                    list(OUTPUT_FORMATS) if args.format == 'both' else [args.format],
+	                    max(1, args.workers), args.force)
+
+	totals = summary['totals']
+	print(f"{totals['files']} files: {totals['processed']} processed, {totals['skipped']} unchanged, "
+	      f"{totals['failed']} failed in {totals['seconds']:.2f}s")
+	print(f"Throughput: {totals['files_per_second']:.2f} files/s, {totals['ips_per_second']:.0f} IPs/s")
+	print(f"Summary written to {os.path.join(args.output_dir, SUMMARY_NAME)}")
+	return 1 if totals['failed'] else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
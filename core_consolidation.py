@@ -1,146 +1,1074 @@
 #!/usr/bin/env python3
 """
 Core consolidation logic for network IP consolidation.
-Handles basic CIDR consolidation and bias-based expansion.
+Handles basic CIDR consolidation and bias-based expansion for IPv4 and IPv6.
 """
 
+import bisect
+import heapq
+import io
 import ipaddress
+import itertools
+import mmap
 import re
 import os
-from typing import List
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-def extract_host_ips(filename: str, chunk_size: int = 10000) -> List[str]:
-    """Extract all IP addresses and CIDR networks from any file format using chunked processing."""
-    host_ips = []
-    # Pattern for individual IPs and CIDR networks
-    ip_pattern = r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}(?:/[0-9]{1,2})?\b'
+import metrics
+from decompression import file_compression, iter_decompressed, open_decompressed
+from roaring import RoaringBitmap
+
+# Use the vectorized NumPy backend when available, otherwise the pure-Python path
+try:
+    import numpy_backend as _np_backend
+except ImportError:
+    _np_backend = None
+
+# Contiguous netmasks (255.255.0.0) and ACL wildcard masks (0.0.255.255) as dotted quads
+_NETMASK_OCTETS = '254|252|248|240|224|192|128'
+_WILDCARD_OCTETS = '127|63|31|15|7|3|1'
+_MASK_QUAD = (
+    rf'255\.255\.255\.(?:255|{_NETMASK_OCTETS}|0)|255\.255\.(?:{_NETMASK_OCTETS}|0)\.0'
+    rf'|255\.(?:{_NETMASK_OCTETS}|0)\.0\.0|(?:{_NETMASK_OCTETS})\.0\.0\.0'
+    rf'|0\.0\.0\.(?:255|{_WILDCARD_OCTETS}|0)|0\.0\.(?:255|{_WILDCARD_OCTETS})\.255'
+    rf'|0\.(?:255|{_WILDCARD_OCTETS})\.255\.255|(?:{_WILDCARD_OCTETS})\.255\.255\.255'
+)
+
+# Lines in ASA/IOS/iptables syntax, the only place a dotted quad after an address is its mask:
+# object members, ACL entries (optionally numbered), routes, interface and OSPF networks, rules
+_CONFIG_KEYWORDS = (
+    r'(?:[0-9]+[ \t]+)?(?:network-object|subnet|range|access-list|permit|deny|ip[ \t]+address'
+    r'|ip[ \t]+route|route|network|iptables|ip6tables|-A|-I)[ \t]'
+)
+
+# Comment lines, whose addresses are skipped, and config lines (group 1 set), read with CONFIG_RE.
+# Found in a pass of their own: a ^ branch in the scanner would cost it a second try at every position
+LINE_PATTERN = rf'(?m)^[ \t\r\f\v]*(?:#|({_CONFIG_KEYWORDS})).*$'
+
+# Cheap tests for the line pass: comments, what every config keyword contains (an "e", or the
+# "-" of iptables-save's "-A" and "-I"), and ranges
+_LINE_MARKERS = ('#', 'e', '-', 'range')
+_LINE_MARKER_BYTES = tuple(marker.encode('ascii') for marker in _LINE_MARKERS)
+
+_OCTETS = r'([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})'
+_DOTTED_QUAD = r'[0-9]{1,3}(?:\.[0-9]{1,3}){3}'
+_IPV6_PATTERN = (
+    r'(?<![0-9A-Za-z:.])(?=[0-9A-Fa-f]{0,4}:)((?:[0-9A-Fa-f]{1,4})?(?::[0-9A-Fa-f]{0,4}){2,7}(?:(?<=[0-9])(?:\.[0-9]{1,3}){3})?)'
+    r'(?:/([0-9]{1,3}))?(?![0-9A-Za-z:])'
+)
+
+# Scanner pattern for everything outside comment and config lines. Groups 1-4 capture an IPv4
+# address's octets and group 5 an optional prefix length; groups 6-7 an IPv6 candidate,
+# validated in token_interval6. A dotted quad after an address is just another address here.
+SCAN_IPV4_PATTERN = rf'\b{_OCTETS}(?:/([0-9]{{1,2}}))?\b'
+SCAN_PATTERN = SCAN_IPV4_PATTERN + '|' + _IPV6_PATTERN
+
+# Pattern for the tokens of one config line. Groups 1-4 capture the address after "host",
+# which never takes a mask; groups 5-8 an address with an optional prefix length or
+# contiguous mask in groups 9-10 ("a/24", "a 255.255.255.0", "network a mask m", ACL
+# wildcards "a 0.0.0.255", iptables "a/255.0.0.0"). Groups 11-12 capture the ends of a range
+# (ASA "range a b", iptables "--src-range a-b"); groups 13-14 an IPv6 candidate. The keyword
+# branches check their boundary after the literal, so other positions are rejected quickly.
+CONFIG_IPV4_PATTERN = (
+    rf'host(?<![0-9A-Za-z-]host)[ \t]+\b{_OCTETS}\b'
+    rf'|\b{_OCTETS}(?:/([0-9]{{1,2}})\b|[ \t/][ \t]*(?:mask[ \t]+)?({_MASK_QUAD})\b|\b)'
+    rf'|range(?<![0-9A-Za-z]range)[ \t]+({_DOTTED_QUAD})(?:[ \t]+|-)({_DOTTED_QUAD})\b'
+)
+CONFIG_PATTERN = CONFIG_IPV4_PATTERN + '|' + _IPV6_PATTERN
+
+# The patterns for raw bytes (uploads, memory-mapped files), and the IPv4-only ones for decoded lines
+SCAN_RE = re.compile(SCAN_PATTERN.encode('ascii'))
+LINE_RE = re.compile(LINE_PATTERN.encode('ascii'))
+CONFIG_RE = re.compile(CONFIG_PATTERN.encode('ascii'))
+SCAN_IPV4_RE = re.compile(SCAN_IPV4_PATTERN.encode('ascii'))
+CONFIG_IPV4_RE = re.compile(CONFIG_IPV4_PATTERN.encode('ascii'))
+
+# Every valid IPv6 address has a "::" or at least six colons, so five hex groups between two
+# colons. Bytes without either are scanned with the IPv4 patterns: the IPv6 branch would
+# otherwise be tried at every position and double the cost of scanning IPv4-only logs
+IPV6_HINT_RE = re.compile(rb':(?::|(?:[0-9A-Fa-f]{1,4}:){5})')
+SCAN_TEXT_RE = re.compile(SCAN_IPV4_PATTERN, re.ASCII)
+LINE_TEXT_RE = re.compile(LINE_PATTERN, re.ASCII)
+CONFIG_TEXT_RE = re.compile(CONFIG_IPV4_PATTERN, re.ASCII)
+
+# Segment size for memory-mapped scanning and progress reporting
+SCAN_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Inputs at least this large spill sorted interval runs to temporary files while scanning
+SPILL_MIN_BYTES = 512 * 1024 * 1024
+
+# Smaller segments when spilling, so one segment's regex matches stay small
+SPILL_SEGMENT_SIZE = 16 * 1024 * 1024
+
+# Intervals buffered before a sorted run is spilled, and runs on disk before they are merged into one
+SPILL_RUN_INTERVALS = 1000000
+SPILL_MAX_RUNS = 64
+
+# Intervals per read or write of a spilled run
+SPILL_IO_INTERVALS = 65536
+
+# Valid octet spellings (no leading zeros) as str and bytes, mapped to their values
+_OCTET_VALUES = {spelling: value for value in range(256) for spelling in (str(value), str(value).encode())}
+
+# Prefix length of each netmask and wildcard mask; netmasks are also excluded as lone addresses.
+# All zeros and all ones are read as host masks (wildcard 0.0.0.0, netmask 255.255.255.255),
+# so "0.0.0.0 0.0.0.0" (any) is never /0
+_NETMASK_PREFIXES = {(0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF: prefix for prefix in range(33)}
+MASK_PREFIXES = {
+    **{mask ^ 0xFFFFFFFF: prefix for mask, prefix in _NETMASK_PREFIXES.items()},
+    **_NETMASK_PREFIXES,
+    0: 32
+}
+
+# Every mask as a SCAN_TEXT_RE, SCAN_IPV4_RE and SCAN_RE token; a mask with a prefix length reads the same everywhere
+_MASK_TOKENS = frozenset(
+    tuple(str(octet) for octet in mask.to_bytes(4, 'big')) + ('',) for mask in MASK_PREFIXES
+) | frozenset(
+    tuple(str(octet).encode() for octet in mask.to_bytes(4, 'big')) + (b'',) * padding
+    for mask in MASK_PREFIXES for padding in (1, 3)
+)
+
+# Address width and the shortest prefix the bias climb may reach, per IP version
+ADDRESS_BITS = {4: 32, 6: 128}
+CLIMB_FLOOR = {4: 8, 6: 32}
+
+_ADDRESS_CLASSES = {4: ipaddress.IPv4Address, 6: ipaddress.IPv6Address}
+_NETWORK_CLASSES = {4: ipaddress.IPv4Network, 6: ipaddress.IPv6Network}
+
+Interval = Tuple[int, int]
+
+# Called as progress_callback(stage, percent) by long-running functions
+ProgressCallback = Callable[[str, float], None]
+
+def _iter_line_chunks(filename: str, chunk_size: int, progress_callback: Optional[ProgressCallback] = None) -> Iterator[List[str]]:
+    """
+    Yield lists of up to chunk_size lines from a file, reporting progress as it goes.
     
+    gzip, bz2, xz and zip files are decompressed while they are read.
+    """
     # Get file size for progress estimation
     file_size = os.path.getsize(filename)
-    processed_bytes = 0
     
-    with open(filename, 'r', encoding='utf-8', errors='ignore') as file:
+    with open(filename, 'rb') as raw, io.TextIOWrapper(open_decompressed(raw), encoding='utf-8', errors='ignore') as file:
         chunk = []
         for line_num, line in enumerate(file, 1):
             chunk.append(line)
-            processed_bytes += len(line.encode('utf-8'))
             
             # Process chunk when it reaches the specified size
             if len(chunk) >= chunk_size:
-                host_ips.extend(process_chunk(chunk, ip_pattern))
+                metrics.inc('lines_scanned', len(chunk))
+                yield chunk
                 chunk = []
                 
-                # Optional: Log progress for very large files
-                if file_size > 10 * 1024 * 1024:  # 10MB
-                    progress = (processed_bytes / file_size) * 100
-                    print(f"Processing progress: {progress:.1f}%")
+                # Progress follows the (possibly compressed) bytes read from disk
+                progress = (raw.tell() / file_size) * 100
+                if progress_callback:
+                    progress_callback('Extracting IP addresses', progress)
         
         # Process remaining lines
         if chunk:
-            host_ips.extend(process_chunk(chunk, ip_pattern))
+            metrics.inc('lines_scanned', len(chunk))
+            yield chunk
+        metrics.inc('bytes_scanned', file_size)
+
+def extract_host_ips(filename: str, chunk_size: int = 10000, progress_callback: Optional[ProgressCallback] = None) -> List[str]:
+    """
+    Extract all IP addresses and CIDR networks from any file format using chunked processing.
     
-    # Remove duplicates while preserving order
-    seen = set()
+    Duplicates are dropped as each chunk is scanned, keeping first-seen order. The addresses
+    seen so far are tracked in a RoaringBitmap, at most 2 bytes per address, and only new
+    ones are formatted as strings.
+    """
     unique_ips = []
-    for ip in host_ips:
-        if ip not in seen:
-            seen.add(ip)
-            unique_ips.append(ip)
+    seen = RoaringBitmap()
+    
+    with metrics.stage('scan', method='lines'):
+        for chunk in _iter_line_chunks(filename, chunk_size, progress_callback):
+            for start, end in _chunk_intervals(chunk):
+                if start == end:
+                    if seen.add(start):
+                        unique_ips.append(_dotted_quad(start))
+                elif start >> 16 == end >> 16 and not seen.range_cardinality(start, end):
+                    # A range inside one /16 that holds none of its addresses yet is added whole
+                    seen.add_range(start, end)
+                    unique_ips.extend(_dotted_quad(address) for address in range(start, end + 1))
+                else:
+                    for address in range(start, end + 1):
+                        if seen.add(address):
+                            unique_ips.append(_dotted_quad(address))
     
     return unique_ips
 
-def process_chunk(chunk: List[str], ip_pattern: str) -> List[str]:
-    """Process a chunk of lines to extract IP addresses."""
-    chunk_ips = []
-    
-    # Common subnet masks to exclude
-    subnet_masks = {
-        '0.0.0.0', '128.0.0.0', '192.0.0.0', '224.0.0.0', '240.0.0.0', '248.0.0.0', '252.0.0.0', '254.0.0.0', '255.0.0.0',
-        '255.128.0.0', '255.192.0.0', '255.224.0.0', '255.240.0.0', '255.248.0.0', '255.252.0.0', '255.254.0.0', '255.255.0.0',
-        '255.255.128.0', '255.255.192.0', '255.255.224.0', '255.255.240.0', '255.255.248.0', '255.255.252.0', '255.255.254.0', '255.255.255.0',
-        '255.255.255.128', '255.255.255.192', '255.255.255.224', '255.255.255.240', '255.255.255.248', '255.255.255.252', '255.255.255.254', '255.255.255.255'
-    }
-    
-    for line in chunk:
-        line = line.strip()
-        if not line or line.startswith('#'):  # Skip empty lines and comments
-            continue
+def extract_host_intervals(filename: str, chunk_size: int = 10000, progress_callback: Optional[ProgressCallback] = None) -> List[Interval]:
+    """
+    Extract all IP addresses and CIDR networks as merged integer [start, end] host intervals.
+    
+    Unlike extract_host_ips, CIDRs are never expanded, so memory scales with the
+    number of tokens in the file rather than the number of addresses they cover.
+    """
+    intervals = []
+    compacted_size = 0
+    
+    with metrics.stage('scan', method='lines'):
+        for chunk in _iter_line_chunks(filename, chunk_size, progress_callback):
+            intervals.extend(process_chunk_intervals(chunk))
+            
+            # Periodically merge so repeated tokens don't accumulate
+            if len(intervals) > 2 * compacted_size + chunk_size:
+                intervals = merge_intervals(intervals)
+                compacted_size = len(intervals)
         
-        # Find all IP addresses and CIDR networks in the line
-        matches = re.findall(ip_pattern, line)
-        for match in matches:
-            try:
-                if '/' in match:  # CIDR notation
-                    network = ipaddress.IPv4Network(match, strict=False)
-                    # Add all host IPs from the network (excluding network and broadcast)
-                    for ip in network.hosts():
-                        chunk_ips.append(str(ip))
-                else:  # Individual IP
-                    ip = ipaddress.IPv4Address(match)
-                    ip_str = str(ip)
-                    # Skip if it's a subnet mask
-                    if ip_str not in subnet_masks:
-                        chunk_ips.append(ip_str)
-            except (ValueError, ipaddress.AddressValueError, ipaddress.NetmaskValueError):
-                continue
-    
-    return chunk_ips
-
-def consolidate_networks(ip_list: List[str]) -> List[ipaddress.IPv4Network]:
-	"""Collapse all host IPs into the smallest set of congruent CIDR networks."""
-	host_networks = [ipaddress.IPv4Network(f"{ip}/32") for ip in ip_list]
-	collapsed = list(ipaddress.collapse_addresses(host_networks))
-	collapsed.sort(key=lambda n: (int(n.network_address), n.prefixlen))
-	return collapsed
-
-def consolidate_with_bias(ip_list: List[str], max_missing_percent: int = 25) -> List[ipaddress.IPv4Network]:
-	"""Consolidate IPs with bias for missing addresses up to max_missing_percent."""
-	ip_set = set(ipaddress.IPv4Address(ip) for ip in ip_list)
-	basic_networks = consolidate_networks(ip_list)
+        return merge_intervals(intervals)
+
+def process_chunk(chunk: List[str]) -> List[str]:
+    """Process a chunk of lines to extract IP addresses, expanding networks and ranges into their hosts."""
+    return [_dotted_quad(value) for start, end in _chunk_intervals(chunk) for value in range(start, end + 1)]
+
+def _chunk_intervals(chunk: List[str]) -> List[Interval]:
+    """Unmerged IPv4 host intervals of a chunk of lines, in line order."""
+    # One scan of the whole chunk, in line order
+    matches = _scan_tokens('\n'.join(chunk))
+    intervals = _tokens_to_intervals(matches)[0]
+    
+    metrics.inc('tokens_matched', len(matches))
+    metrics.inc('hosts_expanded', sum(end - start + 1 for start, end in intervals if end > start))
+    return intervals
+
+def _dotted_quad(value: int) -> str:
+    return f'{value >> 24}.{(value >> 16) & 0xFF}.{(value >> 8) & 0xFF}.{value & 0xFF}'
+
+def host_interval(network_int: int, prefixlen: int, version: int = 4) -> Interval:
+    """Return the [start, end] usable host range of a network, matching IPv4Network/IPv6Network.hosts()."""
+    bits = ADDRESS_BITS[version]
+    size = 1 << (bits - prefixlen)
+    if prefixlen >= bits - 1:
+        return network_int, network_int + size - 1
+    if version == 6:  # Only the Subnet-Router anycast address is excluded
+        return network_int + 1, network_int + size - 1
+    return network_int + 1, network_int + size - 2
+
+def token_interval(octet1, octet2, octet3, octet4, prefix, mask=None) -> Optional[Interval]:
+    """
+    Convert a matched token's captured octets and prefix or mask into a host interval.
+    
+    Works on str or bytes captures and rejects the same tokens ipaddress would
+    (octets above 255 or with leading zeros, prefixes above 32) without raising.
+    Lone netmasks and /0 prefixes ("any") return None. An empty or None prefix and mask means a single host.
+    A netmask or wildcard mask gives the network's hosts when the address is the network
+    address; an address with host bits set (an interface's "ip address a mask") is one host.
+    """
+    value1 = _OCTET_VALUES.get(octet1)
+    value2 = _OCTET_VALUES.get(octet2)
+    value3 = _OCTET_VALUES.get(octet3)
+    value4 = _OCTET_VALUES.get(octet4)
+    if value1 is None or value2 is None or value3 is None or value4 is None:
+        return None
+    address = (value1 << 24) | (value2 << 16) | (value3 << 8) | value4
+    
+    if mask:  # Address followed by a netmask or wildcard mask
+        prefixlen = MASK_PREFIXES[_quad_value(mask)]
+        netmask = (0xFFFFFFFF << (32 - prefixlen)) & 0xFFFFFFFF
+        if prefixlen < 32 and address & netmask == address and address not in MASK_PREFIXES:
+            return host_interval(address, prefixlen)
+    elif prefix:  # CIDR notation
+        prefixlen = int(prefix)
+        if prefixlen > 32 or prefixlen == 0:  # A /0 means "any", like the 0.0.0.0 0.0.0.0 mask
+            return None
+        mask = (0xFFFFFFFF << (32 - prefixlen)) & 0xFFFFFFFF
+        return host_interval(address & mask, prefixlen)
+    if address in _NETMASK_PREFIXES:
+        return None
+    return address, address
+
+def range_interval(first, last) -> Optional[Interval]:
+    """Host interval between two dotted quads (str or bytes), in either order; None when either is invalid."""
+    start = _quad_value(first)
+    end = _quad_value(last)
+    if start is None or end is None:
+        return None
+    return (start, end) if start <= end else (end, start)
+
+def _quad_value(quad) -> Optional[int]:
+    """Integer value of a dotted quad (str or bytes), or None when an octet is invalid."""
+    value = 0
+    for octet in quad.split(b'.' if isinstance(quad, bytes) else '.'):
+        octet_value = _OCTET_VALUES.get(octet)
+        if octet_value is None:
+            return None
+        value = (value << 8) | octet_value
+    return value
+
+def token_interval6(text, prefix) -> Optional[Interval]:
+    """
+    Convert a matched IPv6 candidate and its prefix into a host interval.
+    
+    Candidates that can't be an address (timestamps, MAC addresses) are rejected by
+    counting colons before ipaddress is asked. A lone '::' and a /0 prefix return None.
+    """
+    if isinstance(text, bytes):
+        text = text.decode('ascii')
+    colons = text.count(':')
+    if '::' not in text and colons != 7 and not (colons == 6 and '.' in text):
+        return None
+    try:
+        address = int(ipaddress.IPv6Address(text))
+    except ValueError:
+        return None
+    
+    if prefix:  # CIDR notation
+        prefixlen = int(prefix)
+        if prefixlen > 128 or prefixlen == 0:  # ::/0 means "any"
+            return None
+        return host_interval(address & ~((1 << (128 - prefixlen)) - 1), prefixlen, 6)
+    if address == 0:
+        return None
+    return address, address
+
+def parse_host_token(text: str) -> Optional[Tuple[int, Interval]]:
+    """
+    Parse a single IP, CIDR, address and mask, or range exactly as config lines in uploads are tokenized.
+    
+    Returns (version, host interval), or None when text is not one valid token.
+    """
+    try:
+        data = text.strip().encode('ascii')
+    except UnicodeEncodeError:
+        return None
+    match = CONFIG_RE.fullmatch(data)
+    if match is None:
+        return None
+    return _config_token_interval(match.groups())
+
+def process_chunk_intervals(chunk: List[str]) -> List[Interval]:
+    """Process a chunk of lines into unmerged integer IPv4 host intervals without expanding networks or ranges."""
+    # Repeated tokens are converted once
+    matches = _scan_tokens('\n'.join(chunk))
+    metrics.inc('tokens_matched', len(matches))
+    return _tokens_to_intervals(set(matches))[0]
+
+def _scan_mmap_range(filename: str, start: int, end: int) -> Tuple[List[Interval], List[Interval], int, int]:
+    """
+    Scan bytes [start, end) of a memory-mapped file into (IPv4, IPv6) intervals; start must follow a newline.
+    
+    Also returns the number of lines and regex matches in the range, since pool workers
+    cannot record metrics themselves.
+    """
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        matches = _scan_tokens(mapped, start, end)
+        lines = mapped[start:end].count(b'\n')
+    # Logs repeat the same addresses heavily, so only distinct tokens are converted
+    intervals, intervals6 = _tokens_to_intervals(set(matches))
+    return merge_intervals(intervals), merge_intervals(intervals6), lines, len(matches)
+
+def _scan_tokens(data, start: int = 0, end: Optional[int] = None) -> List[Tuple]:
+    """
+    Tokenize data[start:end] (bytes, mmap or str) in order; the byte before start decides ^ and \\b.
+    
+    Comment lines are skipped and config lines tokenized with CONFIG_RE, everything else
+    with SCAN_RE; bytes without an IPV6_HINT_RE match use the IPv4-only patterns instead.
+    str data is scanned for IPv4 only, with the *_TEXT_RE patterns.
+    """
+    if end is None:
+        end = len(data)
+    if isinstance(data, str):
+        scan_re, line_re, config_re, markers = SCAN_TEXT_RE, LINE_TEXT_RE, CONFIG_TEXT_RE, _LINE_MARKERS
+    elif IPV6_HINT_RE.search(data, start, end):
+        scan_re, line_re, config_re, markers = SCAN_RE, LINE_RE, CONFIG_RE, _LINE_MARKER_BYTES
+    else:
+        scan_re, line_re, config_re, markers = SCAN_IPV4_RE, LINE_RE, CONFIG_IPV4_RE, _LINE_MARKER_BYTES
+    comment, *keyword_markers, range_keyword = markers
+    
+    # Config lines only read differently when they hold a mask or range, so data without
+    # comments, ranges or mask-valued addresses (most logs) needs no line pass, and data
+    # that can't hold a config keyword at all needs no check for either
+    if data.find(comment, start, end) == -1:
+        if all(data.find(marker, start, end) == -1 for marker in keyword_markers):
+            return scan_re.findall(data, start, end)
+        if data.find(range_keyword, start, end) == -1:
+            tokens = scan_re.findall(data, start, end)
+            if _MASK_TOKENS.isdisjoint(tokens):
+                return tokens
+    
+    tokens = []
+    position = start
+    for line in line_re.finditer(data, start, end):
+        if line.start() > position + 1:
+            tokens.extend(scan_re.findall(data, position, line.start()))
+        if line.group(1):
+            tokens.extend(config_re.findall(data, line.start(), line.end()))
+        position = line.end()
+    tokens.extend(scan_re.findall(data, position, end))
+    return tokens
+
+def _tokens_to_intervals(tokens: Iterable[Tuple]) -> Tuple[List[Interval], List[Interval]]:
+    """Convert _scan_tokens tokens into unmerged (IPv4, IPv6) host intervals."""
+    intervals = []
+    intervals6 = []
+    for token in tokens:
+        # Config line tokens have more groups than SCAN_RE's seven (SCAN_IPV4_RE's five)
+        if len(token) > 7:
+            parsed = _config_token_interval(token)
+            if parsed is not None:
+                (intervals if parsed[0] == 4 else intervals6).append(parsed[1])
+        elif token[0]:
+            interval = token_interval(*token[:5])
+            if interval is not None:
+                intervals.append(interval)
+        elif len(token) > 5 and token[5]:
+            interval = token_interval6(token[5], token[6])
+            if interval is not None:
+                intervals6.append(interval)
+    return intervals, intervals6
+
+def _config_token_interval(token: Tuple) -> Optional[Tuple[int, Interval]]:
+    """Convert one CONFIG_RE (or CONFIG_TEXT_RE) token into (version, host interval), or None when invalid."""
+    if token[0]:
+        interval = token_interval(*token[:4], None)
+    elif token[4]:
+        interval = token_interval(*token[4:10])
+    elif token[10]:
+        interval = range_interval(token[10], token[11])
+    elif len(token) > 12 and token[12]:
+        interval = token_interval6(token[12], token[13])
+        return None if interval is None else (6, interval)
+    else:
+        return None
+    return None if interval is None else (4, interval)
+
+class IntervalSpill:
+    """
+    External merge sort for more host intervals than fit comfortably in memory.
+    
+    Intervals are buffered until run_intervals have accumulated, then merged and written
+    to a temporary file as one sorted run. result() streams every run through heapq.merge.
+    Once max_runs files exist they are merged into one, so open files stay bounded.
+    """
+    
+    def __init__(self, version: int = 4, run_intervals: int = SPILL_RUN_INTERVALS, max_runs: int = SPILL_MAX_RUNS):
+        self.version = version
+        self.run_intervals = run_intervals
+        self.max_runs = max_runs
+        self._buffer = []
+        self._runs = []
+    
+    def extend(self, intervals: Iterable[Interval]):
+        self._buffer.extend(intervals)
+        if len(self._buffer) >= self.run_intervals:
+            self._spill(merge_intervals(self._buffer))
+            self._buffer = []
+    
+    def _spill(self, intervals: Iterable[Interval]):
+        if len(self._runs) >= self.max_runs:
+            runs, self._runs = self._runs, []
+            self._spill(_iter_merged(heapq.merge(*(self._read_run(run) for run in runs))))
+            for run in runs:
+                run.close()
+        
+        run = tempfile.TemporaryFile()
+        iterator = iter(intervals)
+        written = 0
+        for block in iter(lambda: list(itertools.islice(iterator, SPILL_IO_INTERVALS)), []):
+            if self.version == 4:
+                run.write(array('I', (bound for interval in block for bound in interval)).tobytes())
+            else:
+                run.write(b''.join(bound.to_bytes(16, 'big') for interval in block for bound in interval))
+            written += len(block)
+        self._runs.append(run)
+        metrics.inc('intervals_spilled', written, version=self.version)
+    
+    def _read_run(self, run) -> Iterator[Interval]:
+        run.seek(0)
+        width = 8 if self.version == 4 else 32
+        while True:
+            data = run.read(width * SPILL_IO_INTERVALS)
+            if not data:
+                return
+            if self.version == 4:
+                bounds = array('I')
+                bounds.frombytes(data)
+            else:
+                bounds = [int.from_bytes(data[i:i + 16], 'big') for i in range(0, len(data), 16)]
+            yield from zip(bounds[0::2], bounds[1::2])
+    
+    def result(self) -> List[Interval]:
+        """Merge the buffer and every run into one list of merged intervals, deleting the runs."""
+        if not self._runs:
+            merged = merge_intervals(self._buffer)
+        else:
+            self._spill(merge_intervals(self._buffer))
+            merged = merge_sorted_intervals(heapq.merge(*(self._read_run(run) for run in self._runs)))
+        self._buffer = []
+        self.close()
+        return merged
+    
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._runs = []
+
+class IntervalStreamParser:
+    """
+    Incremental IP tokenizer for data that arrives in chunks, such as an upload stream.
+    
+    feed() scans everything up to the last complete line and carries the remainder, so
+    tokens split across chunk boundaries are never cut. Lines longer than max_line_bytes
+    are cut at whitespace instead, which keeps memory bounded. Once spill_bytes have been
+    scanned the intervals go to an IntervalSpill instead of being merged in memory (None
+    never spills). close() returns the merged IPv4 host intervals, identical to scanning
+    the whole data at once; close_dual_stack() returns the IPv6 intervals as well.
+    """
+    
+    def __init__(self, max_line_bytes: int = 1024 * 1024, compact_tokens: int = 200000,
+                 spill_bytes: Optional[int] = SPILL_MIN_BYTES):
+        self.max_line_bytes = max_line_bytes
+        self.compact_tokens = compact_tokens
+        self.spill_bytes = spill_bytes
+        self.bytes_scanned = 0
+        self._tail = b''
+        self._previous = b'\n'  # Last scanned byte, so ^ and \b behave across boundaries
+        self._continued = None  # 'comment' or 'config' while a line cut at whitespace continues
+        self._tokens = set()
+        self._intervals = []
+        self._intervals6 = []
+        self._spills = None
+    
+    def feed(self, data: bytes):
+        """Scan a chunk of input; an incomplete last line is held until more data arrives."""
+        buffer = self._tail + data
+        cut = buffer.rfind(b'\n') + 1
+        if cut == 0 and len(buffer) > self.max_line_bytes:
+            cut = self._whitespace_cut(buffer)
+        if cut:
+            self._scan(buffer[:cut])
+            self._tail = buffer[cut:]
+        else:
+            self._tail = buffer
+    
+    def _whitespace_cut(self, buffer: bytes) -> int:
+        """Cut point after the last whitespace that follows the line's first non-blank byte."""
+        content = len(buffer) - len(buffer.lstrip(b' \t\r\f\v'))
+        cut = max(buffer.rfind(b' '), buffer.rfind(b'\t')) + 1
+        return cut if cut > content else 0
+    
+    def _scan(self, piece: bytes):
+        start = 0
+        if self._continued is not None:
+            newline = piece.find(b'\n')
+            start = len(piece) if newline == -1 else newline + 1
+            if self._continued == 'config':
+                self._tokens.update(CONFIG_RE.findall(piece, 0, start))
+            if newline != -1:
+                self._continued = None
+        
+        if start < len(piece):
+            context = self._previous + piece
+            matches = _scan_tokens(context, start + 1)
+            self._tokens.update(matches)
+            metrics.inc('tokens_matched', len(matches))
+        metrics.inc('lines_scanned', piece.count(b'\n'))
+        metrics.inc('bytes_scanned', len(piece))
+        
+        # A piece that ends mid-line must carry whether that line is a comment or config line
+        if not piece.endswith(b'\n'):
+            line_start = piece.rfind(b'\n') + 1
+            if line_start >= start and (line_start or self._previous == b'\n'):
+                line = LINE_RE.match(piece, line_start)
+                self._continued = None if line is None else 'config' if line.group(1) else 'comment'
+        
+        self._previous = piece[-1:]
+        self.bytes_scanned += len(piece)
+        
+        if len(self._tokens) > self.compact_tokens:
+            self._compact()
+    
+    def _compact(self):
+        """Convert pending tokens and merge them into the running intervals."""
+        intervals, intervals6 = _tokens_to_intervals(self._tokens)
+        self._tokens = set()
+        if self._spills is None and self.spill_bytes is not None and self.bytes_scanned >= self.spill_bytes:
+            self._spills = IntervalSpill(4), IntervalSpill(6)
+            self._spills[0].extend(self._intervals)
+            self._spills[1].extend(self._intervals6)
+            self._intervals, self._intervals6 = [], []
+        
+        if self._spills is not None:
+            self._spills[0].extend(intervals)
+            self._spills[1].extend(intervals6)
+        else:
+            self._intervals = merge_intervals(self._intervals + intervals)
+            self._intervals6 = merge_intervals(self._intervals6 + intervals6)
+    
+    def close_dual_stack(self) -> Tuple[List[Interval], List[Interval]]:
+        """Scan any remaining data and return the merged (IPv4, IPv6) host intervals."""
+        if self._tail:
+            self._scan(self._tail)
+            self._tail = b''
+        self._compact()
+        if self._spills is not None:
+            self._intervals, self._intervals6 = (spill.result() for spill in self._spills)
+            self._spills = None
+        return self._intervals, self._intervals6
+    
+    def close(self) -> List[Interval]:
+        """Scan any remaining data and return the merged IPv4 host intervals."""
+        return self.close_dual_stack()[0]
+
+def _split_at_newlines(filename: str, file_size: int, parts: int) -> List[Tuple[int, int]]:
+    """Split a file into up to `parts` byte ranges that each start right after a newline."""
+    bounds = [0]
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for i in range(1, parts):
+            newline = mapped.find(b'\n', max(bounds[-1], file_size * i // parts))
+            if newline == -1:
+                break
+            bounds.append(newline + 1)
+    bounds.append(file_size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+def scan_dual_stack(filename: str, workers: int = 1, segment_size: int = SCAN_SEGMENT_SIZE,
+                    progress_callback: Optional[ProgressCallback] = None,
+                    spill: Optional[bool] = None, max_output: Optional[int] = None) -> Tuple[List[Interval], List[Interval]]:
+    """
+    Extract merged (IPv4, IPv6) host intervals by memory-mapping the file and scanning it with a bytes regex.
+    
+    The file is split at newline boundaries into segments; with workers > 1 the segments
+    are scanned in a process pool. Lines are never decoded and invalid tokens are rejected
+    arithmetically, so throughput is bounded by the regex engine rather than per-line Python.
+    Files of SPILL_MIN_BYTES or more (or spill=True) are scanned in smaller segments whose
+    intervals are merged through an IntervalSpill, so memory stays bounded by the result.
+    gzip, bz2, xz and zip files cannot be mapped and are streamed through an
+    IntervalStreamParser as they are decompressed instead, to at most max_output bytes
+    (ValueError beyond that).
+    """
+    file_size = os.path.getsize(filename)
+    if file_size == 0:
+        return [], []
+    compression = file_compression(filename)
+    if compression:
+        return scan_compressed(filename, compression, progress_callback, max_output=max_output)
+    if spill is None:
+        spill = file_size >= SPILL_MIN_BYTES
+    if spill:
+        segment_size = min(segment_size, SPILL_SEGMENT_SIZE)
+    
+    with metrics.stage('scan', method='mmap'):
+        parts = max(workers, -(-file_size // segment_size))
+        ranges = _split_at_newlines(filename, file_size, parts)
+        intervals, intervals6 = (IntervalSpill(4), IntervalSpill(6)) if spill else ([], [])
+        
+        def add_segment(segment, segment6, lines, tokens):
+            intervals.extend(segment)
+            intervals6.extend(segment6)
+            metrics.inc('lines_scanned', lines)
+            metrics.inc('tokens_matched', tokens)
+        
+        if workers > 1 and len(ranges) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_scan_mmap_range, filename, start, end) for start, end in ranges]
+                for done, future in enumerate(as_completed(futures), 1):
+                    add_segment(*future.result())
+                    if progress_callback:
+                        progress_callback('Extracting IP addresses', (done / len(futures)) * 100)
+        else:
+            for start, end in ranges:
+                add_segment(*_scan_mmap_range(filename, start, end))
+                if progress_callback:
+                    progress_callback('Extracting IP addresses', (end / file_size) * 100)
+        
+        metrics.inc('bytes_scanned', file_size)
+        if spill:
+            return intervals.result(), intervals6.result()
+        return merge_intervals(intervals), merge_intervals(intervals6)
+
+def scan_compressed(filename: str, compression: str, progress_callback: Optional[ProgressCallback] = None,
+                    chunk_size: int = 1024 * 1024, max_output: Optional[int] = None) -> Tuple[List[Interval], List[Interval]]:
+    """
+    Merged (IPv4, IPv6) host intervals of a compressed file, decompressed straight into the tokenizer.
+    
+    Raises ValueError for corrupt data or once more than max_output bytes have been decompressed.
+    """
+    file_size = os.path.getsize(filename)
+    parser = IntervalStreamParser()
+    
+    with metrics.stage('scan', method=compression), open(filename, 'rb') as file:
+        for piece in iter_decompressed(file, compression, chunk_size, max_output):
+            parser.feed(piece)
+            if progress_callback:
+                progress_callback('Extracting IP addresses', (file.tell() / file_size) * 100)
+        return parser.close_dual_stack()
+
+def scan_host_intervals(filename: str, workers: int = 1, segment_size: int = SCAN_SEGMENT_SIZE,
+                        progress_callback: Optional[ProgressCallback] = None) -> List[Interval]:
+    """IPv4-only scan_dual_stack()."""
+    return scan_dual_stack(filename, workers, segment_size, progress_callback)[0]
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Merge overlapping and adjacent integer intervals with a sort-and-sweep."""
+    return merge_sorted_intervals(sorted(intervals))
+
+def merge_sorted_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Merge overlapping and adjacent intervals that arrive sorted by start, e.g. from heapq.merge."""
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def _iter_merged(intervals: Iterable[Interval]) -> Iterator[Interval]:
+    """Generator form of merge_sorted_intervals, for streams too large to hold in memory."""
+    current = None
+    for start, end in intervals:
+        if current is not None and start <= current[1] + 1:
+            if end > current[1]:
+                current = (current[0], end)
+        else:
+            if current is not None:
+                yield current
+            current = (start, end)
+    if current is not None:
+        yield current
+
+def subtract_intervals(intervals: List[Interval], removed: List[Interval]) -> List[Interval]:
+    """Remove the addresses in merged intervals `removed` from merged intervals `intervals`."""
+    result = []
+    i = 0
+    for start, end in intervals:
+        # Skip removals that end before this interval
+        while i < len(removed) and removed[i][1] < start:
+            i += 1
+        j = i
+        while j < len(removed) and removed[j][0] <= end:
+            if removed[j][0] > start:
+                result.append((start, removed[j][0] - 1))
+            start = max(start, removed[j][1] + 1)
+            if removed[j][1] > end:
+                break
+            j += 1
+        if start <= end:
+            result.append((start, end))
+    return result
+
+def count_hosts(intervals: Iterable[Interval]) -> int:
+    """Count the addresses covered by a list of merged intervals."""
+    return sum(end - start + 1 for start, end in intervals)
+
+HostInput = Union[str, ipaddress.IPv4Address, ipaddress.IPv6Address, Interval]
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+def to_intervals(hosts: Iterable[HostInput], version: int = 4) -> List[Interval]:
+	"""Normalize host IP strings and/or [start, end] intervals of one IP version into merged integer intervals."""
+	address_class = _ADDRESS_CLASSES[version]
+	intervals = []
+	for item in hosts:
+		if isinstance(item, (str, address_class)):
+			address = int(address_class(item))
+			intervals.append((address, address))
+		else:
+			intervals.append((int(item[0]), int(item[1])))
+	return merge_intervals(intervals)
+
+def range_to_cidrs(start: int, end: int, version: int = 4) -> Iterator[Tuple[int, int]]:
+	"""Yield the minimal list of aligned (network_int, prefixlen) blocks covering [start, end]."""
+	bits = ADDRESS_BITS[version]
+	while start <= end:
+		# Largest block aligned at start that doesn't run past end
+		size = start & -start if start else 1 << bits
+		if size > end - start + 1:
+			size = 1 << ((end - start + 1).bit_length() - 1)
+		yield start, bits + 1 - size.bit_length()
+		start += size
+
+class FenwickTree:
+	"""Range sums over a list of integers with point updates, both in O(log n)."""
 	
-	expanded_networks = []
-	processed_ips = set()
+	def __init__(self, values: List[int]):
+		self._tree = [0] + values
+		for i in range(1, len(self._tree)):
+			parent = i + (i & -i)
+			if parent < len(self._tree):
+				self._tree[parent] += self._tree[i]
 	
-	for net in basic_networks:
-		if net.prefixlen == 32:
-			expanded_networks.append(net)
-			processed_ips.add(net.network_address)
-			continue
-			
-		best_network = net
-		current_net = net
+	def add(self, index: int, delta: int):
+		"""Add delta to the value at index."""
+		index += 1
+		while index < len(self._tree):
+			self._tree[index] += delta
+			index += index & -index
+	
+	def sum(self, start: int, end: int) -> int:
+		"""Sum of the values in [start, end); both prefixes are walked only down to where they meet."""
+		total = 0
+		while end > start:
+			total += self._tree[end]
+			end &= end - 1
+		while start > end:
+			total -= self._tree[start]
+			start &= start - 1
+		return total
+
+class HostIndex:
+	"""
+	Prefix-count index over merged host intervals.
+	
+	Stores interval starts and ends with a running total of covered addresses, so the
+	number of input hosts inside any address range is two bisect lookups.
+	"""
+	
+	def __init__(self, intervals: List[Interval]):
+		self.starts = [start for start, _ in intervals]
+		self.ends = [end for _, end in intervals]
+		# cumulative[i] is the number of hosts in intervals before i
+		self.cumulative = [0]
+		for start, end in intervals:
+			self.cumulative.append(self.cumulative[-1] + end - start + 1)
+	
+	@property
+	def total(self) -> int:
+		"""Number of covered hosts; unlike len() it is not capped at sys.maxsize, which IPv6 exceeds."""
+		return self.cumulative[-1]
+	
+	def __len__(self) -> int:
+		return self.cumulative[-1]
+	
+	def count_upto(self, address: int) -> int:
+		"""Count input hosts <= address."""
+		i = bisect.bisect_right(self.starts, address) - 1
+		if i < 0:
+			return 0
+		return self.cumulative[i] + min(self.ends[i], address) - self.starts[i] + 1
+	
+	def count(self, low: int, high: int) -> int:
+		"""Count input hosts in [low, high]."""
+		if high < low:
+			return 0
+		return self.count_upto(high) - self.count_upto(low - 1)
+
+def consolidate_networks(ip_list: List[HostInput], version: int = 4) -> List[IPNetwork]:
+	"""Collapse all host IPs (or host intervals) into the smallest set of congruent CIDR networks."""
+	network_class = _NETWORK_CLASSES[version]
+	with metrics.stage('collapse', version=version):
+		if _np_backend is not None and version == 4:
+			addresses, prefixes = _np_backend.collapse(*_np_backend.to_interval_arrays(ip_list))
+			return [network_class(block) for block in zip(addresses.tolist(), prefixes.tolist())]
 		
-		while current_net.prefixlen > 8:
-			parent_net = current_net.supernet()
-			parent_ips = set(parent_net.hosts())
-			matching_ips = parent_ips & ip_set
+		intervals = to_intervals(ip_list, version)
+		return [network_class(block) for start, end in intervals for block in range_to_cidrs(start, end, version)]
+
+def consolidate_with_bias_sweep(ip_list: List[HostInput], thresholds: Iterable[int], version: int = 4) -> Dict[int, List[IPNetwork]]:
+	"""
+	Consolidate IPs with bias for several max_missing_percent thresholds in a single pass.
+	
+	Each collapsed network climbs toward the family's floor (/8 for IPv4, /32 for IPv6)
+	once, recording the largest missing percent needed to reach every supernet on the way;
+	a threshold then only decides how far up that chain it can go.
+	"""
+	thresholds = list(thresholds)
+	ceiling = max(thresholds)
+	bits = ADDRESS_BITS[version]
+	floor = CLIMB_FLOOR[version]
+	
+	# Probes count supernet host lookups, shared by all thresholds; climbs count levels gained per threshold
+	with metrics.stage('bias_sweep', version=version):
+		if _np_backend is not None and version == 4:
+			starts, ends = _np_backend.to_interval_arrays(ip_list)
+			sweep = _np_backend.consolidate_with_bias_sweep(starts, ends, thresholds)
+			per_threshold = {threshold: zip(addresses.tolist(), prefixes.tolist()) for threshold, (addresses, prefixes) in sweep.items()}
+		else:
+			intervals = to_intervals(ip_list, version)
+			basic_networks = [block for start, end in intervals for block in range_to_cidrs(start, end, version)]
+			# IPv4 hosts live in the shared bitmap container; IPv6 ones stay intervals
+			hosts_between = RoaringBitmap.from_intervals(intervals).range_cardinality if version == 4 else HostIndex(intervals).count
+			expanded_networks = {threshold: set() for threshold in thresholds}
+			probes = 0
+			climbs = {threshold: 0 for threshold in thresholds}
 			
-			total_ips_in_parent = parent_net.num_addresses - 2
-			covered_percent = (len(matching_ips) / total_ips_in_parent) * 100 if total_ips_in_parent > 0 else 0
-			missing_percent = 100 - covered_percent
+			for network_int, prefixlen in basic_networks:
+				chain = [(network_int, prefixlen)]
+				needed = []  # needed[i] is the threshold required to reach chain[i + 1]
+				
+				while prefixlen > floor and prefixlen < bits and (not needed or needed[-1] <= ceiling):
+					prefixlen -= 1
+					network_int &= ~((1 << (bits - prefixlen)) - 1)
+					# Only the parent's usable hosts count, as with IPv4Network/IPv6Network.hosts()
+					low, high = host_interval(network_int, prefixlen, version)
+					matching_ips = hosts_between(low, high)
+					
+					total_ips_in_parent = high - low + 1
+					covered_percent = (matching_ips / total_ips_in_parent) * 100 if total_ips_in_parent > 0 else 0
+					missing_percent = 100 - covered_percent
+					
+					chain.append((network_int, prefixlen))
+					needed.append(max(needed[-1], missing_percent) if needed else missing_percent)
+				probes += len(needed)
+				
+				for threshold, networks in expanded_networks.items():
+					climb = bisect.bisect_right(needed, threshold)
+					climbs[threshold] += climb
+					networks.add(chain[climb])
 			
-			if missing_percent <= max_missing_percent:
-				best_network = parent_net
-				current_net = parent_net
-			else:
-				break
+			# Remove duplicates and sort
+			per_threshold = {threshold: sorted(networks) for threshold, networks in expanded_networks.items()}
+			
+			metrics.inc('networks_collapsed', len(basic_networks), version=version)
+			metrics.inc('supernet_probes', probes, version=version)
+			for threshold, climb in climbs.items():
+				metrics.inc('supernet_climbs', climb, version=version, threshold=threshold)
+	
+	# Thresholds share most of their networks, so build each network object once
+	network_class = _NETWORK_CLASSES[version]
+	network_objects = {}
+	results = {}
+	for threshold, networks in per_threshold.items():
+		results[threshold] = []
+		for net in networks:
+			if net not in network_objects:
+				network_objects[net] = network_class(net)
+			results[threshold].append(network_objects[net])
+	return results
+
+def consolidate_with_bias(ip_list: List[HostInput], max_missing_percent: int = 25, version: int = 4) -> List[IPNetwork]:
+	"""Consolidate IPs with bias for missing addresses up to max_missing_percent."""
+	return consolidate_with_bias_sweep(ip_list, [max_missing_percent], version)[max_missing_percent]
+
+@metrics.stage('budget')
+def consolidate_to_budget(ip_list: List[HostInput], max_entries: int, ip_list_v6: Optional[List[HostInput]] = None) -> List[IPNetwork]:
+	"""
+	Consolidate IPs into at most max_entries networks by repeatedly applying the cheapest merge.
+	
+	Starting from the collapsed networks, every pair of neighbours proposes its smallest
+	common supernet, which absorbs whatever networks fall inside it. A heap orders the
+	proposals by added missing addresses (then by most entries removed). Proposals whose
+	networks were absorbed meanwhile are dropped when popped, and ones whose neighbourhood
+	changed are re-priced and pushed back. Pricing is O(log n): the networks inside a supernet
+	are counted and summed from the merges already applied inside it, kept in a Fenwick tree
+	over the collapsed networks. Only an applied merge walks the networks it absorbs, and each
+	network is absorbed once, so a run with r re-pricings takes O((n + r) log n). Supernets never
+	grow past the family's floor; when max_entries is below that limit the closest result
+	is returned.
+	
+	max_entries counts every network, hosts included, since a firewall's group limit
+	counts every member. IPv4 and IPv6 share the budget.
+	"""
+	families = [(4, to_intervals(ip_list))]
+	if ip_list_v6:
+		families.append((6, to_intervals(ip_list_v6, 6)))
+	
+	# Doubly linked list of current networks in address order; families are never linked
+	blocks = []
+	versions = []
+	alive = []
+	prev_node = []
+	next_node = []
+	indexes = {}
+	# The collapsed networks ("leaves") in address order per family, from leaf_base[version]
+	leaf_starts = {}
+	leaf_base = {}
+	for version, intervals in families:
+		indexes[version] = HostIndex(intervals)
+		leaf_base[version] = len(blocks)
+		previous = -1
+		for start, end in intervals:
+			for block in range_to_cidrs(start, end, version):
+				node = len(blocks)
+				blocks.append(block)
+				versions.append(version)
+				alive.append(True)
+				prev_node.append(previous)
+				next_node.append(-1)
+				if previous != -1:
+					next_node[previous] = node
+				previous = node
+		leaf_starts[version] = [block[0] for block in blocks[leaf_base[version]:]]
+	
+	# Every applied merge is recorded at the first leaf inside its supernet as
+	# (addresses it added beyond its absorbed networks) << 32 | (networks it removed), so a
+	# supernet holds its leaves less the removals recorded inside it, and their added addresses
+	merge_totals = FenwickTree([0] * len(blocks))
+	
+	def propose(left: int, right: int) -> Optional[Tuple]:
+		"""Price merging neighbours left and right, plus any networks inside their supernet."""
+		version = versions[left]
+		bits = ADDRESS_BITS[version]
+		prefixlen = bits - (blocks[left][0] ^ blocks[right][0]).bit_length()
+		if prefixlen < CLIMB_FLOOR[version]:
+			return None
+		network_int = blocks[left][0] & ~((1 << (bits - prefixlen)) - 1)
+		network_end = network_int + (1 << (bits - prefixlen)) - 1
 		
-		expanded_networks.append(best_network)
+		starts = leaf_starts[version]
+		i = leaf_base[version] + bisect.bisect_left(starts, network_int)
+		j = leaf_base[version] + bisect.bisect_right(starts, network_end)
+		totals = merge_totals.sum(i, j)
+		absorbed = j - i - (totals & 0xFFFFFFFF)
+		absorbed_added = totals >> 32
 		
-		if best_network.prefixlen == 32:
-			processed_ips.add(best_network.network_address)
-		else:
-			processed_ips.update(best_network.hosts())
+		low, high = host_interval(network_int, prefixlen, version)
+		supernet_added = high - low + 1 - indexes[version].count(low, high)
+		return (supernet_added - absorbed_added, 1 - absorbed, left, right,
+		        (network_int, prefixlen), i)
 	
-	# Remove duplicates and sort
-	unique_networks = []
-	seen_networks = set()
+	heap = []
+	for node in range(len(blocks)):
+		if next_node[node] != -1:
+			candidate = propose(node, next_node[node])
+			if candidate is not None:
+				heap.append(candidate)
+	heapq.heapify(heap)
 	
-	for net in expanded_networks:
-		net_key = (net.network_address, net.prefixlen)
-		if net_key not in seen_networks:
-			seen_networks.add(net_key)
-			unique_networks.append(net)
+	entries = len(blocks)
+	merges = 0
+	while entries > max_entries and heap:
+		candidate = heapq.heappop(heap)
+		left, right = candidate[2], candidate[3]
+		if not (alive[left] and alive[right] and next_node[left] == right):
+			continue
+		current = propose(left, right)
+		if current[:2] != candidate[:2]:
+			heapq.heappush(heap, current)
+			continue
+		
+		cost, change, _, _, supernet, leaf = current
+		network_end = supernet[0] + (1 << (ADDRESS_BITS[versions[left]] - supernet[1])) - 1
+		first, last = left, right
+		while prev_node[first] != -1 and blocks[prev_node[first]][0] >= supernet[0]:
+			first = prev_node[first]
+		while next_node[last] != -1 and blocks[next_node[last]][0] <= network_end:
+			last = next_node[last]
+		before, after = prev_node[first], next_node[last]
+		node = first
+		while True:
+			alive[node] = False
+			if node == last:
+				break
+			node = next_node[node]
+		merge_totals.add(leaf, cost << 32 | -change)
+		
+		# The supernet replaces the absorbed run in the list
+		merged = len(blocks)
+		blocks.append(supernet)
+		versions.append(versions[left])
+		alive.append(True)
+		prev_node.append(before)
+		next_node.append(after)
+		if before != -1:
+			next_node[before] = merged
+		if after != -1:
+			prev_node[after] = merged
+		entries += change
+		merges += 1
+		
+		for pair in ((before, merged), (merged, after)):
+			if pair[0] != -1 and pair[1] != -1:
+				candidate = propose(*pair)
+				if candidate is not None:
+					heapq.heappush(heap, candidate)
 	
-	unique_networks.sort(key=lambda n: (int(n.network_address), n.prefixlen))
-	return unique_networks
+	metrics.inc('budget_merges', merges)
+	networks = [_NETWORK_CLASSES[versions[node]](blocks[node]) for node in range(len(blocks)) if alive[node]]
+	return sorted(networks, key=lambda net: (net.version, net.network_address, net.prefixlen))
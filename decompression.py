@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Streaming decompression of gzip, bz2, xz and zip inputs.
+The format is detected from the leading magic bytes, never the file name. gzip, bz2 and
+xz are decoded chunk by chunk as the data arrives, including files made of several
+concatenated members; zip needs its central directory at the end, so it is read from a
+seekable file and its members are decoded one after another. Output is produced in
+pieces of at most OUTPUT_CHUNK_SIZE bytes, so memory stays bounded however well the
+input compresses.
+"""
+
+import bz2
+import io
+import lzma
+import zipfile
+import zlib
+from typing import BinaryIO, Iterator, Optional
+
+# (format, leading bytes); an empty zip archive starts with its end-of-directory record
+MAGIC = (
+	('gzip', b'\x1f\x8b'),
+	('bz2', b'BZh'),
+	('xz', b'\xfd7zXZ\x00'),
+	('zip', b'PK\x03\x04'),
+	('zip', b'PK\x05\x06'),
+)
+MAGIC_BYTES = max(len(magic) for _, magic in MAGIC)
+
+# Upload file extensions of the supported formats
+COMPRESSED_EXTENSIONS = {'gz', 'bz2', 'xz', 'zip'}
+
+# Largest piece of decompressed output produced at once
+OUTPUT_CHUNK_SIZE = 1024 * 1024
+
+# Errors the decoders raise for corrupt input
+_DECODE_ERRORS = (zlib.error, lzma.LZMAError, OSError, EOFError, zipfile.BadZipFile, NotImplementedError, RuntimeError)
+
+def detect_compression(head: bytes) -> Optional[str]:
+	"""'gzip', 'bz2', 'xz' or 'zip' when head starts with that format's magic bytes, else None."""
+	for kind, magic in MAGIC:
+		if head.startswith(magic):
+			return kind
+	return None
+
+def file_compression(filename: str) -> Optional[str]:
+	"""Compression format of a file on disk, or None for plain files."""
+	with open(filename, 'rb') as f:
+		return detect_compression(f.read(MAGIC_BYTES))
+
+def _limit_error(max_output: int) -> ValueError:
+	return ValueError(f'Decompressed data too large. Maximum size is {max_output // (1024 * 1024)}MB.')
+
+class StreamDecompressor:
+	"""
+	Incremental gzip, bz2 or xz decoder for data that arrives in chunks.
+
+	feed() yields the output of each chunk; a new member is started whenever one ends, and
+	zero padding between members is skipped. close() checks the input did not stop partway
+	through a member. Raises ValueError for corrupt data or, with max_output, once more than
+	that many bytes have been produced.
+	"""
+
+	def __init__(self, kind: str, max_output: Optional[int] = None):
+		if kind not in ('gzip', 'bz2', 'xz'):
+			raise ValueError(f'Not a streaming compression format: {kind}')
+		self.kind = kind
+		self.max_output = max_output
+		self.bytes_out = 0
+		self._decoder = self._new_decoder()
+		self._started = False  # The current decoder has been given input
+
+	def _new_decoder(self):
+		self._started = False
+		if self.kind == 'gzip':
+			return zlib.decompressobj(16 + zlib.MAX_WBITS)
+		if self.kind == 'bz2':
+			return bz2.BZ2Decompressor()
+		return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+	def feed(self, data: bytes) -> Iterator[bytes]:
+		"""Decompress a chunk of input, yielding pieces of at most OUTPUT_CHUNK_SIZE bytes."""
+		try:
+			while True:
+				if self._decoder.eof:
+					data = (self._decoder.unused_data + data).lstrip(b'\0')
+					if not data:
+						return
+					self._decoder = self._new_decoder()
+				if data:
+					self._started = True
+				piece = self._decoder.decompress(data, OUTPUT_CHUNK_SIZE)
+				# zlib hands back input it had no room to decode, bz2 and lzma buffer it internally;
+				# past the end of a member the rest is in unused_data (which zlib's tail repeats)
+				data = b'' if self._decoder.eof else getattr(self._decoder, 'unconsumed_tail', b'')
+				if piece:
+					self.bytes_out += len(piece)
+					if self.max_output is not None and self.bytes_out > self.max_output:
+						raise _limit_error(self.max_output)
+					yield piece
+				if self._decoder.eof or data:
+					continue
+				if self.kind == 'gzip':
+					more = len(piece) == OUTPUT_CHUNK_SIZE
+				else:
+					more = not self._decoder.needs_input
+				if not more:
+					return
+		except _DECODE_ERRORS:
+			raise ValueError(f'Invalid {self.kind} data') from None
+
+	def close(self):
+		"""Raise ValueError when the input ended inside a member."""
+		if self._started and not self._decoder.eof:
+			raise ValueError(f'Truncated {self.kind} data')
+
+def iter_zip_members(file: BinaryIO, max_output: Optional[int] = None) -> Iterator[bytes]:
+	"""
+	Decompressed contents of every file in a zip archive, in archive order.
+
+	file must be seekable. A newline follows each member so lines never join across
+	members. Raises ValueError for corrupt or encrypted archives, or past max_output bytes.
+	"""
+	produced = 0
+	try:
+		with zipfile.ZipFile(file) as archive:
+			for info in archive.infolist():
+				if info.is_dir():
+					continue
+				if info.flag_bits & 0x1:
+					raise ValueError(f'Encrypted zip member: {info.filename}')
+				with archive.open(info) as member:
+					for piece in iter(lambda: member.read(OUTPUT_CHUNK_SIZE), b''):
+						produced += len(piece)
+						if max_output is not None and produced > max_output:
+							raise _limit_error(max_output)
+						yield piece
+				yield b'\n'
+	except _DECODE_ERRORS:
+		raise ValueError('Invalid zip data') from None
+
+def iter_decompressed(file: BinaryIO, kind: Optional[str], chunk_size: int = OUTPUT_CHUNK_SIZE,
+                      max_output: Optional[int] = None) -> Iterator[bytes]:
+	"""Read file to the end, yielding its contents decompressed according to kind (None for plain data)."""
+	if kind == 'zip':
+		yield from iter_zip_members(file, max_output)
+		return
+	decompressor = StreamDecompressor(kind, max_output) if kind else None
+	for chunk in iter(lambda: file.read(chunk_size), b''):
+		if decompressor:
+			yield from decompressor.feed(chunk)
+		else:
+			yield chunk
+	if decompressor:
+		decompressor.close()
+
+class _IteratorReader(io.RawIOBase):
+	"""Raw binary stream over an iterator of byte strings."""
+
+	def __init__(self, pieces: Iterator[bytes]):
+		self._pieces = pieces
+		self._pending = b''
+
+	def readable(self) -> bool:
+		return True
+
+	def readinto(self, buffer) -> int:
+		while not self._pending:
+			self._pending = next(self._pieces, None)
+			if self._pending is None:
+				self._pending = b''
+				return 0
+		size = min(len(buffer), len(self._pending))
+		buffer[:size] = self._pending[:size]
+		self._pending = self._pending[size:]
+		return size
+
+def open_decompressed(file: BinaryIO, max_output: Optional[int] = None) -> BinaryIO:
+	"""
+	Readable binary stream of a file's decompressed contents, detected from its magic bytes.
+
+	file must be a buffered reader positioned at the start; plain files are returned as is.
+	"""
+	kind = detect_compression(file.peek(MAGIC_BYTES)[:MAGIC_BYTES])
+	if kind is None:
+		return file
+	return io.BufferedReader(_IteratorReader(iter_decompressed(file, kind, max_output=max_output)), OUTPUT_CHUNK_SIZE)
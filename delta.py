@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Incremental re-analysis of a stored consolidation.
+Applies added and removed IPs or CIDRs to a result store's host intervals and re-runs the
+bias sweep only inside the address blocks the change can reach, splicing the new networks
+and statistics into a copy of the store.
+
+A collapsed network's supernet climb only looks at the hosts inside the supernets it probes.
+A change inside an aligned block therefore leaves every network outside the block alone as
+long as no stored host interval crosses the block's edge and no climb, before or after the
+change, probes a supernet of the block. Each block starts as the smallest one around a
+changed interval and moves up to its parents until both hold.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import metrics
+from analysis import equal_weight_score, pareto_front
+from core_consolidation import (
+	ADDRESS_BITS, CLIMB_FLOOR, HostIndex, Interval, consolidate_with_bias_sweep, count_hosts, host_interval,
+	merge_intervals, parse_host_token, subtract_intervals,
+)
+from result_store import HOSTS_SECTION, HOSTS_SECTION_V6, ResultStore, splice_result_store, threshold_section
+
+Block = Tuple[int, int]
+
+def parse_hosts(items: Iterable[str]) -> Tuple[List[Interval], List[Interval]]:
+	"""
+	Parse IP or CIDR strings into merged IPv4 and IPv6 host intervals.
+
+	Raises ValueError naming the entries that are not a single valid address or network.
+	"""
+	intervals = {4: [], 6: []}
+	invalid = []
+	for item in items:
+		parsed = parse_host_token(item) if isinstance(item, str) else None
+		if parsed is None:
+			invalid.append(str(item))
+		else:
+			intervals[parsed[0]].append(parsed[1])
+	if invalid:
+		raise ValueError(f"Invalid IP or CIDR: {', '.join(invalid[:10])}")
+	return merge_intervals(intervals[4]), merge_intervals(intervals[6])
+
+def _block(start: int, end: int, version: int) -> Block:
+	"""Smallest aligned (address, prefix) block holding [start, end]."""
+	prefix = ADDRESS_BITS[version] - (start ^ end).bit_length()
+	return _ancestor((start, ADDRESS_BITS[version]), prefix, version)
+
+def _ancestor(block: Block, prefix: int, version: int) -> Block:
+	return block[0] & ~((1 << (ADDRESS_BITS[version] - prefix)) - 1), prefix
+
+def _block_range(block: Block, version: int) -> Interval:
+	return block[0], block[0] + (1 << (ADDRESS_BITS[version] - block[1])) - 1
+
+def _outermost(blocks: Iterable[Block], version: int) -> List[Block]:
+	"""Sorted blocks with those nested inside another dropped; aligned blocks never partly overlap."""
+	result = []
+	for block in sorted(blocks, key=lambda block: (block[0], block[1])):
+		if result and block[0] <= _block_range(result[-1], version)[1]:
+			continue
+		result.append(block)
+	return result
+
+def _probe_top(prefix: int, version: int) -> Optional[int]:
+	"""
+	Prefix of the largest supernet probed by the climb that ended at a network of this prefix
+	at the highest threshold. Climbs stop one level after the threshold is exceeded, or at the floor.
+	"""
+	if prefix == ADDRESS_BITS[version]:
+		return None
+	return prefix - 1 if prefix > CLIMB_FLOOR[version] else prefix
+
+def _probed_above(store: ResultStore, section: str, block: Block, version: int) -> Optional[int]:
+	"""
+	Prefix of the largest supernet of block that a stored climb probed, or None.
+
+	A climb probing the supernet at prefix k ended at one of its two halves (prefix k + 1),
+	or at the supernet itself on the floor, so two exact lookups per level suffice.
+	"""
+	bits = ADDRESS_BITS[version]
+	floor = CLIMB_FLOOR[version]
+	found = None
+	for prefix in range(block[1] - 1, floor - 1, -1):
+		low = _ancestor(block, prefix, version)[0]
+		candidates = [(low, prefix + 1), (low + (1 << (bits - prefix - 1)), prefix + 1)]
+		if prefix == floor:
+			candidates.append((low, floor))
+		for address, end_prefix in candidates:
+			if any(stored == end_prefix and _probe_top(stored, version) == prefix
+			       for _, stored in store.networks_between(section, address, address)):
+				found = prefix
+	return found
+
+def _close_blocks(store: ResultStore, hosts_section: str, ceiling_section: str, blocks: List[Block], version: int) -> List[Block]:
+	"""Grow blocks until no stored host interval crosses their edges and no stored climb probed above them."""
+	top = (1 << ADDRESS_BITS[version]) - 1
+	while True:
+		grown = []
+		for block in blocks:
+			low, high = _block_range(block, version)
+			# Stored intervals touching the edge merge with added hosts across it
+			for start, end in store.intervals_between(hosts_section, max(low - 1, 0), min(high + 1, top)):
+				low, high = min(low, start), max(high, end)
+			block = _block(low, high, version)
+			prefix = _probed_above(store, ceiling_section, block, version)
+			grown.append(block if prefix is None else _ancestor(block, prefix, version))
+		grown = _outermost(grown, version)
+		if grown == blocks:
+			return blocks
+		blocks = grown
+
+def _region_stats(networks: List[Tuple[int, int]], index: HostIndex, version: int) -> Tuple[int, int, int]:
+	"""(objects, addresses covered, covered addresses that are not input hosts) of one region's networks."""
+	covered = merge_intervals(host_interval(address, prefix, version) for address, prefix in networks)
+	total = count_hosts(covered)
+	objects = sum(1 for _, prefix in networks if prefix != ADDRESS_BITS[version])
+	return objects, total, total - sum(index.count(start, end) for start, end in covered)
+
+@metrics.stage('delta')
+def apply_delta(path: str, target: str, added: Iterable[str], removed: Iterable[str], analysis_id: Optional[str] = None,
+                drop: Iterable[str] = ()) -> Dict:
+	"""
+	Add and remove hosts in the analysis stored at path, writing the updated analysis to target.
+
+	added and removed are IP or CIDR strings; an address in both ends up removed. Work is
+	proportional to the blocks the change reaches plus copying the store, and the results
+	match a fresh run_consolidation_analysis over the updated hosts. The stored budget and
+	optimal trade-off curve cannot be updated this way and are dropped from the summary, as
+	are the sections named in drop. Returns the new summary. Raises ValueError for invalid entries or when no hosts would remain.
+	"""
+	added4, added6 = parse_hosts(added)
+	removed4, removed6 = parse_hosts(removed)
+
+	with ResultStore(path) as store:
+		summary = store.summary()
+		thresholds = [r['threshold'] for r in summary['results']]
+		# threshold -> changes to [objects, original hosts, addresses covered, missing addresses]
+		changes = {threshold: [0, 0, 0, 0] for threshold in thresholds}
+		network_splices = {4: {}, 6: {}}
+		interval_splices = {4: {}, 6: {}}
+		region_count = 0
+
+		for version, additions, removals in ((4, added4, removed4), (6, added6, removed6)):
+			changed = merge_intervals(additions + removals)
+			if not changed:
+				continue
+			hosts_section = HOSTS_SECTION if version == 4 else HOSTS_SECTION_V6
+			sections = {threshold: threshold_section(threshold, version) for threshold in thresholds}
+			interval_splices[version][hosts_section] = []
+			for section in sections.values():
+				network_splices[version][section] = []
+
+			ceiling_section = sections[max(thresholds)]
+			blocks = _close_blocks(store, hosts_section, ceiling_section,
+			                       _outermost((_block(start, end, version) for start, end in changed), version), version)
+			swept = {}
+			while True:
+				grown = []
+				for block in blocks:
+					if block not in swept:
+						low, high = _block_range(block, version)
+						old = store.intervals_between(hosts_section, low, high)
+						# Every changed interval lies inside exactly one block
+						new = merge_intervals(old + [interval for interval in additions if low <= interval[0] <= high])
+						new = subtract_intervals(new, [interval for interval in removals if low <= interval[0] <= high])
+						# Climbs that stay inside the block only probe hosts inside it, so its intervals suffice
+						swept[block] = (old, new, consolidate_with_bias_sweep(new, thresholds, version) if new else {})
+					probed = [_probe_top(net.prefixlen, version) for net in swept[block][2].get(max(thresholds), [])]
+					prefix = min((prefix for prefix in probed if prefix is not None and prefix < block[1]), default=None)
+					grown.append(block if prefix is None else _ancestor(block, prefix, version))
+				if grown == blocks:
+					break
+				blocks = _close_blocks(store, hosts_section, ceiling_section, _outermost(grown, version), version)
+
+			region_count += len(blocks)
+			for block in blocks:
+				low, high = _block_range(block, version)
+				old, new, networks_by_threshold = swept[block]
+				old_index, new_index = HostIndex(old), HostIndex(new)
+				for threshold in thresholds:
+					old_networks = store.networks_between(sections[threshold], low, high)
+					new_networks = [(int(net.network_address), net.prefixlen) for net in networks_by_threshold.get(threshold, [])]
+					old_objects, old_total, old_missing = _region_stats(old_networks, old_index, version)
+					new_objects, new_total, new_missing = _region_stats(new_networks, new_index, version)
+					change = changes[threshold]
+					change[0] += new_objects - old_objects
+					change[1] += new_index.total - old_index.total
+					change[2] += new_total - old_total
+					change[3] += new_missing - old_missing
+					network_splices[version][sections[threshold]].append((low, high, new_networks))
+				interval_splices[version][hosts_section].append((low, high, new))
+
+		results = summary['results']
+		for r in results:
+			objects, original, total, missing = changes[r['threshold']]
+			r['objects_defined'] += objects
+			r['original_ips'] += original
+			r['total_ips_final'] += total
+			r['missing_ips_included'] += missing
+		host_ips_count = results[0]['original_ips']
+		if not host_ips_count:
+			raise ValueError('No host IPs would remain after this change')
+		for r in results:
+			r['expansion_percent'] = (r['missing_ips_included'] / r['original_ips']) * 100
+
+		results = equal_weight_score(results)
+		frontier = pareto_front(results)
+		recommended = min(frontier, key=lambda r: r['score'])
+		summary = {
+			key: value for key, value in summary.items() if key not in ('budget', 'optimal_frontier', 'metrics')
+		}
+		summary.update({
+			'host_ips_count': host_ips_count,
+			'results': results,
+			'frontier': frontier,
+			'recommended': {key: recommended[key] for key in (
+				'threshold', 'score', 'objects_defined', 'missing_ips_included', 'expansion_percent'
+			)},
+			'delta': {
+				'base_analysis_id': summary.get('analysis_id'),
+				'added': count_hosts(added4) + count_hosts(added6),
+				'removed': count_hosts(removed4) + count_hosts(removed6),
+				'regions': region_count
+			}
+		})
+		if analysis_id is not None:
+			summary['analysis_id'] = analysis_id
+
+	metrics.inc('delta_regions', region_count)
+	splice_result_store(path, target, summary, network_splices[4], network_splices[6], interval_splices[4],
+	                    interval_splices[6], drop=drop)
+	return summary
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Background job queue for long-running uploads.
+Runs jobs on a bounded thread pool and tracks per-job stage and percent progress.
+"""
+
+import secrets
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+class QueueFullError(Exception):
+	"""Raised when the queue already holds its maximum number of unfinished jobs."""
+
+class Job:
+	"""A queued unit of work with progress reported through update()."""
+
+	def __init__(self, job_id: str):
+		self.id = job_id
+		self.status = 'queued'
+		self.stage = 'Queued'
+		self.percent = 0.0
+		self.result = None
+		self.error = None
+		self.created = time.time()
+		self.finished = None
+		self.future: Optional[Future] = None
+
+	def update(self, stage: str, percent: float):
+		"""Progress callback handed to the core functions."""
+		self.stage = stage
+		self.percent = max(0.0, min(100.0, percent))
+
+	def to_dict(self) -> Dict:
+		return {
+			'id': self.id,
+			'status': self.status,
+			'stage': self.stage,
+			'percent': round(self.percent, 1),
+			'error': self.error
+		}
+
+class JobQueue:
+	"""Bounded worker pool; at most max_pending jobs may be queued or running at once."""
+
+	def __init__(self, workers: int = 2, max_pending: int = 8, ttl_seconds: int = 3600):
+		self.max_pending = max_pending
+		self.ttl_seconds = ttl_seconds
+		self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload-job')
+		self._jobs: Dict[str, Job] = {}
+		self._lock = threading.Lock()
+
+	def _pending_count(self) -> int:
+		return sum(1 for job in self._jobs.values() if job.status in ('queued', 'running'))
+
+	def _expire(self):
+		"""Forget finished jobs older than the TTL."""
+		cutoff = time.time() - self.ttl_seconds
+		for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+			del self._jobs[job_id]
+
+	def reserve(self) -> Job:
+		"""
+		Claim a queue slot for a job whose input is not ready yet; hand it to start() or cancel().
+
+		The reserved job counts against max_pending, so callers can refuse work before reading
+		its input. Raises QueueFullError when max_pending jobs are already unfinished.
+		"""
+		with self._lock:
+			self._expire()
+			if self._pending_count() >= self.max_pending:
+				raise QueueFullError(f'Job queue is full ({self.max_pending} pending jobs)')
+			job = Job(secrets.token_urlsafe(16))
+			self._jobs[job.id] = job
+			return job
+
+	def start(self, job: Job, fn: Callable, *args, **kwargs) -> Job:
+		"""Run fn(*args, progress_callback=job.update, **kwargs) as the reserved job."""
+		def run():
+			job.status = 'running'
+			try:
+				job.result = fn(*args, progress_callback=job.update, **kwargs)
+				job.update('Complete', 100)
+				job.status = 'done'
+			except Exception as e:
+				job.error = str(e)
+				job.status = 'error'
+			finally:
+				job.finished = time.time()
+			return job.result
+
+		job.future = self._executor.submit(run)
+		return job
+
+	def cancel(self, job: Job):
+		"""Release a reserved job that was never started."""
+		with self._lock:
+			if job.future is None:
+				self._jobs.pop(job.id, None)
+
+	def submit(self, fn: Callable, *args, **kwargs) -> Job:
+		"""
+		Queue fn(*args, progress_callback=job.update, **kwargs) and return its Job.
+
+		Raises QueueFullError when max_pending jobs are already unfinished.
+		"""
+		return self.start(self.reserve(), fn, *args, **kwargs)
+
+	def get(self, job_id: str) -> Optional[Job]:
+		with self._lock:
+			return self._jobs.get(job_id)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Lightweight instrumentation for the consolidation pipeline.
+Counters and per-stage timers (wall time and peak memory) go into a process-wide registry
+rendered in Prometheus text format, and into any per-run collector active on the thread.
+
+Peak memory is the tracemalloc peak while the stage ran, recorded only while tracemalloc is
+tracing (METRICS_TRACE_MEMORY=true in the web app); otherwise stages record a peak of 0.
+tracemalloc's peak is process-wide, so a stage that overlaps a stage on another thread
+records no peak rather than one that includes the other thread's allocations.
+Work done in pool worker processes is not recorded.
+"""
+
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+METRIC_PREFIX = 'ipcons'
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_local = threading.local()
+
+# Threads inside a stage, and a count bumped whenever stages on two threads overlap
+_trace_lock = threading.Lock()
+_threads_in_stages = 0
+_overlaps = 0
+
+def _label_key(labels: Dict) -> Labels:
+	return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels) -> str:
+	if not labels:
+		return ''
+	escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+	return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+class MetricsRecorder:
+	"""Thread-safe store of counters and stage statistics, keyed by name and labels."""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._counters: Dict[Tuple[str, Labels], float] = {}
+		# (name, labels) -> [calls, total seconds, max seconds, peak bytes]
+		self._stages: Dict[Tuple[str, Labels], List] = {}
+
+	def inc(self, name: str, value: float = 1, labels: Labels = ()):
+		with self._lock:
+			key = (name, labels)
+			self._counters[key] = self._counters.get(key, 0) + value
+
+	def observe(self, name: str, seconds: float, peak_bytes: int = 0, labels: Labels = ()):
+		with self._lock:
+			stats = self._stages.setdefault((name, labels), [0, 0.0, 0.0, 0])
+			stats[0] += 1
+			stats[1] += seconds
+			stats[2] = max(stats[2], seconds)
+			stats[3] = max(stats[3], peak_bytes)
+
+	def snapshot(self) -> Dict:
+		"""Plain-dict copy, with labels rendered into the keys, e.g. 'supernet_probes{version="4"}'."""
+		with self._lock:
+			return {
+				'counters': {name + _format_labels(labels): value for (name, labels), value in sorted(self._counters.items())},
+				'stages': {
+					name + _format_labels(labels): {'calls': calls, 'seconds': seconds, 'max_seconds': max_seconds, 'peak_bytes': peak}
+					for (name, labels), (calls, seconds, max_seconds, peak) in sorted(self._stages.items())
+				}
+			}
+
+	def render_prometheus(self) -> str:
+		"""Prometheus text exposition of every counter and stage."""
+		with self._lock:
+			counters = sorted(self._counters.items())
+			stages = sorted(self._stages.items())
+
+		lines = []
+		for metric, help_text, kind, field in (
+			('stage_seconds_total', 'Wall time spent in each stage.', 'counter', 1),
+			('stage_calls_total', 'Times each stage ran.', 'counter', 0),
+			('stage_max_seconds', 'Longest single run of each stage.', 'gauge', 2),
+			('stage_peak_bytes', 'Highest peak memory seen during each stage.', 'gauge', 3),
+		):
+			lines.append(f'# HELP {METRIC_PREFIX}_{metric} {help_text}')
+			lines.append(f'# TYPE {METRIC_PREFIX}_{metric} {kind}')
+			for (name, labels), stats in stages:
+				lines.append(f'{METRIC_PREFIX}_{metric}{_format_labels((("stage", name),) + labels)} {stats[field]}')
+
+		previous = None
+		for (name, labels), value in counters:
+			if name != previous:
+				lines.append(f'# TYPE {METRIC_PREFIX}_{name}_total counter')
+				previous = name
+			lines.append(f'{METRIC_PREFIX}_{name}_total{_format_labels(labels)} {value}')
+		return '\n'.join(lines) + '\n'
+
+# Process-wide registry behind the /metrics endpoint
+REGISTRY = MetricsRecorder()
+
+def _recorders() -> List[MetricsRecorder]:
+	return [REGISTRY] + getattr(_local, 'collectors', [])
+
+def inc(name: str, value: float = 1, **labels):
+	"""Add value to a counter in the registry and in any collector active on this thread."""
+	key = _label_key(labels)
+	for recorder in _recorders():
+		recorder.inc(name, value, key)
+
+def observe(name: str, seconds: float, peak_bytes: int = 0, **labels):
+	"""Record one run of a stage that was timed by the caller."""
+	key = _label_key(labels)
+	for recorder in _recorders():
+		recorder.observe(name, seconds, peak_bytes, key)
+
+@contextmanager
+def stage(name: str, **labels) -> Iterator[None]:
+	"""Time the enclosed block as one run of a stage, with its peak memory when tracemalloc is tracing."""
+	global _threads_in_stages, _overlaps
+	stack = _local.__dict__.setdefault('stages', [])
+	tracing = tracemalloc.is_tracing()
+	with _trace_lock:
+		if not stack:
+			_threads_in_stages += 1
+			if _threads_in_stages > 1:
+				_overlaps += 1
+		alone = _threads_in_stages == 1
+		overlaps = _overlaps
+		# Resetting the peak while another thread's stage runs would discard that stage's peak
+		if tracing and alone:
+			# The enclosing stage keeps its peak so far, since reset_peak() discards it
+			_, outer_peak = tracemalloc.get_traced_memory()
+			if stack:
+				stack[-1][0] = max(stack[-1][0], outer_peak)
+			tracemalloc.reset_peak()
+	frame = [0]  # Highest peak of nested stages
+	stack.append(frame)
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		seconds = time.perf_counter() - started
+		stack.pop()
+		with _trace_lock:
+			if not stack:
+				_threads_in_stages -= 1
+			alone = alone and overlaps == _overlaps
+		peak = 0
+		# Without tracemalloc there is no per-stage peak; the process's lifetime peak RSS would mislead
+		if tracing and tracemalloc.is_tracing() and alone:
+			peak = max(tracemalloc.get_traced_memory()[1], frame[0])
+			if stack:
+				stack[-1][0] = max(stack[-1][0], peak)
+		observe(name, seconds, peak, **labels)
+
+@contextmanager
+def collect(recorder: Optional[MetricsRecorder] = None) -> Iterator[MetricsRecorder]:
+	"""
+	Also record this thread's metrics into a recorder, e.g. to attach to one analysis result.
+
+	Pass the recorder from an earlier collect() to continue it, such as on another thread.
+	"""
+	collectors = _local.__dict__.setdefault('collectors', [])
+	recorder = recorder or MetricsRecorder()
+	collectors.append(recorder)
+	try:
+		yield recorder
+	finally:
+		collectors.remove(recorder)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Optional NumPy backend for network consolidation.
+Holds hosts as uint32/int64 arrays so parse, dedupe, sort and collapse are vectorized.
+Importing this module raises ImportError when NumPy is not installed.
+"""
+
+import ipaddress
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+
+ADDRESS_SPACE = 1 << 32
+
+def _parse_octets(ip_list: List[str]) -> Optional[np.ndarray]:
+	"""
+	Octets of dotted-quad strings as an (n, 4) int64 array, or None unless every string is one
+	that ipaddress.IPv4Address accepts: exactly three dots, one to three ASCII digits per
+	octet, no leading zeros and no octet above 255. Works on the bytes of the joined strings.
+	"""
+	try:
+		text = np.frombuffer(('\n'.join(ip_list) + '\n').encode('ascii'), dtype=np.uint8)
+	except UnicodeEncodeError:
+		return None
+	is_dot = text == ord('.')
+	is_separator = is_dot | (text == ord('\n'))
+	if not np.all(is_separator | ((text >= ord('0')) & (text <= ord('9')))):
+		return None
+
+	# Each address must end its first three octets with a dot and the last with its newline
+	ends = np.flatnonzero(is_separator)
+	if ends.size != 4 * len(ip_list):
+		return None
+	dots = is_dot[ends].reshape(-1, 4)
+	if not np.all(dots[:, :3]) or np.any(dots[:, 3]):
+		return None
+	starts = np.concatenate(([0], ends[:-1] + 1))
+	lengths = ends - starts
+	if lengths.min() < 1 or lengths.max() > 3 or np.any((lengths > 1) & (text[starts] == ord('0'))):
+		return None
+
+	digits = text.astype(np.int64) - ord('0')
+	octets = digits[ends - 1]
+	octets += np.where(lengths >= 2, digits[ends - 2], 0) * 10
+	octets += np.where(lengths == 3, digits[ends - 3], 0) * 100
+	if octets.max() > 255:
+		return None
+	return octets.reshape(-1, 4)
+
+def parse_ips(ip_list: Iterable[str]) -> np.ndarray:
+	"""Parse dotted-quad strings into a uint32 array with vectorized validation and conversion."""
+	ip_list = list(ip_list)
+	if not ip_list:
+		return np.empty(0, dtype=np.uint32)
+
+	# Anything the vectorized checks reject takes the strict path, which raises the same errors as core
+	octets = _parse_octets(ip_list)
+	if octets is None:
+		return np.array([int(ipaddress.IPv4Address(ip)) for ip in ip_list], dtype=np.uint32)
+	return ((octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]).astype(np.uint32)
+
+def sorted_unique(values: np.ndarray) -> np.ndarray:
+	"""Sort and dedupe an integer array (np.sort plus a neighbour mask beats np.unique on large inputs)."""
+	values = np.sort(values)
+	if values.size == 0:
+		return values
+	return values[np.concatenate(([True], values[1:] != values[:-1]))]
+
+def intervals_from_hosts(hosts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""Dedupe and sort host integers, then split them into runs of consecutive addresses."""
+	hosts = sorted_unique(np.asarray(hosts)).astype(np.int64)
+	if hosts.size == 0:
+		return hosts, hosts
+	breaks = np.nonzero(np.diff(hosts) != 1)[0]
+	starts = hosts[np.concatenate(([0], breaks + 1))]
+	ends = hosts[np.concatenate((breaks, [hosts.size - 1]))]
+	return starts, ends
+
+def merge_intervals(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""Merge overlapping and adjacent intervals using a running maximum of the ends."""
+	starts = np.asarray(starts, dtype=np.int64)
+	ends = np.asarray(ends, dtype=np.int64)
+	if starts.size == 0:
+		return starts, ends
+	order = np.lexsort((ends, starts))
+	starts, ends = starts[order], ends[order]
+	reach = np.maximum.accumulate(ends)
+	new_group = np.concatenate(([True], starts[1:] > reach[:-1] + 1))
+	group_starts = np.nonzero(new_group)[0]
+	group_ends = np.concatenate((group_starts[1:] - 1, [starts.size - 1]))
+	return starts[group_starts], reach[group_ends]
+
+def to_interval_arrays(hosts: Iterable) -> Tuple[np.ndarray, np.ndarray]:
+	"""Normalize host IP strings or [start, end] intervals into merged interval arrays."""
+	hosts = list(hosts)
+	if all(isinstance(item, str) for item in hosts):
+		return intervals_from_hosts(parse_ips(hosts))
+
+	starts = np.empty(len(hosts), dtype=np.int64)
+	ends = np.empty(len(hosts), dtype=np.int64)
+	for i, item in enumerate(hosts):
+		if isinstance(item, (str, ipaddress.IPv4Address)):
+			starts[i] = ends[i] = int(ipaddress.IPv4Address(item))
+		else:
+			starts[i], ends[i] = int(item[0]), int(item[1])
+	return merge_intervals(starts, ends)
+
+def _floor_log2(values: np.ndarray) -> np.ndarray:
+	"""Exact floor(log2(x)) for positive integers below 2**53."""
+	_, exponent = np.frexp(values.astype(np.float64))
+	return exponent.astype(np.int64) - 1
+
+def collapse(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""
+	Collapse merged intervals into the minimal aligned CIDR blocks.
+
+	Each pass emits, for every unfinished interval at once, the largest block that is
+	aligned at its start and fits in what remains, so it runs at most 64 passes.
+	"""
+	starts = np.array(starts, dtype=np.int64)
+	ends = np.asarray(ends, dtype=np.int64)
+	addresses, prefixes = [], []
+
+	while starts.size:
+		alignment = np.where(starts == 0, ADDRESS_SPACE, starts & -starts)
+		fit = np.left_shift(1, _floor_log2(ends - starts + 1))
+		size = np.minimum(alignment, fit)
+		addresses.append(starts.copy())
+		prefixes.append(32 - _floor_log2(size))
+		starts += size
+		unfinished = starts <= ends
+		starts, ends = starts[unfinished], ends[unfinished]
+
+	if not addresses:
+		return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+	addresses = np.concatenate(addresses)
+	prefixes = np.concatenate(prefixes)
+	order = np.argsort(addresses, kind='stable')
+	return addresses[order], prefixes[order]
+
+def count_in_ranges(starts: np.ndarray, ends: np.ndarray, cumulative: np.ndarray, lows: np.ndarray, highs: np.ndarray) -> np.ndarray:
+	"""Count the hosts inside each [low, high] range with searchsorted over the intervals."""
+	def count_upto(addresses):
+		i = np.searchsorted(starts, addresses, side='right') - 1
+		safe = np.maximum(i, 0)
+		covered = cumulative[safe] + np.minimum(ends[safe], addresses) - starts[safe] + 1
+		return np.where(i < 0, 0, covered)
+	return count_upto(highs) - count_upto(lows - 1)
+
+def consolidate_with_bias_sweep(starts: np.ndarray, ends: np.ndarray, thresholds: Iterable[int]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+	"""
+	Vectorized bias expansion for several thresholds in one climb.
+
+	Every collapsed network climbs toward /8 in lockstep while tracking the largest missing
+	percent seen so far; each threshold keeps the highest level it can afford.
+	"""
+	thresholds = list(thresholds)
+	ceiling = max(thresholds)
+	addresses, prefixes = collapse(starts, ends)
+	cumulative = np.concatenate(([0], np.cumsum(ends - starts + 1)))
+
+	required = np.zeros(addresses.size, dtype=np.float64)
+	climbs = {threshold: np.zeros(addresses.size, dtype=np.int64) for threshold in thresholds}
+	active = np.nonzero((prefixes < 32) & (prefixes > 8))[0]
+	level = 0
+	probes = 0
+
+	while active.size:
+		level += 1
+		probes += active.size
+		prefix = prefixes[active] - level
+		size = np.left_shift(1, 32 - prefix)
+		parent = addresses[active] & ~(size - 1)
+		# Only the parent's usable hosts count, as with IPv4Network.hosts()
+		matching_ips = count_in_ranges(starts, ends, cumulative, parent + 1, parent + size - 2)
+
+		total_ips_in_parent = size - 2
+		covered_percent = (matching_ips / total_ips_in_parent) * 100
+		missing_percent = 100 - covered_percent
+
+		needed = missing_percent if level == 1 else np.maximum(required[active], missing_percent)
+		required[active] = needed
+		for threshold, climb in climbs.items():
+			climb[active[needed <= threshold]] = level
+		active = active[(needed <= ceiling) & (prefix > 8)]
+
+	metrics.inc('networks_collapsed', addresses.size, version=4)
+	metrics.inc('supernet_probes', probes, version=4)
+	results = {}
+	for threshold, climb in climbs.items():
+		metrics.inc('supernet_climbs', int(climb.sum()), version=4, threshold=threshold)
+		best_prefixes = prefixes - climb
+		best_addresses = addresses & ~(np.left_shift(1, 32 - best_prefixes) - 1)
+		# Remove duplicates and sort by (address, prefix)
+		keys = sorted_unique(best_addresses * 64 + best_prefixes)
+		results[threshold] = (keys >> 6, keys & 63)
+	return results
+
+def consolidate_with_bias(starts: np.ndarray, ends: np.ndarray, max_missing_percent: int = 25) -> Tuple[np.ndarray, np.ndarray]:
+	"""Vectorized bias expansion: every collapsed network climbs toward /8 in lockstep."""
+	return consolidate_with_bias_sweep(starts, ends, [max_missing_percent])[max_missing_percent]
@@ -2,26 +2,50 @@
 """
 Output generation module for network consolidation.
 Handles network configuration generation, file writing, and console output.
+Export formats are Renderer subclasses registered in RENDERERS; iter_bundle streams
+any number of them for several consolidations as one zip archive.
 """
 
 import ipaddress
-from typing import List, Dict, Tuple
+import json
+import time
+import zipfile
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import metrics
+
+# Dotted netmask for every prefix length, indexed by prefix
+NETMASKS = [str(ipaddress.IPv4Address((0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF)) for prefix in range(33)]
+
+# Bytes per chunk when streaming rendered output
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Prefix of the ipset and nftables set names
+SET_NAME_PREFIX = 'ipcons'
+
+# ipset's default maximum set size, raised for larger sets
+IPSET_DEFAULT_MAXELEM = 65536
 
 def make_object_name(network_str: str) -> str:
-	"""Generate a simple object name using the base IP address with dots."""
-	network = ipaddress.IPv4Network(network_str, strict=False)
+	"""Generate a simple object name using the base IP address."""
+	network = ipaddress.ip_network(network_str, strict=False)
 	return str(network.network_address)
 
+@metrics.stage('render', format='asa_lines')
 def generate_asa_output(networks: List[str], threshold: int) -> Tuple[List[str], List[str]]:
 	"""Generate ASA object definitions and group references."""
 	object_definitions_lines = []
 	group_reference_lines = []
 	
 	for network_str in networks:
-		network = ipaddress.IPv4Network(network_str, strict=False)
-		obj_name = make_object_name(network_str)
-		if network.prefixlen == 32:
+		network = ipaddress.ip_network(network_str, strict=False)
+		obj_name = str(network.network_address)
+		if network.prefixlen == network.max_prefixlen:
 			group_reference_lines.append(f"network-object host {network.network_address}")
+		elif network.version == 6:
+			object_definitions_lines.append(f"object network {obj_name}")
+			object_definitions_lines.append(f" subnet {network.with_prefixlen}")
+			group_reference_lines.append(f"network-object object {obj_name}")
 		else:
 			object_definitions_lines.append(f"object network {obj_name}")
 			object_definitions_lines.append(f" subnet {network.network_address} {network.netmask}")
@@ -40,7 +64,310 @@ def write_asa_file(object_lines: List[str], group_lines: List[str], threshold: i
 		for line in group_lines:
 			f.write(line + "\n")
 
+def format_address(address: int) -> str:
+	"""Dotted-quad text for an integer IPv4 address."""
+	return f"{address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.{address & 255}"
+
+def format_address6(address: int) -> str:
+	"""Compressed text for an integer IPv6 address."""
+	return str(ipaddress.IPv6Address(address))
+
+def render_asa_lines(networks: Sequence[Tuple[int, int]], threshold: Optional[int],
+                     networks_v6: Sequence[Tuple[int, int]] = (), heading: Optional[str] = None) -> Iterator[str]:
+	"""
+	Yield the lines of write_asa_file's output from (address, prefix) pairs.
+
+	Produces the same text as generate_asa_output plus write_asa_file, one line at a time,
+	without parsing network strings or holding the output in memory. IPv6 networks follow
+	the IPv4 ones in both sections, using ASA's prefix-length subnet syntax. heading, when
+	given, replaces the threshold in the first line (e.g. "a budget of 500 entries").
+	"""
+	yield f"! Generated with {heading or f'{threshold}% missing threshold'}\n"
+	yield "! === Object definitions ===\n"
+	for address, prefix in networks:
+		if prefix != 32:
+			name = format_address(address)
+			yield f"object network {name}\n subnet {name} {NETMASKS[prefix]}\n"
+	for address, prefix in networks_v6:
+		if prefix != 128:
+			name = format_address6(address)
+			yield f"object network {name}\n subnet {name}/{prefix}\n"
+	yield "\n! === Group member list ===\n"
+	for address, prefix in networks:
+		if prefix == 32:
+			yield f"network-object host {format_address(address)}\n"
+		else:
+			yield f"network-object object {format_address(address)}\n"
+	for address, prefix in networks_v6:
+		if prefix == 128:
+			yield f"network-object host {format_address6(address)}\n"
+		else:
+			yield f"network-object object {format_address6(address)}\n"
+
+def render_raw_lines(networks: Iterable[Tuple[int, int]], threshold: Optional[int], result: Dict,
+                     networks_v6: Iterable[Tuple[int, int]] = (), heading: Optional[str] = None) -> Iterator[str]:
+	"""Yield a raw CIDR listing (IPv4, then IPv6) with a commented statistics header; heading replaces the threshold."""
+	yield f"# Raw IP Addresses for {heading or f'{threshold}% threshold'}\n"
+	yield "# Generated from uploaded file\n"
+	yield f"# Objects: {result['objects_defined']}\n"
+	yield f"# Missing IPs: {result['missing_ips_included']}\n"
+	yield f"# Expansion: {result['expansion_percent']:.1f}%\n\n"
+	for address, prefix in networks:
+		yield f"{format_address(address)}/{prefix}\n"
+	for address, prefix in networks_v6:
+		yield f"{format_address6(address)}/{prefix}\n"
+
+class ExportSection(NamedTuple):
+	"""One consolidation to export: a threshold's result or the object budget."""
+	label: str  # Output file name suffix, e.g. '25percent' or 'budget500'
+	threshold: Optional[int]
+	heading: Optional[str]  # Replaces the threshold in headers, e.g. "a budget of 500 entries"
+	result: Dict  # Statistics: objects_defined, missing_ips_included, expansion_percent, ...
+	networks: Sequence[Tuple[int, int]]
+	networks_v6: Sequence[Tuple[int, int]]
+
+class Renderer:
+	"""
+	An export format. Subclasses set name, prefix and extension and yield the file's text
+	from render(); decorating them with register_renderer makes them available to every download.
+	"""
+
+	name = ''  # Format key used in requests
+	prefix = ''  # Output file name prefix
+	extension = 'txt'
+	mimetype = 'text/plain'
+
+	def filename(self, section: ExportSection) -> str:
+		return f"{self.prefix}_{section.label}.{self.extension}"
+
+	def render(self, section: ExportSection) -> Iterator[str]:
+		raise NotImplementedError
+
+# Registered export formats by name, in registration order
+RENDERERS: Dict[str, Renderer] = {}
+
+def register_renderer(cls):
+	"""Class decorator adding an instance of a Renderer subclass to RENDERERS."""
+	RENDERERS[cls.name] = cls()
+	return cls
+
+def set_name(section: ExportSection, version: int = 4) -> str:
+	"""ipset/nftables set name of one section's networks of one IP version (at most 31 characters for ipset)."""
+	return f"{SET_NAME_PREFIX}_{section.label}" if version == 4 else f"{SET_NAME_PREFIX}_{section.label}_v6"
+
+def _split_default_route(networks: Iterable[Tuple[int, int]], bits: int) -> Iterator[Tuple[int, int]]:
+	"""Networks with a /0 replaced by its two /1 halves, for set types without /0 support."""
+	for address, prefix in networks:
+		if prefix == 0:
+			yield 0, 1
+			yield 1 << (bits - 1), 1
+		else:
+			yield address, prefix
+
+def _outermost_networks(networks: Iterable[Tuple[int, int]], bits: int) -> Iterator[Tuple[int, int]]:
+	"""Networks in address order without those inside another one (CIDR blocks nest or are disjoint)."""
+	end = -1
+	for address, prefix in sorted(networks):
+		if address > end:
+			yield address, prefix
+			end = address + (1 << (bits - prefix)) - 1
+
+@register_renderer
+class AsaRenderer(Renderer):
+	"""Cisco ASA object definitions and group members, as render_asa_lines."""
+
+	name = 'asa'
+	prefix = 'asa_output'
+
+	def render(self, section: ExportSection) -> Iterator[str]:
+		return render_asa_lines(section.networks, section.threshold, section.networks_v6, heading=section.heading)
+
+@register_renderer
+class RawRenderer(Renderer):
+	"""Plain CIDR listing, as render_raw_lines."""
+
+	name = 'raw'
+	prefix = 'raw_ips'
+
+	def render(self, section: ExportSection) -> Iterator[str]:
+		return render_raw_lines(section.networks, section.threshold, section.result, section.networks_v6,
+		                        heading=section.heading)
+
+@register_renderer
+class IpsetRenderer(Renderer):
+	"""
+	Input for `ipset restore`: a hash:net set per IP version, created when missing and
+	emptied before the networks are added, so loading the file again replaces the set.
+	"""
+
+	name = 'ipset'
+	prefix = 'ipset'
+	extension = 'ipset'
+
+	def render(self, section: ExportSection) -> Iterator[str]:
+		yield f"# Generated with {section.heading or f'{section.threshold}% missing threshold'}\n"
+		families = [(4, 'inet', 32, section.networks)]
+		if section.networks_v6:
+			families.append((6, 'inet6', 128, section.networks_v6))
+		for version, family, bits, networks in families:
+			name = set_name(section, version)
+			# hash:net takes prefixes 1 to 32 (128), so a /0 counts as its two halves
+			size = len(networks) + sum(1 for _, prefix in networks if prefix == 0)
+			yield f"create {name} hash:net family {family} maxelem {max(size, IPSET_DEFAULT_MAXELEM)} -exist\n"
+			yield f"flush {name}\n"
+			format_text = format_address if version == 4 else format_address6
+			for address, prefix in _split_default_route(networks, bits):
+				yield f"add {name} {format_text(address)}/{prefix}\n"
+
+@register_renderer
+class NftablesRenderer(Renderer):
+	"""
+	An `nft -f` script adding an interval set per IP version to the inet table SET_NAME_PREFIX.
+	The sets are flushed before their elements are added, so loading the file again replaces them.
+	Interval sets reject overlapping elements, so networks inside another listed one are left out.
+	"""
+
+	name = 'nftables'
+	prefix = 'nftables'
+	extension = 'nft'
+
+	def render(self, section: ExportSection) -> Iterator[str]:
+		yield f"# Generated with {section.heading or f'{section.threshold}% missing threshold'}\n"
+		yield f"add table inet {SET_NAME_PREFIX}\n"
+		families = [(4, 'ipv4_addr', 32, section.networks)]
+		if section.networks_v6:
+			families.append((6, 'ipv6_addr', 128, section.networks_v6))
+		for version, address_type, bits, networks in families:
+			name = set_name(section, version)
+			yield f"add set inet {SET_NAME_PREFIX} {name} {{ type {address_type}; flags interval; }}\n"
+			yield f"flush set inet {SET_NAME_PREFIX} {name}\n"
+			if not networks:
+				continue
+			format_text = format_address if version == 4 else format_address6
+			yield f"add element inet {SET_NAME_PREFIX} {name} {{\n"
+			separator = '\t'
+			for address, prefix in _outermost_networks(networks, bits):
+				yield f"{separator}{format_text(address)}/{prefix}"
+				separator = ',\n\t'
+			yield "\n}\n"
+
+@register_renderer
+class JsonRenderer(Renderer):
+	"""The section's statistics and its networks as CIDR strings (IPv4, then IPv6) in one JSON object."""
+
+	name = 'json'
+	prefix = 'networks'
+	extension = 'json'
+	mimetype = 'application/json'
+
+	def render(self, section: ExportSection) -> Iterator[str]:
+		yield "{\n"
+		if section.heading:
+			yield f'  "generated_for": {json.dumps(section.heading)},\n'
+		for key, value in section.result.items():
+			if key != 'networks':
+				yield f"  {json.dumps(key)}: {json.dumps(value)},\n"
+		yield '  "networks": ['
+		separator = '\n    '
+		for address, prefix in section.networks:
+			yield f'{separator}"{format_address(address)}/{prefix}"'
+			separator = ',\n    '
+		for address, prefix in section.networks_v6:
+			yield f'{separator}"{format_address6(address)}/{prefix}"'
+			separator = ',\n    '
+		yield "\n  ]\n}\n"
+
+def _encode_batches(lines: Iterable[str], chunk_size: int) -> Iterator[bytes]:
+	"""Join lines into encoded chunks of roughly chunk_size bytes."""
+	buffer = []
+	size = 0
+	for line in lines:
+		buffer.append(line)
+		size += len(line)
+		if size >= chunk_size:
+			yield ''.join(buffer).encode('ascii')
+			buffer = []
+			size = 0
+	if buffer:
+		yield ''.join(buffer).encode('ascii')
+
+def _timed_chunks(chunks: Iterable[bytes], target: str) -> Iterator[bytes]:
+	"""Pass chunks through, recording the time spent producing them, excluding time the consumer spends between chunks, and the bytes produced."""
+	written = 0
+	rendering = 0.0
+	resumed = time.perf_counter()
+	try:
+		for chunk in chunks:
+			written += len(chunk)
+			rendering += time.perf_counter() - resumed
+			yield chunk
+			resumed = time.perf_counter()
+		rendering += time.perf_counter() - resumed
+		resumed = None
+	finally:
+		# Also reached when the client disconnects mid-download
+		if resumed is not None:
+			rendering += time.perf_counter() - resumed
+		metrics.observe('render', rendering, format=target)
+		metrics.inc('bytes_written', written, target=target)
+
+def iter_chunks(lines: Iterable[str], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+	"""
+	Batch rendered lines into encoded chunks of roughly chunk_size bytes for streaming.
+
+	Records the rendering time, excluding time the consumer spends between chunks, and the bytes produced.
+	"""
+	return _timed_chunks(_encode_batches(lines, chunk_size), 'stream')
+
+class _ZipSink:
+	"""Write-only, non-seekable file for ZipFile that keeps what is written until it is drained."""
+
+	def __init__(self):
+		self._pieces = []
+		self.size = 0
+
+	def write(self, data) -> int:
+		self._pieces.append(bytes(data))
+		self.size += len(data)
+		return len(data)
+
+	def flush(self):
+		pass
+
+	def drain(self) -> bytes:
+		data = b''.join(self._pieces)
+		self._pieces = []
+		self.size = 0
+		return data
+
+def _zip_pieces(sections: Iterable[ExportSection], renderers: Sequence[Renderer], chunk_size: int) -> Iterator[bytes]:
+	sink = _ZipSink()
+	date_time = time.localtime()[:6]
+	# ZipFile writes sizes after each member's data when it cannot seek back
+	with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+		for section in sections:
+			for renderer in renderers:
+				info = zipfile.ZipInfo(renderer.filename(section), date_time)
+				info.compress_type = zipfile.ZIP_DEFLATED
+				with archive.open(info, 'w', force_zip64=True) as member:
+					for chunk in _encode_batches(renderer.render(section), chunk_size):
+						member.write(chunk)
+						if sink.size >= chunk_size:
+							yield sink.drain()
+	yield sink.drain()
+
+def iter_bundle(sections: Iterable[ExportSection], formats: Sequence[str],
+                chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+	"""
+	Stream a zip archive holding every section rendered in every format.
 
+	Each section is rendered into all the formats before the next is taken, so sections can
+	be produced lazily and only one is held at a time. The archive is built in memory as it
+	is yielded, in chunks of roughly chunk_size bytes: no file is written and nothing is
+	seeked. Raises KeyError for unknown formats.
+	"""
+	renderers = [RENDERERS[name] for name in formats]
+	return _timed_chunks(_zip_pieces(sections, renderers, chunk_size), 'bundle')
 
 def print_analysis_summary(results: List[Dict], frontier: List[Dict], recommended: Dict):
 	"""Print formatted analysis summary to console."""
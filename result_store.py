@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Compact binary store for consolidation analysis results.
+One file per analysis: a small JSON summary plus named sections of packed networks,
+read through mmap so a request only touches the bytes it needs.
+
+Layout (little-endian):
+	header      magic 'IPCS', version u16, reserved u16, summary length u32, section count u32
+	directory   per section: name (16 bytes, NUL padded), kind u8, 7 pad bytes, offset u64, count u64
+	summary     UTF-8 JSON
+	sections    IPv4 networks: count uint32 addresses, then count uint8 prefixes (4-byte aligned)
+	            IPv6 networks: count 16-byte big-endian addresses, then count uint8 prefixes
+	            IPv4 intervals: count uint32 starts, then count uint32 ends
+	            IPv6 intervals: count 16-byte big-endian starts, then count 16-byte ends
+"""
+
+import bisect
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import metrics
+
+MAGIC = b'IPCS'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHII')
+DIRECTORY_ENTRY = struct.Struct('<16sB7xQQ')
+
+SECTION_NETWORKS = 1
+SECTION_NETWORKS6 = 2
+SECTION_INTERVALS = 3
+SECTION_INTERVALS6 = 4
+
+# Width and byte order of each column of a section, by kind
+_COLUMNS = {
+	SECTION_NETWORKS: ((4, 'little'), (1, 'little')),
+	SECTION_NETWORKS6: ((16, 'big'), (1, 'little')),
+	SECTION_INTERVALS: ((4, 'little'), (4, 'little')),
+	SECTION_INTERVALS6: ((16, 'big'), (16, 'big')),
+}
+
+# Sections holding the input host intervals, kept so later requests can re-consolidate
+HOSTS_SECTION = 'hosts'
+HOSTS_SECTION_V6 = 'hosts.v6'
+
+Network = Tuple[int, int]
+Interval = Tuple[int, int]
+
+# Sorted, disjoint (low, high) address ranges, each with the rows replacing the old ones inside it
+Splices = Dict[str, List[Tuple[int, int, List[Tuple[int, int]]]]]
+
+def threshold_section(threshold: int, version: int = 4) -> str:
+	"""Section name holding one threshold's networks of one IP version."""
+	return f"t{threshold}" if version == 4 else f"t{threshold}.v6"
+
+def format_network(address: int, prefix: int) -> str:
+	"""Render an (address, prefix) pair as CIDR text without building an IPv4Network."""
+	return f"{address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.{address & 255}/{prefix}"
+
+def _pack_addresses(addresses: array) -> bytes:
+	if sys.byteorder == 'big':
+		addresses.byteswap()
+	return addresses.tobytes()
+
+def _unpack_addresses(data: bytes) -> array:
+	addresses = array('I')
+	addresses.frombytes(data)
+	if sys.byteorder == 'big':
+		addresses.byteswap()
+	return addresses
+
+def _encode_name(name: str) -> bytes:
+	encoded_name = name.encode('ascii')
+	if len(encoded_name) > 16:
+		raise ValueError(f"Section name too long: {name}")
+	return encoded_name
+
+def _network_payloads(sections: Dict[str, Iterable[Network]], version: int) -> List[Tuple]:
+	payloads = []
+	for name, networks in sections.items():
+		prefixes = bytearray()
+		if version == 4:
+			addresses = array('I')
+			for address, prefix in networks:
+				addresses.append(address)
+				prefixes.append(prefix)
+			payloads.append((_encode_name(name), SECTION_NETWORKS, len(prefixes), _pack_addresses(addresses) + bytes(prefixes)))
+		else:
+			addresses = bytearray()
+			for address, prefix in networks:
+				addresses += address.to_bytes(16, 'big')
+				prefixes.append(prefix)
+			payloads.append((_encode_name(name), SECTION_NETWORKS6, len(prefixes), bytes(addresses) + bytes(prefixes)))
+	return payloads
+
+def _interval_payloads(sections: Dict[str, Iterable[Interval]], version: int) -> List[Tuple]:
+	payloads = []
+	for name, intervals in sections.items():
+		if version == 4:
+			starts, ends = array('I'), array('I')
+			for start, end in intervals:
+				starts.append(start)
+				ends.append(end)
+			payloads.append((_encode_name(name), SECTION_INTERVALS, len(starts), _pack_addresses(starts) + _pack_addresses(ends)))
+		else:
+			starts, ends = bytearray(), bytearray()
+			for start, end in intervals:
+				starts += start.to_bytes(16, 'big')
+				ends += end.to_bytes(16, 'big')
+			payloads.append((_encode_name(name), SECTION_INTERVALS6, len(starts) // 16, bytes(starts) + bytes(ends)))
+	return payloads
+
+def _write_payloads(path: str, summary: Dict, payloads: List[Tuple]):
+	with metrics.stage('json_serialization', target='result_store'):
+		summary_bytes = json.dumps(summary, separators=(',', ':'), default=str).encode('utf-8')
+
+	offset = HEADER.size + DIRECTORY_ENTRY.size * len(payloads) + len(summary_bytes)
+	directory = []
+	for encoded_name, kind, count, payload in payloads:
+		offset += -offset % 4
+		directory.append(DIRECTORY_ENTRY.pack(encoded_name, kind, offset, count))
+		offset += len(payload)
+
+	with open(path, 'wb') as f:
+		f.write(HEADER.pack(MAGIC, VERSION, 0, len(summary_bytes), len(payloads)))
+		f.write(b''.join(directory))
+		f.write(summary_bytes)
+		for _, _, _, payload in payloads:
+			f.write(b'\0' * (-f.tell() % 4))
+			f.write(payload)
+		metrics.inc('bytes_written', f.tell(), target='result_store')
+
+def write_result_store(path: str, summary: Dict, sections: Dict[str, Iterable[Network]],
+                       sections_v6: Optional[Dict[str, Iterable[Network]]] = None,
+                       intervals: Optional[Dict[str, Iterable[Interval]]] = None,
+                       intervals_v6: Optional[Dict[str, Iterable[Interval]]] = None):
+	"""
+	Write the summary and each section to path.
+
+	sections and sections_v6 hold (address, prefix) pairs of IPv4 and IPv6 networks;
+	intervals and intervals_v6 hold (start, end) address intervals.
+	"""
+	_write_payloads(path, summary, _network_payloads(sections, 4) + _network_payloads(sections_v6 or {}, 6) +
+	                _interval_payloads(intervals or {}, 4) + _interval_payloads(intervals_v6 or {}, 6))
+
+def update_result_store(path: str, summary: Dict, sections: Optional[Dict[str, Iterable[Network]]] = None,
+                        sections_v6: Optional[Dict[str, Iterable[Network]]] = None):
+	"""
+	Replace the summary and add or replace network sections of an existing store.
+
+	Untouched sections are copied byte for byte, and the new file is renamed over the old
+	one, so readers that already mapped it keep a consistent view.
+	"""
+	sections = sections or {}
+	sections_v6 = sections_v6 or {}
+	payloads = _network_payloads(sections, 4) + _network_payloads(sections_v6, 6)
+	with ResultStore(path) as store:
+		for name in store.section_names():
+			if name not in sections and name not in sections_v6:
+				payloads.append((_encode_name(name),) + store._raw_section(name))
+
+	tmp_path = path + '.tmp'
+	_write_payloads(tmp_path, summary, payloads)
+	os.replace(tmp_path, path)
+
+def splice_result_store(path: str, target: str, summary: Dict, sections: Optional[Splices] = None,
+                        sections_v6: Optional[Splices] = None, intervals: Optional[Splices] = None,
+                        intervals_v6: Optional[Splices] = None, drop: Iterable[str] = ()):
+	"""
+	Write a copy of the store at path to target with rows replaced inside address ranges.
+
+	Each splice lists (low, high, rows) ranges: the section's networks with addresses in
+	[low, high], or its intervals overlapping it, are replaced by rows. Rows outside every
+	range are copied byte for byte, so the cost follows the size of the ranges rather than
+	re-encoding the whole store. An interval may overlap at most one range. Sections that
+	do not exist yet are created; sections in drop are left out.
+	"""
+	drop = set(drop)
+	kinds = {}
+	for kind, splices in ((SECTION_NETWORKS, sections), (SECTION_NETWORKS6, sections_v6),
+	                      (SECTION_INTERVALS, intervals), (SECTION_INTERVALS6, intervals_v6)):
+		for name in splices or {}:
+			kinds[name] = (kind, splices[name])
+
+	payloads = []
+	with ResultStore(path) as store:
+		for name in store.section_names():
+			if name in drop:
+				continue
+			if name in kinds:
+				payloads.append((_encode_name(name),) + store._splice(name, *kinds.pop(name)))
+			else:
+				payloads.append((_encode_name(name),) + store._raw_section(name))
+		for name, (kind, regions) in kinds.items():
+			payloads.append((_encode_name(name),) + store._splice(name, kind, regions))
+
+	tmp_path = target + '.tmp'
+	_write_payloads(tmp_path, summary, payloads)
+	os.replace(tmp_path, target)
+
+class _Column:
+	"""Sequence view of one column of a section, decoding values on access so bisect can search it in place."""
+
+	def __init__(self, mapped: mmap.mmap, offset: int, count: int, width: int, byteorder: str):
+		self._mapped = mapped
+		self._offset = offset
+		self._count = count
+		self._width = width
+		self._byteorder = byteorder
+
+	def __len__(self) -> int:
+		return self._count
+
+	def __getitem__(self, index: int) -> int:
+		start = self._offset + index * self._width
+		return int.from_bytes(self._mapped[start:start + self._width], self._byteorder)
+
+class ResultStore:
+	"""Read-only, memory-mapped view of a result store file."""
+
+	def __init__(self, path: str):
+		self._file = open(path, 'rb')
+		try:
+			self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+			magic, version, _, summary_length, section_count = HEADER.unpack_from(self._mapped, 0)
+			if magic != MAGIC or version != VERSION:
+				raise ValueError(f"Not a result store: {path}")
+			self._sections = {}
+			position = HEADER.size
+			for _ in range(section_count):
+				name, kind, offset, count = DIRECTORY_ENTRY.unpack_from(self._mapped, position)
+				self._sections[name.rstrip(b'\0').decode('ascii')] = (kind, offset, count)
+				position += DIRECTORY_ENTRY.size
+		except (ValueError, struct.error):
+			# Also covers a directory cut short and names that are not ASCII (UnicodeDecodeError)
+			self.close()
+			raise ValueError(f"Not a result store: {path}")
+		self._summary_span = (position, position + summary_length)
+
+	def close(self):
+		if getattr(self, '_mapped', None) is not None:
+			self._mapped.close()
+			self._mapped = None
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def section_names(self) -> List[str]:
+		return list(self._sections)
+
+	def __contains__(self, name: str) -> bool:
+		return name in self._sections
+
+	def _raw_section(self, name: str) -> Tuple[int, int, bytes]:
+		"""Return (kind, count, payload bytes) of one section."""
+		kind, offset, count = self._sections[name]
+		size = sum(width for width, _ in _COLUMNS[kind]) * count
+		return kind, count, self._mapped[offset:offset + size]
+
+	def _columns(self, name: str) -> List[_Column]:
+		kind, offset, count = self._sections[name]
+		columns = []
+		for width, byteorder in _COLUMNS[kind]:
+			columns.append(_Column(self._mapped, offset, count, width, byteorder))
+			offset += width * count
+		return columns
+
+	def _span(self, name: str, low: int, high: int) -> Tuple[int, int]:
+		"""Row positions [i, j) of the networks with addresses in [low, high], or the intervals overlapping it."""
+		kind = self._sections[name][0]
+		columns = self._columns(name)
+		if kind in (SECTION_INTERVALS, SECTION_INTERVALS6):
+			# Intervals are sorted and disjoint, so their ends are sorted too
+			return bisect.bisect_left(columns[1], low), bisect.bisect_right(columns[0], high)
+		return bisect.bisect_left(columns[0], low), bisect.bisect_right(columns[0], high)
+
+	def _rows(self, name: str, low: int, high: int) -> List[Tuple[int, int]]:
+		if name not in self._sections:
+			return []
+		i, j = self._span(name, low, high)
+		first, second = self._columns(name)
+		return [(first[k], second[k]) for k in range(i, j)]
+
+	def _splice(self, name: str, kind: int, regions) -> Tuple[int, int, bytes]:
+		"""(kind, count, payload) of a section with the rows inside each (low, high, rows) region replaced."""
+		columns = _COLUMNS[kind]
+		if name in self._sections:
+			if self._sections[name][0] != kind:
+				raise ValueError(f"Section {name} holds a different kind of rows")
+			_, offset, count = self._sections[name]
+		else:
+			offset, count = 0, 0
+		starts = []
+		for width, _ in columns:
+			starts.append(offset)
+			offset += width * count
+
+		parts = [[] for _ in columns]
+		total = 0
+		previous = 0
+		for low, high, rows in regions:
+			i, j = self._span(name, low, high) if count else (0, 0)
+			for index, ((width, byteorder), start) in enumerate(zip(columns, starts)):
+				parts[index].append(self._mapped[start + previous * width:start + i * width])
+				parts[index].append(b''.join(row[index].to_bytes(width, byteorder) for row in rows))
+			total += i - previous + len(rows)
+			previous = j
+		for index, ((width, _), start) in enumerate(zip(columns, starts)):
+			parts[index].append(self._mapped[start + previous * width:start + count * width])
+		total += count - previous
+		return kind, total, b''.join(b''.join(part) for part in parts)
+
+	def summary(self) -> Dict:
+		"""Decode only the JSON summary."""
+		start, end = self._summary_span
+		return json.loads(self._mapped[start:end].decode('utf-8'))
+
+	def count(self, name: str) -> int:
+		"""Number of rows in one section. Raises KeyError for unknown sections."""
+		return self._sections[name][2]
+
+	def _network_rows(self, name: str, i: int, j: int) -> List[Network]:
+		"""(address, prefix) pairs of rows [i, j) of a network section."""
+		kind, offset, count = self._sections[name]
+		width = 16 if kind == SECTION_NETWORKS6 else 4
+		data = self._mapped[offset + width * i:offset + width * j]
+		if kind == SECTION_NETWORKS6:
+			addresses = [int.from_bytes(data[k:k + 16], 'big') for k in range(0, len(data), 16)]
+		else:
+			addresses = _unpack_addresses(data)
+		prefixes = self._mapped[offset + width * count + i:offset + width * count + j]
+		return list(zip(addresses, prefixes))
+
+	def networks(self, name: str) -> List[Network]:
+		"""Return one section's (address, prefix) pairs. Raises KeyError for unknown sections."""
+		return self._network_rows(name, 0, self._sections[name][2])
+
+	def networks_page(self, name: str, low: Optional[int] = None, high: Optional[int] = None,
+	                  offset: int = 0, limit: Optional[int] = None) -> Tuple[int, List[Network]]:
+		"""
+		One page of a network section: the networks with addresses in [low, high] (the whole
+		section when not given) after skipping offset of them, at most limit. Returns the number
+		of networks in the range and the page. Only the page's rows are decoded.
+		Raises KeyError for unknown sections.
+		"""
+		count = self._sections[name][2]
+		if low is None and high is None:
+			i, j = 0, count
+		else:
+			i, j = self._span(name, 0 if low is None else low, (1 << 128) if high is None else high)
+			j = max(i, j)
+		start = min(i + offset, j)
+		end = j if limit is None else min(start + limit, j)
+		return j - i, self._network_rows(name, start, end)
+
+	def network_strings(self, name: str) -> List[str]:
+		"""Return one section's networks as CIDR strings."""
+		if self._sections[name][0] == SECTION_NETWORKS6:
+			return [f"{ipaddress.IPv6Address(address)}/{prefix}" for address, prefix in self.networks(name)]
+		return [format_network(address, prefix) for address, prefix in self.networks(name)]
+
+	def networks_between(self, name: str, low: int, high: int) -> List[Network]:
+		"""One section's networks with addresses in [low, high], found by binary search; empty for unknown sections."""
+		return self._rows(name, low, high)
+
+	def intervals_between(self, name: str, low: int, high: int) -> List[Interval]:
+		"""One interval section's intervals overlapping [low, high]; empty for unknown sections."""
+		return self._rows(name, low, high)
+
+	def intervals(self, name: str) -> List[Interval]:
+		"""Return one interval section's (start, end) pairs. Raises KeyError for unknown sections."""
+		kind, offset, count = self._sections[name]
+		if kind == SECTION_INTERVALS6:
+			data = self._mapped[offset:offset + 32 * count]
+			bounds = [int.from_bytes(data[i:i + 16], 'big') for i in range(0, len(data), 16)]
+		else:
+			bounds = _unpack_addresses(self._mapped[offset:offset + 8 * count])
+		return list(zip(bounds[:count], bounds[count:]))
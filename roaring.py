@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Compressed bitmap of IPv4 addresses in the Roaring layout.
+Addresses are grouped by their upper 16 bits; each group's lower 16 bits live in one of
+three containers, the smallest one whenever a group is built or combined:
+
+	array    sorted uint16 values, for up to ARRAY_MAX_SIZE addresses (2 bytes each)
+	bitmap   8KB bytearray with one bit per value, for denser groups
+	runs     sorted (start, end) value ranges, for groups made of a few long runs
+
+add() and add_range() update containers in place. Set algebra combines two arrays as
+Python sets and converts anything else to 65536-bit integers, so unions, intersections
+and differences run a machine word at a time inside the interpreter. Range cardinality
+reads a running total of the container sizes, built on first use after a change, so it
+costs two binary searches and two partial container counts however wide the range is.
+"""
+
+import bisect
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+ARRAY_MAX_SIZE = 4096
+CONTAINER_BITS = 1 << 16
+BITMAP_BYTES = CONTAINER_BITS // 8
+
+Interval = Tuple[int, int]
+Container = Union[array, bytearray, List[Interval]]
+
+try:
+	_popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+	def _popcount(value: int) -> int:
+		return bin(value).count('1')
+
+def _to_int(container: Container) -> int:
+	"""Container values as the set bits of one integer."""
+	if isinstance(container, bytearray):
+		return int.from_bytes(container, 'little')
+	if isinstance(container, array):
+		return int.from_bytes(_to_bitmap(container), 'little')
+	bits = 0
+	for start, end in container:
+		bits |= ((1 << (end - start + 1)) - 1) << start
+	return bits
+
+def _to_bitmap(values: Iterable[int]) -> bytearray:
+	"""Bitmap container holding the given values, such as an array container's."""
+	bitmap = bytearray(BITMAP_BYTES)
+	for value in values:
+		bitmap[value >> 3] |= 1 << (value & 7)
+	return bitmap
+
+def _int_runs(bits: int) -> Iterator[Interval]:
+	"""(start, end) ranges of consecutive set bits, in order."""
+	offset = 0
+	while bits:
+		skip = (bits & -bits).bit_length() - 1
+		bits >>= skip
+		offset += skip
+		length = (~bits & (bits + 1)).bit_length() - 1
+		yield offset, offset + length - 1
+		bits >>= length
+		offset += length
+
+# Set bit positions of every byte value
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+def _bitmap_values(data: bytes) -> Iterator[int]:
+	for i, byte in enumerate(data):
+		if byte:
+			base = i << 3
+			for bit in _BYTE_BITS[byte]:
+				yield base | bit
+
+def _value_runs(values: Iterable[int]) -> Iterator[Interval]:
+	"""(start, end) ranges of consecutive values, which arrive sorted."""
+	start = end = None
+	for value in values:
+		if end is None or value != end + 1:
+			if start is not None:
+				yield start, end
+			start = value
+		end = value
+	if start is not None:
+		yield start, end
+
+def _from_int(bits: int) -> Container:
+	"""Smallest container holding the set bits; None when there are none."""
+	if not bits:
+		return None
+	cardinality = _popcount(bits)
+	# Each run costs 4 bytes, each array value 2, a bitmap BITMAP_BYTES
+	run_count = _popcount(bits & ~(bits << 1))
+	if 4 * run_count < min(2 * cardinality, BITMAP_BYTES):
+		return list(_int_runs(bits))
+	if cardinality <= ARRAY_MAX_SIZE:
+		# Walking a few runs is cheaper than scanning all BITMAP_BYTES bytes
+		if run_count < 512:
+			return array('H', (value for start, end in _int_runs(bits) for value in range(start, end + 1)))
+		return array('H', _bitmap_values(bits.to_bytes(BITMAP_BYTES, 'little')))
+	return bytearray(bits.to_bytes(BITMAP_BYTES, 'little'))
+
+def _from_runs(runs: List[Interval]) -> Container:
+	"""Smallest container holding sorted, disjoint, non-adjacent (start, end) runs."""
+	cardinality = sum(end - start + 1 for start, end in runs)
+	if 4 * len(runs) < min(2 * cardinality, BITMAP_BYTES):
+		return runs
+	if cardinality <= ARRAY_MAX_SIZE:
+		return array('H', (value for start, end in runs for value in range(start, end + 1)))
+	return bytearray(_to_int(runs).to_bytes(BITMAP_BYTES, 'little'))
+
+def _fill(bitmap: bytearray, low: int, high: int):
+	"""Set the bits of values low..high in a bitmap container."""
+	first, last = low >> 3, high >> 3
+	if first == last:
+		bitmap[first] |= (0xFF << (low & 7)) & (0xFF >> (7 - (high & 7)))
+		return
+	bitmap[first] |= (0xFF << (low & 7)) & 0xFF
+	bitmap[first + 1:last] = b'\xff' * (last - first - 1)
+	bitmap[last] |= 0xFF >> (7 - (high & 7))
+
+def _from_values(values: List[int]) -> Container:
+	"""Array or bitmap container holding sorted, distinct values; None when there are none."""
+	if not values:
+		return None
+	if len(values) <= ARRAY_MAX_SIZE:
+		return array('H', values)
+	return _to_bitmap(values)
+
+def _run_contains(runs: List[Interval], value: int) -> bool:
+	i = bisect.bisect_right(runs, (value, CONTAINER_BITS)) - 1
+	return i >= 0 and runs[i][1] >= value
+
+def _cardinality(container: Container) -> int:
+	if isinstance(container, array):
+		return len(container)
+	if isinstance(container, bytearray):
+		return _popcount(int.from_bytes(container, 'little'))
+	return sum(end - start + 1 for start, end in container)
+
+def _run_totals(runs: List[Interval]) -> List[int]:
+	"""totals[i] is the number of values in runs before runs[i]."""
+	totals = [0]
+	for start, end in runs:
+		totals.append(totals[-1] + end - start + 1)
+	return totals
+
+def _count_upto(container: Container, value: int, run_totals: Optional[List[int]] = None) -> int:
+	"""Number of container values <= value; run containers also need their _run_totals."""
+	if isinstance(container, array):
+		return bisect.bisect_right(container, value)
+	if isinstance(container, bytearray):
+		return _popcount(int.from_bytes(container[:(value >> 3) + 1], 'little') & ((1 << (value + 1)) - 1))
+	i = bisect.bisect_right(container, (value, CONTAINER_BITS))
+	if not i:
+		return 0
+	start, end = container[i - 1]
+	return run_totals[i - 1] + min(end, value) - start + 1
+
+def _values(container: Container) -> Iterator[int]:
+	if isinstance(container, array):
+		return iter(container)
+	if isinstance(container, bytearray):
+		return _bitmap_values(container)
+	return (value for start, end in container for value in range(start, end + 1))
+
+def _runs(container: Container) -> Iterator[Interval]:
+	if isinstance(container, list):
+		return iter(container)
+	return _value_runs(_values(container))
+
+class RoaringBitmap:
+	"""
+	Set of IPv4 addresses (as integers) stored as Roaring containers keyed by the upper 16 bits.
+
+	Supports add/in/len/iteration, |, & and - (and their in-place forms), cardinality of
+	an address range, and conversion to and from merged (start, end) intervals.
+	"""
+
+	def __init__(self, addresses: Iterable[int] = ()):
+		self._containers: Dict[int, Container] = {}
+		self._key_list: List[int] = []
+		self._keys_sorted = True
+		# _cumulative[i] is the number of addresses in the containers before _keys[i], rebuilt
+		# after a change; _run_totals caches _run_totals() of run containers, dropped per key
+		self._cumulative: Optional[List[int]] = None
+		self._run_totals: Dict[int, List[int]] = {}
+		for address in addresses:
+			self.add(address)
+
+	@classmethod
+	def from_intervals(cls, intervals: Iterable[Interval]) -> 'RoaringBitmap':
+		"""Bitmap of every address in the given (start, end) intervals, in any order."""
+		bitmap = cls()
+		key, runs = None, []
+		# Sorted intervals reach each key in order, so every container is built once from its runs
+		for start, end in sorted(intervals):
+			for current in range(start >> 16, (end >> 16) + 1):
+				low = start & 0xFFFF if current == start >> 16 else 0
+				high = end & 0xFFFF if current == end >> 16 else 0xFFFF
+				if current != key:
+					if runs:
+						bitmap._set(key, _from_runs(runs))
+					key, runs = current, []
+				if runs and low <= runs[-1][1] + 1:
+					runs[-1] = (runs[-1][0], max(runs[-1][1], high))
+				else:
+					runs.append((low, high))
+		if runs:
+			bitmap._set(key, _from_runs(runs))
+		return bitmap
+
+	def _set(self, key: int, container: Container):
+		self._cumulative = None
+		self._run_totals.pop(key, None)
+		if container is None:
+			if key in self._containers:
+				del self._containers[key]
+				self._key_list.remove(key)
+			return
+		if key not in self._containers:
+			# Appending keeps scattered adds linear; _keys sorts once when next read
+			if self._key_list and key < self._key_list[-1]:
+				self._keys_sorted = False
+			self._key_list.append(key)
+		self._containers[key] = container
+
+	@property
+	def _keys(self) -> List[int]:
+		"""Container keys in order."""
+		if not self._keys_sorted:
+			self._key_list.sort()
+			self._keys_sorted = True
+		return self._key_list
+
+	@_keys.setter
+	def _keys(self, keys: List[int]):
+		self._key_list, self._keys_sorted = keys, True
+
+	def add(self, address: int) -> bool:
+		"""Add one address; True when it was not stored yet, so dedupe needs no separate 'in' test."""
+		key, value = address >> 16, address & 0xFFFF
+		container = self._containers.get(key)
+		if container is None:
+			self._set(key, array('H', [value]))
+		elif isinstance(container, array):
+			i = bisect.bisect_left(container, value)
+			if i < len(container) and container[i] == value:
+				return False
+			container.insert(i, value)
+			if len(container) > ARRAY_MAX_SIZE:
+				self._containers[key] = _to_bitmap(container)
+		elif isinstance(container, bytearray):
+			bit = 1 << (value & 7)
+			if container[value >> 3] & bit:
+				return False
+			container[value >> 3] |= bit
+		elif _run_contains(container, value):
+			return False
+		else:
+			self._add_run(key, container, value, value)
+		self._cumulative = None
+		return True
+
+	def add_range(self, start: int, end: int):
+		"""Add every address in [start, end]."""
+		for key in range(start >> 16, (end >> 16) + 1):
+			low = start & 0xFFFF if key == start >> 16 else 0
+			high = end & 0xFFFF if key == end >> 16 else 0xFFFF
+			container = self._containers.get(key)
+			self._cumulative = None
+			if container is None or (low == 0 and high == 0xFFFF):
+				self._set(key, [(low, high)])
+				continue
+			# Containers are updated in place; only an array outgrowing ARRAY_MAX_SIZE changes kind
+			if isinstance(container, array):
+				i, j = bisect.bisect_left(container, low), bisect.bisect_right(container, high)
+				if len(container) - (j - i) + high - low + 1 <= ARRAY_MAX_SIZE:
+					container[i:j] = array('H', range(low, high + 1))
+					continue
+				container = self._containers[key] = _to_bitmap(container)
+			if isinstance(container, bytearray):
+				_fill(container, low, high)
+			else:
+				self._add_run(key, container, low, high)
+
+	def _add_run(self, key: int, runs: List[Interval], low: int, high: int):
+		"""Merge [low, high] into a run container, switching to a bitmap once runs cost more."""
+		i = bisect.bisect_right(runs, (low, CONTAINER_BITS)) - 1
+		if i < 0 or runs[i][1] < low - 1:
+			i += 1
+		j = bisect.bisect_right(runs, (high + 1, CONTAINER_BITS))
+		if i < j:
+			low, high = min(low, runs[i][0]), max(high, runs[j - 1][1])
+		runs[i:j] = [(low, high)]
+		self._run_totals.pop(key, None)
+		if 4 * len(runs) >= BITMAP_BYTES:
+			self._set(key, _from_int(_to_int(runs)))
+
+	def __contains__(self, address: int) -> bool:
+		container = self._containers.get(address >> 16)
+		if container is None:
+			return False
+		value = address & 0xFFFF
+		if isinstance(container, array):
+			i = bisect.bisect_left(container, value)
+			return i < len(container) and container[i] == value
+		if isinstance(container, bytearray):
+			return bool(container[value >> 3] & (1 << (value & 7)))
+		return _run_contains(container, value)
+
+	def __len__(self) -> int:
+		return self._totals()[-1]
+
+	def __bool__(self) -> bool:
+		return bool(self._containers)
+
+	def __iter__(self) -> Iterator[int]:
+		for key in self._keys:
+			base = key << 16
+			for value in _values(self._containers[key]):
+				yield base | value
+
+	def __eq__(self, other) -> bool:
+		if not isinstance(other, RoaringBitmap):
+			return NotImplemented
+		return self._keys == other._keys and all(
+			_to_int(self._containers[key]) == _to_int(other._containers[key]) for key in self._keys
+		)
+
+	def intervals(self) -> List[Interval]:
+		"""Merged (start, end) intervals covering exactly the stored addresses."""
+		merged = []
+		for key in self._keys:
+			base = key << 16
+			for start, end in _runs(self._containers[key]):
+				if merged and merged[-1][1] + 1 == base + start:
+					merged[-1] = (merged[-1][0], base + end)
+				else:
+					merged.append((base + start, base + end))
+		return merged
+
+	def _totals(self) -> List[int]:
+		if self._cumulative is None:
+			cumulative = [0]
+			for key in self._keys:
+				container = self._containers[key]
+				if isinstance(container, list):
+					cumulative.append(cumulative[-1] + self._totals_of_runs(key, container)[-1])
+				else:
+					cumulative.append(cumulative[-1] + _cardinality(container))
+			self._cumulative = cumulative
+		return self._cumulative
+
+	def _totals_of_runs(self, key: int, runs: List[Interval]) -> List[int]:
+		totals = self._run_totals.get(key)
+		if totals is None:
+			totals = self._run_totals[key] = _run_totals(runs)
+		return totals
+
+	def _count_in(self, key: int, container: Container, value: int) -> int:
+		"""Number of values <= value in the container of key."""
+		if isinstance(container, list):
+			return _count_upto(container, value, self._totals_of_runs(key, container))
+		return _count_upto(container, value)
+
+	def count_upto(self, address: int) -> int:
+		"""Number of stored addresses <= address."""
+		if address < 0:
+			return 0
+		cumulative = self._totals() if self._cumulative is None else self._cumulative
+		key = address >> 16
+		keys = self._keys
+		i = bisect.bisect_right(keys, key)
+		if not i or keys[i - 1] != key:
+			return cumulative[i]
+		container = self._containers[key]
+		if isinstance(container, array):
+			# Sparse groups are the common case; count them without another call
+			return cumulative[i - 1] + bisect.bisect_right(container, address & 0xFFFF)
+		return cumulative[i - 1] + self._count_in(key, container, address & 0xFFFF)
+
+	def range_cardinality(self, low: int, high: int) -> int:
+		"""Number of stored addresses in [low, high]."""
+		if high < low:
+			return 0
+		if low >> 16 == high >> 16:
+			container = self._containers.get(low >> 16)
+			if container is None:
+				return 0
+			if isinstance(container, array):
+				return bisect.bisect_right(container, high & 0xFFFF) - bisect.bisect_left(container, low & 0xFFFF)
+			# One group needs no running totals, so adds in between stay cheap
+			return self._count_in(low >> 16, container, high & 0xFFFF) - self._count_in(low >> 16, container, (low & 0xFFFF) - 1)
+		return self.count_upto(high) - self.count_upto(low - 1)
+
+	def _combine(self, other: 'RoaringBitmap', keys: Iterable[int], operation, set_operation) -> 'RoaringBitmap':
+		result = RoaringBitmap()
+		for key in keys:
+			mine, theirs = self._containers.get(key), other._containers.get(key)
+			if mine is None or theirs is None:
+				# Only unions and differences get here, and both keep the side that is present
+				container = _copy(theirs if mine is None else mine)
+			elif isinstance(mine, array) and isinstance(theirs, array):
+				# Two sparse groups combine faster as sets than as 65536-bit integers
+				container = _from_values(sorted(set_operation(set(mine), set(theirs))))
+			else:
+				container = _from_int(operation(_to_int(mine), _to_int(theirs)))
+			if container is not None:
+				result._keys.append(key)
+				result._containers[key] = container
+		return result
+
+	def __or__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+		return self._combine(other, sorted(set(self._keys) | set(other._keys)), int.__or__, set.__or__)
+
+	def __and__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+		return self._combine(other, [key for key in self._keys if key in other._containers], int.__and__, set.__and__)
+
+	def __sub__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+		return self._combine(other, self._keys, lambda mine, theirs: mine & ~theirs, set.__sub__)
+
+	def _replace(self, combined: 'RoaringBitmap') -> 'RoaringBitmap':
+		self._containers, self._keys = combined._containers, combined._keys
+		self._cumulative, self._run_totals = None, {}
+		return self
+
+	def __ior__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+		combined = self | other
+		return self._replace(combined)
+
+	def __iand__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+		combined = self & other
+		return self._replace(combined)
+
+	def __isub__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+		combined = self - other
+		return self._replace(combined)
+
+	def union(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+		return self | other
+
+	def intersection(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+		return self & other
+
+	def difference(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+		return self - other
+
+	def memory_bytes(self) -> int:
+		"""Approximate payload size: 2 bytes per array value, 4 per run, BITMAP_BYTES per bitmap."""
+		total = 0
+		for container in self._containers.values():
+			if isinstance(container, array):
+				total += 2 * len(container)
+			elif isinstance(container, bytearray):
+				total += BITMAP_BYTES
+			else:
+				total += 4 * len(container)
+		return total
+
+def _copy(container: Container) -> Container:
+	"""Results never share mutable containers with their operands."""
+	if isinstance(container, array):
+		return array('H', container)
+	if isinstance(container, bytearray):
+		return bytearray(container)
+	return list(container)
@@ -0,0 +1,96 @@
+import random
+
+import pytest
+
+from analysis import optimal_frontier, summarize_consolidation
+from core_consolidation import (ADDRESS_BITS, CLIMB_FLOOR, HostIndex, count_hosts, host_interval, merge_intervals,
+                                range_to_cidrs, subtract_intervals)
+
+
+def _brute_force_points(intervals, version):
+	"""
+	Reachable (objects, added) pairs of one family: each collapsed block is kept, or replaced along
+	with its neighbours by any supernet of them no larger than the floor. Every choice inside a
+	floor-sized block is enumerated; only the blocks' combination is pruned to their frontiers.
+	"""
+	bits = ADDRESS_BITS[version]
+	index = HostIndex(intervals)
+	leaves = [block for start, end in intervals for block in range_to_cidrs(start, end, version)]
+
+	def points(network_int, prefixlen):
+		end = network_int + (1 << (bits - prefixlen)) - 1
+		inside = [leaf for leaf in leaves if network_int <= leaf[0] <= end]
+		if not inside:
+			return {(0, 0)}
+		if inside == [(network_int, prefixlen)]:
+			return {(0 if prefixlen == bits else 1, 0)}
+		half = 1 << (bits - prefixlen - 1)
+		low, high = host_interval(network_int, prefixlen, version)
+		combined = {(objects_left + objects_right, added_left + added_right)
+		            for objects_left, added_left in points(network_int, prefixlen + 1)
+		            for objects_right, added_right in points(network_int + half, prefixlen + 1)}
+		return combined | {(1, high - low + 1 - index.count(low, high))}
+
+	floor = CLIMB_FLOOR[version]
+	total = {(0, 0)}
+	# Floor-sized blocks share nothing, so each one's own frontier is all that combines
+	for root in sorted({leaf[0] >> (bits - floor) for leaf in leaves}):
+		total = {(objects + more_objects, added + more_added) for objects, added in _pareto(total)
+		         for more_objects, more_added in _pareto(points(root << (bits - floor), floor))}
+	return total
+
+
+def _pareto(points):
+	frontier = []
+	for objects, added in sorted(points):
+		if not frontier or added < frontier[-1][1]:
+			frontier.append((objects, added))
+	return frontier
+
+
+def _random_hosts(rng, version):
+	"""A few host intervals in a few clusters, some in separate floor-sized blocks."""
+	if version == 4:
+		bases, span, count = [10 << 24, 10 << 24 | 1 << 12, 11 << 24], 8, 4
+	else:
+		# Chains of supernets up to the /32 floor are long, so IPv6 gets fewer intervals
+		bases, span, count = [0x2001_0db8 << 96, 0x2001_0db9 << 96], 6, 2
+	intervals = []
+	for _ in range(rng.randint(1, count)):
+		start = rng.choice(bases) | rng.randrange(1 << span)
+		intervals.append((start, start + rng.choice([0, 0, 1, 3, 7, 20])))
+	return merge_intervals(intervals)
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_optimal_frontier_matches_brute_force(seed):
+	rng = random.Random(seed)
+	intervals = _random_hosts(rng, 4)
+	intervals6 = _random_hosts(rng, 6) if seed % 3 == 0 else []
+	points = _brute_force_points(intervals, 4)
+	if intervals6:
+		# Likewise the families share no blocks
+		points = {(objects + objects6, added + added6) for objects, added in _pareto(points)
+		          for objects6, added6 in _pareto(_brute_force_points(intervals6, 6))}
+
+	frontier = optimal_frontier(intervals, intervals6, with_networks=True)
+	assert [(r['objects_defined'], r['missing_ips_included']) for r in frontier] == _pareto(points)
+
+	# Each point's networks hold every host and reproduce its statistics
+	original = count_hosts(intervals) + count_hosts(intervals6)
+	for result in frontier:
+		assert result['original_ips'] == original
+		objects = added = 0
+		for version, hosts in ((4, intervals), (6, intervals6)):
+			networks = [network for network in result['networks'] if network.version == version]
+			summary = summarize_consolidation(networks, HostIndex(hosts), 0) if hosts else None
+			if summary:
+				blocks = merge_intervals((int(network.network_address), int(network.broadcast_address)) for network in networks)
+				assert subtract_intervals(hosts, blocks) == []
+				objects += summary['objects_defined']
+				added += summary['missing_ips_included']
+		assert (objects, added) == (result['objects_defined'], result['missing_ips_included'])
+
+
+def test_optimal_frontier_of_nothing_is_empty():
+	assert optimal_frontier([]) == []
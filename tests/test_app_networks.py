@@ -0,0 +1,123 @@
+import importlib
+import ipaddress
+
+import pytest
+
+from result_store import threshold_section, write_result_store
+
+NETWORKS = [((10 << 24) + (i << 8), 24) for i in range(0, 50, 2)] + [((192 << 24) + i, 32) for i in range(5)]
+NETWORKS_V6 = [((0x2001_0db8 << 96) + (i << 64), 64) for i in range(7)]
+BUDGET = NETWORKS[:3]
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+	# Importing the app creates its upload and cache folders in the working directory
+	with pytest.MonkeyPatch.context() as monkeypatch:
+		monkeypatch.chdir(tmp_path_factory.mktemp('app'))
+		return importlib.import_module('app')
+
+
+@pytest.fixture
+def client(app_module, tmp_path, monkeypatch):
+	monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+	_write_store(app_module, tmp_path, max_entries=3)
+	client = app_module.app.test_client()
+	with client.session_transaction() as session:
+		session['result_file'] = 'result_test.ipcs'
+	return client
+
+
+def _write_store(app_module, folder, max_entries):
+	write_result_store(str(folder / 'result_test.ipcs'), {'budget': {'max_entries': max_entries}},
+	                   {threshold_section(25): NETWORKS, app_module.BUDGET_SECTION: BUDGET},
+	                   sections_v6={threshold_section(25, 6): NETWORKS_V6})
+
+
+def _strings(networks):
+	return [str(ipaddress.ip_network((address, prefix))) for address, prefix in networks]
+
+
+@pytest.mark.parametrize('version, networks', [(4, NETWORKS), (6, NETWORKS_V6)])
+def test_pages_walk_every_network(client, version, networks):
+	walked = []
+	offset = 0
+	while offset is not None:
+		page = client.get('/api/networks/25', query_string={'version': version, 'offset': offset, 'limit': 4}).get_json()
+		assert page['total'] == len(networks) and page['offset'] == offset and page['limit'] == 4
+		assert page['threshold'] == 25 and page['version'] == version
+		assert len(page['networks']) == min(4, len(networks) - offset)
+		walked += page['networks']
+		offset = page['next_offset']
+	assert walked == _strings(networks)
+
+
+def test_default_page_and_address_range(client):
+	page = client.get('/api/networks/25').get_json()
+	assert page['networks'] == _strings(NETWORKS) and page['next_offset'] is None
+	page = client.get('/api/networks/25', query_string={'start': '10.0.4.0', 'end': '10.0.9.255', 'limit': 2}).get_json()
+	assert (page['total'], page['networks'], page['next_offset']) == (3, ['10.0.4.0/24', '10.0.6.0/24'], 2)
+	page = client.get('/api/networks/25', query_string={'start': '192.0.0.3'}).get_json()
+	assert page['networks'] == ['192.0.0.3/32', '192.0.0.4/32']
+
+
+@pytest.mark.parametrize('query', [
+	{'offset': len(NETWORKS)},
+	{'offset': len(NETWORKS) + 100, 'limit': 10},
+	{'start': '193.0.0.0'},
+	{'start': '10.0.0.1', 'end': '10.0.0.255', 'offset': 5},
+])
+def test_out_of_range_pages_are_empty(client, query):
+	response = client.get('/api/networks/25', query_string=query)
+	assert response.status_code == 200
+	page = response.get_json()
+	assert page['networks'] == [] and page['next_offset'] is None
+
+
+@pytest.mark.parametrize('query', [
+	{'version': '5'},
+	{'offset': '-1'},
+	{'limit': '0'},
+	{'limit': '10001'},
+	{'limit': 'a'},
+	{'start': 'x'},
+	{'start': '::1'},
+	{'version': '6', 'end': '10.0.0.1'},
+	{'start': '10.0.0.9', 'end': '10.0.0.1'},
+])
+def test_invalid_queries_are_rejected(client, query):
+	response = client.get('/api/networks/25', query_string=query)
+	assert response.status_code == 400 and 'error' in response.get_json()
+
+
+def test_missing_analysis_or_threshold_is_not_found(client, app_module):
+	assert client.get('/api/networks/7').status_code == 404
+	assert app_module.app.test_client().get('/api/networks/25').status_code == 404
+
+
+def test_etag_answers_304(client):
+	response = client.get('/api/networks/25?limit=5')
+	etag = response.headers['ETag']
+	assert response.headers['Cache-Control'] == 'private, no-cache'
+
+	cached = client.get('/api/networks/25?limit=5', headers={'If-None-Match': etag})
+	assert cached.status_code == 304 and cached.data == b'' and cached.headers['ETag'] == etag
+	# Flask-Compress appends the content coding to the tags of compressed responses
+	assert client.get('/api/networks/25?limit=5', headers={'If-None-Match': etag[:-1] + ':gzip"'}).status_code == 304
+	assert client.get('/api/networks/25?limit=5', headers={'If-None-Match': '*'}).status_code == 304
+
+	# Another page or version has its own tag
+	for url in ('/api/networks/25?limit=6', '/api/networks/25?limit=5&offset=5', '/api/networks/25?limit=5&version=6'):
+		response = client.get(url, headers={'If-None-Match': etag})
+		assert response.status_code == 200 and response.headers['ETag'] != etag
+
+
+def test_budget_etag_changes_with_the_budget(client, app_module, tmp_path):
+	response = client.get('/api/networks/budget')
+	assert response.get_json()['networks'] == _strings(BUDGET) and response.get_json()['threshold'] == 'budget'
+	etag = response.headers['ETag']
+	assert client.get('/api/networks/budget', headers={'If-None-Match': etag}).status_code == 304
+
+	_write_store(app_module, tmp_path, max_entries=4)
+	response = client.get('/api/networks/budget', headers={'If-None-Match': etag})
+	assert response.status_code == 200 and response.headers['ETag'] != etag
@@ -0,0 +1,30 @@
+from benchmark import compare_to_baseline, missing_from_baseline
+
+
+def _run(results):
+	return {'results': {key: {'stages': {stage: {'seconds': seconds, 'peak_bytes': 1000} for stage, seconds in stages.items()}}
+	                    for key, stages in results.items()}}
+
+
+def test_matching_run_has_nothing_missing():
+	baseline = _run({'dense/1000': {'extract': 0.1, 'bias': 0.2}})
+	assert missing_from_baseline(_run({'dense/1000': {'extract': 0.1}}), baseline) == []
+	assert compare_to_baseline(_run({'dense/1000': {'extract': 0.2}}), baseline, 0.25, 0.25) == [
+		'dense/1000 extract: 100.0ms -> 200.0ms']
+
+
+def test_keys_and_stages_missing_from_baseline_are_listed():
+	baseline = _run({'dense/1000': {'extract': 0.1}})
+	current = _run({'dense/1000': {'extract': 0.1, 'bias': 0.5}, 'sparse/1000': {'extract': 0.1}})
+	assert missing_from_baseline(current, baseline) == ['dense/1000 bias: not in baseline', 'sparse/1000: not in baseline']
+
+
+def test_run_without_overlap_is_listed():
+	# A baseline recorded at another size measures none of this run's stages
+	baseline = _run({'dense/1000': {'extract': 0.1}})
+	current = _run({'dense/2000': {'extract': 10.0}})
+	assert compare_to_baseline(current, baseline, 0.25, 0.25) == []
+	assert missing_from_baseline(current, baseline) == [
+		'dense/2000: not in baseline', 'no stage of this run is in the baseline (it has dense/1000)']
+	assert missing_from_baseline(current, {}) == [
+		'dense/2000: not in baseline', 'no stage of this run is in the baseline (it has no results)']
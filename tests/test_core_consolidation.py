@@ -0,0 +1,235 @@
+import ipaddress
+import random
+
+import pytest
+
+import core_consolidation
+
+
+def _hosts(text):
+	"""Merged IPv4 host intervals from the bytes scanner, checked against the line scanner."""
+	parser = core_consolidation.IntervalStreamParser()
+	parser.feed(text.encode())
+	intervals = parser.close()
+	lines = core_consolidation.process_chunk_intervals(text.splitlines(True))
+	assert core_consolidation.merge_intervals(lines) == intervals
+	return [(core_consolidation._dotted_quad(start), core_consolidation._dotted_quad(end)) for start, end in intervals]
+
+
+@pytest.mark.parametrize('line, hosts', [
+	('network-object 10.1.0.0 255.255.255.0', [('10.1.0.1', '10.1.0.254')]),
+	(' subnet 10.1.0.0 255.255.0.0', [('10.1.0.1', '10.1.255.254')]),
+	('range 10.2.0.1 10.2.0.50', [('10.2.0.1', '10.2.0.50')]),
+	('access-list 101 permit ip 10.3.0.0 0.0.0.255 any', [('10.3.0.1', '10.3.0.254')]),
+	(' 10 permit 10.3.0.0 0.0.0.255', [('10.3.0.1', '10.3.0.254')]),
+	('-A INPUT -s 10.4.0.0/255.255.0.0 -j DROP', [('10.4.0.1', '10.4.255.254')]),
+	('-A INPUT -m iprange --src-range 10.5.0.1-10.5.0.20 -j DROP', [('10.5.0.1', '10.5.0.20')]),
+	('ip address 10.6.0.1 255.255.255.0', [('10.6.0.1', '10.6.0.1')]),
+	('network 10.9.0.0 mask 255.255.0.0', [('10.9.0.1', '10.9.255.254')]),
+	('access-list outside extended permit ip host 10.7.0.0 255.255.0.0 any', [('10.7.0.0', '10.7.0.0')]),
+	('ip route 0.0.0.0 0.0.0.0 10.0.0.1', [('10.0.0.1', '10.0.0.1')]),
+	# /0 means "any", like the all-zero mask, in iptables -L listings and rules
+	('ACCEPT     tcp  --  0.0.0.0/0            10.0.0.5             tcp dpt:22', [('10.0.0.5', '10.0.0.5')]),
+	('DROP       all  --  10.0.0.0/30          0.0.0.0/0', [('10.0.0.1', '10.0.0.2')]),
+	('-A INPUT -s 0.0.0.0/0 -d 10.0.0.7 -j DROP', [('10.0.0.7', '10.0.0.7')]),
+	('route 10.8.0.0/0 10.0.0.1', [('10.0.0.1', '10.0.0.1')]),
+])
+def test_masks_and_ranges_in_firewall_syntax(line, hosts):
+	assert _hosts(line + '\n') == hosts
+
+
+@pytest.mark.parametrize('line, hosts', [
+	('10.0.0.0 1.255.255.255', [('1.255.255.255', '1.255.255.255'), ('10.0.0.0', '10.0.0.0')]),
+	('src=10.0.0.0 255.255.0.0', [('10.0.0.0', '10.0.0.0')]),
+	('# comment\nsrc=10.0.0.0 0.0.255.255', [('0.0.255.255', '0.0.255.255'), ('10.0.0.0', '10.0.0.0')]),
+	('client 10.0.0.0/255.0.0.0', [('10.0.0.0', '10.0.0.0')]),
+	('range 10.0.0.1 to 10.0.0.9', [('10.0.0.1', '10.0.0.1'), ('10.0.0.9', '10.0.0.9')]),
+	('seen 10.0.0.1-10.0.0.9', [('10.0.0.1', '10.0.0.1'), ('10.0.0.9', '10.0.0.9')]),
+	('network-object 10.0.0.0 255.0.255.0', [('10.0.0.0', '10.0.0.0'), ('255.0.255.0', '255.0.255.0')]),
+	('# network-object 10.1.0.0 255.255.255.0', []),
+])
+def test_masks_elsewhere_are_addresses(line, hosts):
+	assert _hosts(line + '\n') == hosts
+
+
+def test_config_line_cut_at_whitespace_keeps_its_masks():
+	parser = core_consolidation.IntervalStreamParser(max_line_bytes=32)
+	parser.feed(b'network-object 10.1.0.0 255.255.255.0 ')
+	parser.feed(b'10.2.0.0 255.255.255.0 ')
+	parser.feed(b'\n10.3.0.0 255.255.255.0\n')
+	assert parser.close() == [(0x0A010001, 0x0A0100FE), (0x0A020001, 0x0A0200FE), (0x0A030000, 0x0A030000)]
+
+
+@pytest.mark.parametrize('line, hosts', [
+	('ipv6 route ::/0 2001:db8::1', [('2001:db8::1', '2001:db8::1')]),
+	('ipv6 route 2001:db8:1::/126 ::/0', [('2001:db8:1::1', '2001:db8:1::3')]),
+	('ipv6 route 2001:db8::/0 Null0', []),
+	('ACCEPT     all      ::/0                 2001:db8::5', [('2001:db8::5', '2001:db8::5')]),
+])
+def test_ipv6_default_route_is_not_a_network(line, hosts):
+	parser = core_consolidation.IntervalStreamParser()
+	parser.feed(line.encode() + b'\n')
+	intervals, intervals6 = parser.close_dual_stack()
+	assert intervals == []
+	assert [(str(ipaddress.IPv6Address(start)), str(ipaddress.IPv6Address(end))) for start, end in intervals6] == hosts
+
+
+@pytest.mark.parametrize('text', [
+	'2001:db8:0:0:0:0:0:1 10.0.0.1',
+	'src ::ffff:10.0.0.1 dst 10.0.0.2',
+	'1:2:3:4:5:6:10.0.0.1',
+	'mac 00:1a:2b:3c:4d:5e at 12:34:56 from 10.0.0.1',
+])
+def test_ipv6_prefilter_keeps_full_scan_results(text):
+	data = text.encode() + b'\n'
+	full = core_consolidation._tokens_to_intervals(core_consolidation.SCAN_RE.findall(data))
+	assert core_consolidation._tokens_to_intervals(core_consolidation._scan_tokens(data)) == full
+
+
+@pytest.mark.parametrize('text, expected', [
+	('10.0.0.0 255.0.0.0', (4, (0x0A000001, 0x0AFFFFFE))),
+	('10.0.0.0/8', (4, (0x0A000001, 0x0AFFFFFE))),
+	('range 10.0.0.1 10.0.0.5', (4, (0x0A000001, 0x0A000005))),
+	('2001:db8::1', (6, (0x20010DB8 << 96 | 1, 0x20010DB8 << 96 | 1))),
+	('10.0.0.256', None),
+	('10.0.0.0 255.0.255.0', None),
+	('0.0.0.0 0.0.0.0', None),
+	('0.0.0.0/0', None),
+	('10.0.0.0/0', None),
+	('::/0', None),
+	('2001:db8::/0', None),
+])
+def test_parse_host_token(text, expected):
+	assert core_consolidation.parse_host_token(text) == expected
+
+
+def _mixed_corpus(seed, lines=2000):
+	"""Hosts, CIDRs, config masks and ranges, comments and noise, as bytes."""
+	rng = random.Random(seed)
+	address = lambda: f'10.{rng.randrange(4)}.{rng.randrange(256)}.{rng.randrange(256)}'
+	makers = [
+		lambda: f'{rng.choice(["", "src=", "client "])}{address()} port {rng.randrange(65536)}',
+		lambda: f'route {address().rsplit(".", 1)[0]}.0/{rng.randint(28, 30)}',
+		lambda: f'network-object {address().rsplit(".", 1)[0]}.0 255.255.255.{rng.choice([240, 248, 252])}',
+		lambda: f'access-list 10 permit ip {address().rsplit(".", 1)[0]}.0 0.0.0.{rng.choice([3, 7, 15])} any',
+		lambda: 'range {0}.{1} {0}.{2}'.format(address().rsplit('.', 1)[0], rng.randint(1, 9), rng.randint(10, 20)),
+		lambda: f'# disabled {address()}',
+		lambda: f'version 1.2.3.4.5 build {rng.randrange(10 ** 6)} at 12:{rng.randrange(60):02d}:00',
+	]
+	return ''.join(rng.choice(makers)() + '\n' for _ in range(lines)).encode()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 100, 65536])
+def test_stream_parser_matches_extract_host_ips(tmp_path, chunk_size):
+	data = _mixed_corpus(1)
+	path = tmp_path / 'mixed.log'
+	path.write_bytes(data)
+	expected = core_consolidation.to_intervals(core_consolidation.extract_host_ips(str(path)))
+	# Small chunks split tokens, masks and keywords across feed() calls
+	parser = core_consolidation.IntervalStreamParser(compact_tokens=50)
+	for i in range(0, len(data), chunk_size):
+		parser.feed(data[i:i + chunk_size])
+	assert parser.close() == expected
+
+
+def test_stream_parser_spills_to_several_runs(monkeypatch):
+	data = _mixed_corpus(2)
+	expected = core_consolidation.IntervalStreamParser()
+	expected.feed(data)
+	expected = expected.close()
+
+	spills = []
+	spill_class = core_consolidation.IntervalSpill
+
+	def small_spill(version):
+		spills.append(spill_class(version, run_intervals=32, max_runs=4))
+		return spills[-1]
+
+	monkeypatch.setattr(core_consolidation, 'IntervalSpill', small_spill)
+	parser = core_consolidation.IntervalStreamParser(compact_tokens=20, spill_bytes=0)
+	runs = 0
+	for i in range(0, len(data), 997):
+		parser.feed(data[i:i + 997])
+		runs = max(runs, len(spills[0]._runs) if spills else 0)
+	assert runs > 1
+	assert parser.close() == expected
+
+
+@pytest.mark.parametrize('version, bits', [(4, 32), (6, 128)])
+def test_interval_spill_merges_runs(version, bits):
+	rng = random.Random(version)
+	intervals = [(start, start + rng.randrange(4)) for start in (rng.getrandbits(bits - 12) for _ in range(1000))]
+	spill = core_consolidation.IntervalSpill(version, run_intervals=16, max_runs=3)
+	for i in range(0, len(intervals), 10):
+		spill.extend(intervals[i:i + 10])
+	assert len(spill._runs) > 1
+	assert spill.result() == core_consolidation.merge_intervals(intervals)
+	assert spill._runs == []
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_fenwick_tree_matches_list_sums(seed):
+	rng = random.Random(seed)
+	values = [rng.randrange(-50, 50) for _ in range(rng.randint(1, 200))]
+	tree = core_consolidation.FenwickTree(list(values))
+	for _ in range(500):
+		index = rng.randrange(len(values))
+		delta = rng.randrange(-20, 20)
+		values[index] += delta
+		tree.add(index, delta)
+		start, end = sorted(rng.randrange(len(values) + 1) for _ in range(2))
+		assert tree.sum(start, end) == sum(values[start:end])
+
+
+def _budget_hosts(rng, count, version=4):
+	"""Host intervals clustered under one IPv4 /12 (IPv6 /44), so every budget can be met."""
+	base, span = ((10 << 24), 20) if version == 4 else ((0x2001_0db8 << 96), 84)
+	intervals = []
+	for _ in range(count):
+		start = base | rng.randrange((1 << span) - 64)
+		intervals.append((start, start + rng.choice([0, 0, 0, 1, 5, 40])))
+	return core_consolidation.merge_intervals(intervals)
+
+
+def _assert_covers(networks, intervals, version=4):
+	"""networks are disjoint and hold every host of intervals."""
+	blocks = sorted((int(network.network_address), int(network.broadcast_address)) for network in networks
+	                if network.version == version)
+	for (_, previous_end), (start, _) in zip(blocks, blocks[1:]):
+		assert previous_end < start
+	covered = core_consolidation.merge_intervals(blocks)
+	assert core_consolidation.subtract_intervals(intervals, covered) == []
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_consolidate_to_budget_stays_within_budget_and_covers_hosts(seed):
+	rng = random.Random(seed)
+	intervals = _budget_hosts(rng, 400)
+	collapsed = core_consolidation.consolidate_networks(intervals)
+	for budget in (1, 2, rng.randint(3, len(collapsed) - 1), len(collapsed), len(collapsed) + 10):
+		networks = core_consolidation.consolidate_to_budget(intervals, budget)
+		assert len(networks) <= budget
+		_assert_covers(networks, intervals)
+		if budget >= len(collapsed):
+			# Nothing needs merging once the collapsed networks fit
+			assert networks == collapsed
+	assert [str(network) for network in core_consolidation.consolidate_to_budget(intervals, 1)] == ['10.0.0.0/12']
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_consolidate_to_budget_shares_the_budget_across_families(seed):
+	rng = random.Random(seed)
+	intervals, intervals_v6 = _budget_hosts(rng, 200), _budget_hosts(rng, 200, 6)
+	for budget in (2, 50, 10 ** 6):
+		networks = core_consolidation.consolidate_to_budget(intervals, budget, intervals_v6)
+		assert len(networks) <= budget
+		_assert_covers(networks, intervals)
+		_assert_covers(networks, intervals_v6, 6)
+
+
+def test_consolidate_to_budget_below_the_floor_returns_the_closest_result():
+	intervals = [(10 << 24 | 5, 10 << 24 | 5), (10 << 24 | 1 << 20, 10 << 24 | 1 << 20), (192 << 24 | 7, 192 << 24 | 7)]
+	networks = core_consolidation.consolidate_to_budget(intervals, 1)
+	# Supernets never grow past a /8, so one network per /8 is as close as it gets
+	assert [str(network) for network in networks] == ['10.0.0.0/11', '192.0.0.7/32']
+	_assert_covers(networks, intervals)
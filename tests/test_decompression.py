@@ -0,0 +1,69 @@
+import gzip
+import io
+import lzma
+import zipfile
+
+import pytest
+
+from decompression import StreamDecompressor, iter_zip_members
+
+DATA = b''.join(b'permit host 10.0.%d.%d\n' % (i // 256, i % 256) for i in range(5000))
+
+
+def _decompress(kind, payload, chunk_size, max_output=None):
+	decompressor = StreamDecompressor(kind, max_output)
+	pieces = []
+	for i in range(0, len(payload), chunk_size):
+		pieces.extend(decompressor.feed(payload[i:i + chunk_size]))
+	decompressor.close()
+	return b''.join(pieces)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 777, 1 << 20])
+def test_gzip_concatenated_members(chunk_size):
+	cut = DATA.rfind(b'\n', 0, len(DATA) // 2) + 1
+	# Members may be separated by zero padding, as tape-style writers leave
+	payload = gzip.compress(DATA[:cut]) + b'\0\0\0' + gzip.compress(DATA[cut:]) + gzip.compress(b'')
+	assert _decompress('gzip', payload, chunk_size) == DATA
+
+
+@pytest.mark.parametrize('cut', [1, 100, -1])
+def test_truncated_xz(cut):
+	payload = lzma.compress(DATA)
+	with pytest.raises(ValueError, match='Truncated xz data'):
+		_decompress('xz', payload[:cut if cut > 0 else len(payload) + cut], 4096)
+
+
+def test_gzip_bomb_stops_at_max_output():
+	payload = gzip.compress(b'\0' * (64 << 20))
+	with pytest.raises(ValueError, match='Decompressed data too large'):
+		_decompress('gzip', payload, 1 << 16, max_output=1 << 20)
+
+
+def test_zip_bomb_stops_at_max_output():
+	archive = io.BytesIO()
+	with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as z:
+		z.writestr('small.txt', DATA)
+		z.writestr('bomb.txt', b'0' * (64 << 20))
+	archive.seek(0)
+	produced = 0
+	with pytest.raises(ValueError, match='Decompressed data too large'):
+		for piece in iter_zip_members(archive, max_output=len(DATA) + (1 << 20)):
+			produced += len(piece)
+	assert produced <= len(DATA) + (1 << 20) + 1
+
+
+def test_encrypted_zip_member_is_rejected():
+	archive = io.BytesIO()
+	with zipfile.ZipFile(archive, 'w') as z:
+		z.writestr('plain.txt', DATA)
+		z.writestr('secret.txt', b'ciphertext')
+	# zipfile cannot write encrypted members, so set the encryption flag in both headers
+	data = bytearray(archive.getvalue())
+	with zipfile.ZipFile(io.BytesIO(bytes(data))) as z:
+		local = z.getinfo('secret.txt').header_offset
+	central = data.rindex(b'PK\x01\x02', 0, data.rindex(b'secret.txt'))
+	data[local + 6] |= 0x1
+	data[central + 8] |= 0x1
+	with pytest.raises(ValueError, match='Encrypted zip member: secret.txt'):
+		list(iter_zip_members(io.BytesIO(bytes(data))))
@@ -0,0 +1,123 @@
+import ipaddress
+import random
+
+import pytest
+
+from analysis import DEFAULT_THRESHOLDS, run_consolidation_analysis
+from core_consolidation import merge_intervals, parse_host_token, subtract_intervals
+from delta import apply_delta
+from result_store import (HOSTS_SECTION, HOSTS_SECTION_V6, SECTION_INTERVALS, SECTION_INTERVALS6, ResultStore,
+                          threshold_section, write_result_store)
+
+
+def _write_analysis(path, hosts, hosts_v6):
+	"""Store a full analysis of the host intervals the way the upload job does; returns its summary."""
+	results, frontier = run_consolidation_analysis(hosts, thresholds=DEFAULT_THRESHOLDS, host_ips_v6=hosts_v6)
+	recommended = min(frontier, key=lambda r: r['score'])
+	summary = {
+		'host_ips_count': sum(end - start + 1 for start, end in hosts + hosts_v6),
+		'results': [{key: value for key, value in r.items() if key != 'networks'} for r in results],
+		'frontier': [{key: value for key, value in r.items() if key != 'networks'} for r in frontier],
+		'recommended': {key: recommended[key] for key in (
+			'threshold', 'score', 'objects_defined', 'missing_ips_included', 'expansion_percent'
+		)},
+		'analysis_id': 'base',
+	}
+	sections, sections_v6 = {}, {}
+	for r in results:
+		sections[threshold_section(r['threshold'])] = [
+			(int(net.network_address), net.prefixlen) for net in r['networks'] if net.version == 4
+		]
+		if hosts_v6:
+			sections_v6[threshold_section(r['threshold'], 6)] = [
+				(int(net.network_address), net.prefixlen) for net in r['networks'] if net.version == 6
+			]
+	write_result_store(path, summary, sections, sections_v6,
+	                   intervals={HOSTS_SECTION: hosts}, intervals_v6={HOSTS_SECTION_V6: hosts_v6})
+	return summary
+
+
+def _intervals(tokens):
+	parsed = {4: [], 6: []}
+	for token in tokens:
+		version, interval = parse_host_token(token)
+		parsed[version].append(interval)
+	return merge_intervals(parsed[4]), merge_intervals(parsed[6])
+
+
+def _assert_delta_matches_full_analysis(tmp_path, base, added, removed):
+	hosts, hosts_v6 = _intervals(base)
+	_write_analysis(str(tmp_path / 'base.ipcs'), hosts, hosts_v6)
+	summary = apply_delta(str(tmp_path / 'base.ipcs'), str(tmp_path / 'delta.ipcs'), added, removed, 'delta')
+
+	added4, added6 = _intervals(added)
+	removed4, removed6 = _intervals(removed)
+	expected = _write_analysis(str(tmp_path / 'full.ipcs'), subtract_intervals(merge_intervals(hosts + added4), removed4),
+	                           subtract_intervals(merge_intervals(hosts_v6 + added6), removed6))
+	for key in ('host_ips_count', 'results', 'frontier', 'recommended'):
+		assert summary[key] == expected[key], key
+	assert summary['delta']['base_analysis_id'] == 'base' and summary['analysis_id'] == 'delta'
+
+	with ResultStore(str(tmp_path / 'delta.ipcs')) as delta, ResultStore(str(tmp_path / 'full.ipcs')) as full:
+		assert delta.summary() == summary
+		# A family the full analysis has no hosts for may be left as empty sections by the delta
+		for name in set(delta.section_names()) | set(full.section_names()):
+			if full._sections.get(name, delta._sections.get(name))[0] in (SECTION_INTERVALS, SECTION_INTERVALS6):
+				assert delta.intervals(name) == full.intervals(name), name
+			else:
+				assert (delta.networks(name) if name in delta else []) == (full.networks(name) if name in full else []), name
+	return summary
+
+
+def _token(rng, version=4):
+	if version == 6:
+		return str(ipaddress.IPv6Address((0x2001_0db8 << 96) | rng.choice([0, 1]) << 80 | rng.getrandbits(12)))
+	address = rng.choice([10, 11, 172, 192]) << 24 | rng.choice([0, 1, 255]) << 16 | rng.getrandbits(16)
+	if rng.random() < 0.3:
+		prefix = rng.randint(20, 31)
+		return f"{ipaddress.IPv4Address(address & ~((1 << (32 - prefix)) - 1))}/{prefix}"
+	return str(ipaddress.IPv4Address(address))
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_delta_matches_full_reanalysis(tmp_path, seed):
+	rng = random.Random(seed)
+	base = [_token(rng) for _ in range(rng.randint(1, 300))]
+	if seed % 2:
+		base += [_token(rng, 6) for _ in range(rng.randint(1, 40))]
+	added = [_token(rng) for _ in range(rng.randint(0, 20))] + [_token(rng, 6) for _ in range(rng.randint(0, 4))]
+	if seed % 4 == 3:
+		added.append('11.255.255.0/23')  # Straddles a /8 boundary
+	removed = rng.sample(base, min(len(base), rng.randint(0, 20))) + [_token(rng) for _ in range(rng.randint(0, 5))]
+	# _token never draws from 10.200.0.0/16, so one host always remains
+	_assert_delta_matches_full_analysis(tmp_path, base + ['10.200.0.1'], added, removed)
+
+
+def test_removing_every_ipv6_host(tmp_path):
+	base = ['10.0.0.1', '10.0.0.2', '10.0.1.0/24', '2001:db8::1', '2001:db8::5', '2001:db8:0:1::/120']
+	summary = _assert_delta_matches_full_analysis(tmp_path, base, [], ['2001:db8::1', '2001:db8::5', '2001:db8:0:1::/120'])
+	assert summary['host_ips_count'] == 256
+	with ResultStore(str(tmp_path / 'delta.ipcs')) as store:
+		assert store.intervals(HOSTS_SECTION_V6) == []
+		assert all(store.networks(threshold_section(threshold, 6)) == [] for threshold in DEFAULT_THRESHOLDS)
+
+
+def test_removing_every_ipv4_host(tmp_path):
+	base = ['10.0.0.1', '10.0.0.2', '2001:db8::1', '2001:db8::5']
+	summary = _assert_delta_matches_full_analysis(tmp_path, base, [], ['10.0.0.0/24'])
+	assert summary['host_ips_count'] == 2
+
+
+def test_adding_ipv6_to_an_ipv4_analysis(tmp_path):
+	base = ['10.0.0.1', '10.0.0.2', '10.0.0.9', '192.168.1.0/28']
+	summary = _assert_delta_matches_full_analysis(tmp_path, base, ['2001:db8::1', '2001:db8::3', '2001:db8:1::/64'], [])
+	assert summary['host_ips_count'] == 17 + 2 + (1 << 64) - 1
+
+
+def test_removing_every_host_is_rejected(tmp_path):
+	hosts, hosts_v6 = _intervals(['10.0.0.1', '2001:db8::1'])
+	_write_analysis(str(tmp_path / 'base.ipcs'), hosts, hosts_v6)
+	with pytest.raises(ValueError, match='No host IPs would remain'):
+		apply_delta(str(tmp_path / 'base.ipcs'), str(tmp_path / 'delta.ipcs'), [], ['10.0.0.0/8', '2001:db8::/32'])
+	with pytest.raises(ValueError, match='Invalid IP or CIDR'):
+		apply_delta(str(tmp_path / 'base.ipcs'), str(tmp_path / 'delta.ipcs'), ['10.0.0.256'], [])
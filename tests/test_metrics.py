@@ -0,0 +1,31 @@
+import tracemalloc
+
+import metrics
+
+
+def _peak(recorder, name):
+	return recorder.snapshot()['stages'][name]['peak_bytes']
+
+
+def test_stage_without_tracemalloc_records_no_peak():
+	assert not tracemalloc.is_tracing()
+	with metrics.collect() as recorder:
+		with metrics.stage('untraced'):
+			data = bytearray(1 << 20)
+	assert _peak(recorder, 'untraced') == 0
+	del data
+
+
+def test_stage_peak_under_tracemalloc():
+	tracemalloc.start()
+	try:
+		with metrics.collect() as recorder:
+			with metrics.stage('outer'):
+				with metrics.stage('inner'):
+					data = bytearray(4 << 20)
+				del data
+	finally:
+		tracemalloc.stop()
+	assert _peak(recorder, 'inner') >= 4 << 20
+	# The enclosing stage keeps the peak of the stages inside it
+	assert _peak(recorder, 'outer') >= _peak(recorder, 'inner')
@@ -0,0 +1,43 @@
+import ipaddress
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+import numpy_backend
+
+
+def test_parse_ips_matches_ipaddress():
+	rng = random.Random(1)
+	ips = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(2000)] + ['0.0.0.0', '255.255.255.255']
+	assert numpy_backend.parse_ips(ips).tolist() == [int(ipaddress.IPv4Address(ip)) for ip in ips]
+
+
+@pytest.mark.parametrize('ips', [
+	['1.2.3', '4.5.6.7.8'],
+	['01.2.3.4'],
+	['1.2.3.256'],
+	['1.2.3.+4'],
+	['1.2.3. 4'],
+	['1..2.3'],
+	['1.2.3.4\n5.6.7', '8'],
+	['١.2.3.4'],
+])
+def test_parse_ips_rejects_what_ipaddress_rejects(ips):
+	with pytest.raises(ValueError):
+		numpy_backend.parse_ips(ips)
+
+
+def test_parse_ips_fuzz_agrees_with_ipaddress():
+	rng = random.Random(2)
+	for _ in range(5000):
+		text = ''.join(rng.choice('0123456789.') for _ in range(rng.randint(1, 16)))
+		try:
+			expected = int(ipaddress.IPv4Address(text))
+		except ValueError:
+			expected = None
+		try:
+			got = int(numpy_backend.parse_ips([text])[0])
+		except ValueError:
+			got = None
+		assert got == expected, text
@@ -0,0 +1,55 @@
+import ipaddress
+import random
+
+import pytest
+
+from output_generator import RENDERERS, ExportSection
+
+
+def _network(text):
+	network = ipaddress.ip_network(text)
+	return int(network.network_address), network.prefixlen
+
+
+def _nft_elements(networks, networks_v6=()):
+	section = ExportSection('25percent', 25, None, {}, networks, networks_v6)
+	script = ''.join(RENDERERS['nftables'].render(section))
+	elements = []
+	for block in script.split('{\n')[1:]:
+		elements.append([ipaddress.ip_network(line.strip().rstrip(',')) for line in block.split('\n}')[0].splitlines()])
+	return elements
+
+
+def _assert_disjoint(elements):
+	for previous, network in zip(elements, elements[1:]):
+		assert previous.broadcast_address < network.network_address
+
+
+@pytest.mark.parametrize('networks, expected', [
+	(['10.0.0.0/21', '10.0.0.128/26'], ['10.0.0.0/21']),
+	(['10.0.0.208/29', '10.0.0.214/32'], ['10.0.0.208/29']),
+	(['10.0.0.214/32', '10.0.0.208/29', '10.0.0.216/32'], ['10.0.0.208/29', '10.0.0.216/32']),
+	(['10.0.0.0/24', '0.0.0.0/0', '192.168.0.1/32'], ['0.0.0.0/0']),
+])
+def test_nftables_drops_contained_networks(networks, expected):
+	[elements] = _nft_elements([_network(text) for text in networks])
+	assert [str(network) for network in elements] == expected
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_nftables_elements_never_overlap(seed):
+	rng = random.Random(seed)
+	networks, networks_v6 = [], []
+	for _ in range(300):
+		prefix = rng.randrange(16, 33)
+		address = ((10 << 24) | rng.randrange(1 << 20)) >> (32 - prefix) << (32 - prefix)
+		networks.append((address, prefix))
+		prefix = rng.randrange(96, 129)
+		networks_v6.append((((0x2001_0db8 << 96) | rng.randrange(1 << 40)) >> (128 - prefix) << (128 - prefix), prefix))
+	elements, elements_v6 = _nft_elements(networks, networks_v6)
+	for rendered, source in ((elements, networks), (elements_v6, networks_v6)):
+		_assert_disjoint(rendered)
+		# Every listed network is still covered by one element
+		source = [ipaddress.ip_network((address, prefix)) for address, prefix in source]
+		assert all(any(network.subnet_of(element) for element in rendered) for network in source)
+		assert set(rendered) <= set(source)
@@ -0,0 +1,99 @@
+import pytest
+
+from result_store import (DIRECTORY_ENTRY, HEADER, MAGIC, VERSION, ResultStore, threshold_section,
+                          write_result_store)
+
+NETWORKS = [((10 << 24) + (i << 8), 24) for i in range(0, 200, 2)]
+NETWORKS_V6 = [((0x2001_0db8 << 96) + (i << 64), 64) for i in range(50)] + [((1 << 128) - 1, 128)]
+INTERVALS = [((10 << 24) + i * 10, (10 << 24) + i * 10 + 4) for i in range(100)]
+INTERVALS_V6 = [((0x2001_0db8 << 96) + i * 10, (0x2001_0db8 << 96) + i * 10 + 4) for i in range(20)]
+SUMMARY = {'total_ips': 520, 'thresholds': [100], 'note': 'ünïcode'}
+
+
+@pytest.fixture
+def store_path(tmp_path):
+	path = str(tmp_path / 'result.ipcs')
+	write_result_store(path, SUMMARY, {threshold_section(100): NETWORKS, 'empty': []},
+	                   sections_v6={threshold_section(100, 6): NETWORKS_V6},
+	                   intervals={'hosts': INTERVALS}, intervals_v6={'hosts.v6': INTERVALS_V6})
+	return path
+
+
+def test_round_trip(store_path):
+	with ResultStore(store_path) as store:
+		assert store.summary() == SUMMARY
+		assert store.section_names() == ['t100', 'empty', 't100.v6', 'hosts', 'hosts.v6']
+		assert 't100.v6' in store and 't50' not in store
+		assert store.networks('t100') == NETWORKS
+		assert store.networks('t100.v6') == NETWORKS_V6
+		assert store.networks('empty') == []
+		assert store.intervals('hosts') == INTERVALS
+		assert store.intervals('hosts.v6') == INTERVALS_V6
+		assert store.network_strings('t100')[:2] == ['10.0.0.0/24', '10.0.2.0/24']
+		assert store.network_strings('t100.v6')[-1] == 'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff/128'
+		assert store.networks_between('t100', NETWORKS[3][0], NETWORKS[5][0]) == NETWORKS[3:6]
+		assert store.intervals_between('hosts.v6', INTERVALS_V6[2][1], INTERVALS_V6[4][0]) == INTERVALS_V6[2:5]
+		assert store.networks_between('missing', 0, 1 << 32) == []
+		with pytest.raises(KeyError):
+			store.networks('missing')
+
+
+def _write_raw(tmp_path, data):
+	path = tmp_path / 'bad.ipcs'
+	path.write_bytes(data)
+	return str(path)
+
+
+@pytest.mark.parametrize('data', [
+	b'',
+	MAGIC,
+	HEADER.pack(b'XXXX', VERSION, 0, 2, 0) + b'{}',
+	HEADER.pack(MAGIC, VERSION + 1, 0, 2, 0) + b'{}',
+	# Directory claims more sections than the file holds
+	HEADER.pack(MAGIC, VERSION, 0, 2, 3) + DIRECTORY_ENTRY.pack(b't100', 1, 0, 0),
+	HEADER.pack(MAGIC, VERSION, 0, 2, 1) + DIRECTORY_ENTRY.pack(b'\xff', 1, 0, 0) + b'{}',
+], ids=['empty', 'short-header', 'magic', 'version', 'short-directory', 'bad-name'])
+def test_corrupt_header_is_rejected(tmp_path, data):
+	with pytest.raises(ValueError, match='Not a result store'):
+		ResultStore(_write_raw(tmp_path, data))
+
+
+def test_truncated_store_is_rejected(tmp_path, store_path):
+	with open(store_path, 'rb') as f:
+		data = f.read()
+	with pytest.raises(ValueError, match='Not a result store'):
+		ResultStore(_write_raw(tmp_path, data[:HEADER.size + DIRECTORY_ENTRY.size * 2 + 5]))
+
+
+@pytest.mark.parametrize('name, networks', [('t100', NETWORKS), ('t100.v6', NETWORKS_V6)])
+def test_networks_page_offset_and_limit(store_path, name, networks):
+	with ResultStore(store_path) as store:
+		assert store.networks_page(name) == (len(networks), networks)
+		assert store.networks_page(name, offset=10, limit=5) == (len(networks), networks[10:15])
+		assert store.networks_page(name, offset=len(networks) - 2, limit=5) == (len(networks), networks[-2:])
+		assert store.networks_page(name, offset=len(networks) + 5) == (len(networks), [])
+		assert store.networks_page(name, limit=0) == (len(networks), [])
+
+
+def test_networks_page_ranges(store_path):
+	with ResultStore(store_path) as store:
+		low, high = NETWORKS[10][0], NETWORKS[19][0]
+		assert store.networks_page('t100', low, high) == (10, NETWORKS[10:20])
+		assert store.networks_page('t100', low, high, offset=8, limit=5) == (10, NETWORKS[18:20])
+		assert store.networks_page('t100', low, high, offset=10) == (10, [])
+		# Bounds between two networks still select the ones inside
+		assert store.networks_page('t100', low - 1, high + 1) == (10, NETWORKS[10:20])
+		assert store.networks_page('t100', low=NETWORKS[-3][0]) == (3, NETWORKS[-3:])
+		assert store.networks_page('t100', high=NETWORKS[2][0]) == (3, NETWORKS[:3])
+		assert store.networks_page('t100.v6', low=NETWORKS_V6[-1][0]) == (1, NETWORKS_V6[-1:])
+		assert store.networks_page('t100', low=NETWORKS[-1][0] + 1) == (0, [])
+		assert store.networks_page('empty', 0, 1 << 32) == (0, [])
+
+
+def test_networks_page_reversed_range_is_empty(store_path):
+	with ResultStore(store_path) as store:
+		assert store.networks_page('t100', NETWORKS[19][0], NETWORKS[10][0]) == (0, [])
+		assert store.networks_page('t100', NETWORKS[5][0] + 1, NETWORKS[5][0]) == (0, [])
+		assert store.networks_page('t100', NETWORKS[19][0], NETWORKS[10][0], offset=3, limit=2) == (0, [])
+		with pytest.raises(KeyError):
+			store.networks_page('missing')
@@ -0,0 +1,172 @@
+import bisect
+import random
+from array import array
+
+import pytest
+
+import core_consolidation
+from analysis import analyze_consolidation, summarize_consolidation
+from roaring import RoaringBitmap
+
+
+def _addresses(rng, kind):
+	"""Address sets that land in each kind of container, plus a mix of all three."""
+	base = rng.randrange(1 << 8) << 24
+	if kind == 'array':
+		return {base | rng.randrange(1 << 18) for _ in range(2000)}
+	if kind == 'bitmap':
+		return {base | rng.randrange(1 << 16) for _ in range(6000)}
+	if kind == 'runs':
+		addresses = set()
+		for _ in range(20):
+			start = base | rng.randrange(1 << 18)
+			addresses.update(range(start, start + rng.randrange(1, 3000)))
+		return addresses
+	return _addresses(rng, 'array') | _addresses(rng, 'bitmap') | _addresses(rng, 'runs')
+
+
+def _intervals(addresses):
+	intervals = []
+	for address in sorted(addresses):
+		if intervals and intervals[-1][1] + 1 == address:
+			intervals[-1] = (intervals[-1][0], address)
+		else:
+			intervals.append((address, address))
+	return intervals
+
+
+def _container_kinds(bitmap):
+	return {type(container) for container in bitmap._containers.values()}
+
+
+KINDS = ['array', 'bitmap', 'runs', 'mixed']
+PAIRS = [(seed, kind) for seed in range(2) for kind in KINDS]
+
+
+@pytest.mark.parametrize('kind, container', [('array', array), ('bitmap', bytearray), ('runs', list)])
+def test_container_kinds(kind, container):
+	addresses = _addresses(random.Random(0), kind)
+	assert _container_kinds(RoaringBitmap.from_intervals(_intervals(addresses))) == {container}
+
+
+@pytest.mark.parametrize('seed, kind', PAIRS)
+def test_build_and_read_back(seed, kind):
+	rng = random.Random(seed)
+	addresses = _addresses(rng, kind)
+	added = RoaringBitmap(rng.sample(sorted(addresses), len(addresses)))
+	from_intervals = RoaringBitmap.from_intervals(reversed(_intervals(addresses)))
+	ranges = RoaringBitmap()
+	for start, end in _intervals(addresses):
+		ranges.add_range(start, end)
+	for bitmap in (added, from_intervals, ranges):
+		assert len(bitmap) == len(addresses)
+		assert list(bitmap) == sorted(addresses)
+		assert bitmap.intervals() == _intervals(addresses)
+		assert bitmap == added
+	probes = rng.sample(sorted(addresses), 200) + [rng.randrange(1 << 32) for _ in range(200)]
+	for probe in probes:
+		assert (probe in from_intervals) == (probe in addresses)
+
+
+@pytest.mark.parametrize('seed, kind', PAIRS)
+def test_add_into_existing_containers(seed, kind):
+	rng = random.Random(seed)
+	addresses = _addresses(rng, kind)
+	bitmap = RoaringBitmap.from_intervals(_intervals(addresses))
+	ordered = sorted(addresses)
+	for _ in range(300):
+		start = rng.choice(ordered) + rng.randrange(-100, 100)
+		if rng.random() < 0.5:
+			assert bitmap.add(start) == (start not in addresses)
+			addresses.add(start)
+		else:
+			end = start + rng.choice([1, 10, 100, 5000])
+			bitmap.add_range(start, end)
+			addresses.update(range(start, end + 1))
+	assert list(bitmap) == sorted(addresses)
+	assert len(bitmap) == len(addresses)
+
+
+@pytest.mark.parametrize('seed, kind', PAIRS)
+def test_set_algebra(seed, kind):
+	rng = random.Random(seed)
+	first, second = _addresses(rng, kind), _addresses(rng, rng.choice(KINDS))
+	# Share some keys so containers are combined, not just copied
+	second |= set(rng.sample(sorted(first), len(first) // 2))
+	a, b = RoaringBitmap.from_intervals(_intervals(first)), RoaringBitmap.from_intervals(_intervals(second))
+	assert list(a | b) == sorted(first | second)
+	assert list(a & b) == sorted(first & second)
+	assert list(a - b) == sorted(first - second)
+	assert list(b - a) == sorted(second - first)
+	assert a.union(b) == a | b and a.intersection(b) == a & b and a.difference(b) == a - b
+	assert list(a) == sorted(first) and list(b) == sorted(second)
+	for operation, expected in (('__ior__', first | second), ('__iand__', first & second), ('__isub__', first - second)):
+		target = RoaringBitmap.from_intervals(_intervals(first))
+		# Build the running totals first, so the in-place forms must drop them
+		assert len(target) == len(first)
+		getattr(target, operation)(b)
+		assert list(target) == sorted(expected)
+		assert len(target) == len(expected)
+
+
+@pytest.mark.parametrize('seed, kind', PAIRS)
+def test_range_cardinality(seed, kind):
+	rng = random.Random(seed)
+	addresses = _addresses(rng, kind)
+	bitmap = RoaringBitmap.from_intervals(_intervals(addresses))
+	ordered = sorted(addresses)
+	for _ in range(300):
+		low, high = sorted(rng.choice(ordered) + rng.randrange(-70000, 70000) for _ in range(2))
+		assert bitmap.range_cardinality(low, high) == bisect.bisect_right(ordered, high) - bisect.bisect_left(ordered, low)
+	assert bitmap.range_cardinality(0, (1 << 32) - 1) == len(addresses)
+	assert bitmap.range_cardinality(ordered[-1], ordered[0]) == 0
+	# Adding an address invalidates the running totals
+	extra = max(addresses) + 5
+	bitmap.add(extra)
+	assert bitmap.range_cardinality(0, extra) == len(addresses) + 1
+
+
+def test_empty():
+	bitmap = RoaringBitmap()
+	assert len(bitmap) == 0 and not bitmap and list(bitmap) == [] and bitmap.intervals() == []
+	assert bitmap.range_cardinality(0, (1 << 32) - 1) == 0
+	assert RoaringBitmap.from_intervals([]) == bitmap
+	assert list(RoaringBitmap([5]) & RoaringBitmap([6])) == []
+	assert list(RoaringBitmap([5]) - RoaringBitmap([5])) == []
+
+
+def test_whole_address_space():
+	bitmap = RoaringBitmap.from_intervals([(0, (1 << 32) - 1)])
+	assert len(bitmap) == 1 << 32
+	assert bitmap.intervals() == [(0, (1 << 32) - 1)]
+	assert bitmap.range_cardinality(1 << 20, (1 << 21) - 1) == 1 << 20
+	assert bitmap.memory_bytes() == 4 << 16
+
+
+def _host_intervals(seed):
+	rng = random.Random(seed)
+	intervals = []
+	for _ in range(300):
+		start = (10 << 24) | rng.randrange(1 << 20)
+		intervals.append((start, start + rng.choice([0, 0, 0, 3, 40, 300])))
+	return intervals
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_bias_sweep_counts_hosts_from_the_bitmap(monkeypatch, seed):
+	if core_consolidation._np_backend is None:
+		pytest.skip('NumPy is not installed')
+	intervals = core_consolidation.merge_intervals(_host_intervals(seed))
+	thresholds = [0, 10, 25, 50]
+	expected = core_consolidation.consolidate_with_bias_sweep(intervals, thresholds)
+	# The pure-Python sweep counts hosts from a RoaringBitmap
+	monkeypatch.setattr(core_consolidation, '_np_backend', None)
+	assert core_consolidation.consolidate_with_bias_sweep(intervals, thresholds) == expected
+
+
+@pytest.mark.parametrize('threshold', [0, 25, 50])
+def test_analyze_consolidation_set_algebra_matches_interval_counts(threshold):
+	hosts = _host_intervals(threshold)
+	networks = core_consolidation.consolidate_with_bias(hosts, threshold)
+	expected = summarize_consolidation(networks, core_consolidation.HostIndex(core_consolidation.to_intervals(hosts)), threshold)
+	assert analyze_consolidation(hosts, threshold) == expected